@@ -0,0 +1,188 @@
+import random
+import platform
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable, Optional
+from sandbox import Sandbox
+import fasteval
+
+# whitelisted and numpy-translatable, so every backend can run it
+MATH_FN = "def blackbox(x, y):\n    return sin(x) * y + sqrt(abs(x)) / (y + 1.5)"
+
+PATHOLOGICAL = {
+    "power_tower": "def blackbox(x, y):\n    return x ** x ** x ** x",
+    "factorial": "def blackbox(x, y):\n    return factorial(x ** 6)",
+    "repeat": "def blackbox(x, y):\n    return 'a' * 10 ** x",
+    "spin": "def blackbox(x, y):\n    while True:\n        pass",
+}
+
+BACKENDS = ["oneshot", "pool", "fast", "vectorized", "cache", "bulk"]
+SIZES = [1, 10, 100, 1000]
+
+
+@contextmanager
+def backend(name: str, pool_size: int = 4):
+    """point Sandbox at one execution path, restoring its settings afterwards"""
+    saved = (
+        Sandbox.pool_size,
+        Sandbox.pool_options,
+        Sandbox.fast_eval,
+        Sandbox.vectorize_min_batch,
+        Sandbox.cache,
+    )
+    Sandbox.configure_pool(
+        0 if name == "oneshot" else pool_size, **Sandbox.pool_options
+    )
+    Sandbox.fast_eval = name in ("fast", "vectorized")
+    Sandbox.vectorize_min_batch = 1 if name == "vectorized" else 1 << 62
+    Sandbox.configure_cache(100_000 if name == "cache" else 0)
+    try:
+        yield
+    finally:
+        size, options, Sandbox.fast_eval, Sandbox.vectorize_min_batch, cache = saved
+        Sandbox.configure_pool(size, **options)
+        Sandbox.cache = cache
+
+
+def reset():
+    """drop everything warm: workers, compiled fns and cached results"""
+    Sandbox.configure_pool(Sandbox.pool_size, **Sandbox.pool_options)
+    fasteval.compile_fn.cache_clear()
+    if Sandbox.cache is not None:
+        Sandbox.cache.clear()
+
+
+def inputs(rng: random.Random, n: int) -> list[dict]:
+    return [
+        {"x": round(rng.uniform(-100, 100), 1), "y": rng.randint(0, 50)}
+        for _ in range(n)
+    ]
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(run: Callable[[], int], repeat: int, setup: Callable = lambda: None):
+    """time `repeat` runs of `run`, which returns how many inputs it evaluated"""
+    samples, evaluated = [], 0
+    for _ in range(repeat):
+        setup()
+        start = perf_counter()
+        evaluated += run()
+        samples.append(perf_counter() - start)
+
+    total = sum(samples)
+    return {
+        "repeat": repeat,
+        "p50_ms": percentile(samples, 0.5) * 1e3,
+        "p90_ms": percentile(samples, 0.9) * 1e3,
+        "p99_ms": percentile(samples, 0.99) * 1e3,
+        "mean_ms": total / repeat * 1e3,
+        "max_ms": max(samples) * 1e3,
+        "inputs_per_s": evaluated / total if total else 0.0,
+    }
+
+
+def scenarios(name: str, rng: random.Random, repeat: int):
+    """(scenario, run, repeat, setup) for one backend"""
+
+    def batch(n: int, pending: list[list[dict]]) -> Callable[[], int]:
+        def run() -> int:
+            kwargs_list = pending.pop()
+            if name == "bulk":
+                columns = {k: [kw[k] for kw in kwargs_list] for k in ("x", "y")}
+                Sandbox.local_bulk(MATH_FN, columns)
+            else:
+                Sandbox.local_batch(MATH_FN, kwargs_list)
+            return n
+
+        return run
+
+    for n in SIZES:
+        runs = repeat if n < 1000 else max(1, repeat // 10)
+        if name == "cache":
+            # every run after the first asks for the same inputs again
+            fixed = inputs(rng, n)
+            Sandbox.local_batch(MATH_FN, fixed)
+            pending = [fixed] * runs
+        else:
+            pending = [inputs(rng, n) for _ in range(runs)]
+        scenario = "single" if n == 1 else f"batch_{n}"
+        yield scenario, batch(n, pending), runs, lambda: None
+
+    for case, fn in PATHOLOGICAL.items():
+
+        def pathological(fn=fn) -> int:
+            result = Sandbox.local(fn, {"x": 10, "y": 1})
+            assert result.is_err(), result
+            return 1
+
+        yield f"pathological_{case}", pathological, max(1, repeat // 10), lambda: None
+
+    def cold() -> int:
+        Sandbox.local(MATH_FN, inputs(rng, 1)[0])
+        return 1
+
+    yield "cold", cold, max(1, repeat // 10), reset
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    backends: Optional[list[str]] = None, repeat: int = 20, seed: int = 0
+) -> dict:
+    """benchmark every backend offline, returns a json-serializable report"""
+    rng = random.Random(seed)
+    results = []
+    for name in backends or BACKENDS:
+        with backend(name):
+            reset()
+            Sandbox.local(MATH_FN, inputs(rng, 1)[0])
+            for scenario, run, runs, setup in scenarios(name, rng, repeat):
+                stats = measure(run, runs, setup)
+                results.append({"backend": name, "scenario": scenario, **stats})
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> list[dict]:
+    """p50 ratio per (backend, scenario) present in both reports, >1 is slower"""
+    before = {(r["backend"], r["scenario"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        old = before.get((r["backend"], r["scenario"]))
+        if old is None or not old["p50_ms"]:
+            continue
+        rows.append(
+            {
+                "backend": r["backend"],
+                "scenario": r["scenario"],
+                "baseline_p50_ms": old["p50_ms"],
+                "p50_ms": r["p50_ms"],
+                "ratio": r["p50_ms"] / old["p50_ms"],
+            }
+        )
+    return rows
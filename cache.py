@@ -0,0 +1,96 @@
+import ast
+from collections import OrderedDict
+from functools import lru_cache
+from json import dumps
+from threading import Lock
+from typing import Optional
+from result import Result
+import xxhash
+
+
+@lru_cache(maxsize=4096)
+def source_hash(fn: str) -> str:
+    """hash of the function with comments and formatting normalized away"""
+    try:
+        source = ast.unparse(ast.parse(fn))
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # too deeply nested to normalize, hash the text as it is
+        source = fn.strip()
+    return xxhash.xxh64(source.encode()).hexdigest()
+
+
+def canonical(kwargs) -> Optional[str]:
+    try:
+        return dumps(kwargs, sort_keys=True, allow_nan=True)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultCache:
+    """process-wide LRU of sandbox results keyed on (fn hash, canonical kwargs)
+
+    entries are `Ok`/`Err` results, so a cached error stays an error"""
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 64 * 1024**2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple[Result, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get_many(self, fn: str, kwargs_list: list) -> list[Optional[Result]]:
+        digest = source_hash(fn)
+        found = []
+        with self.lock:
+            for kwargs in kwargs_list:
+                key = (digest, canonical(kwargs))
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    found.append(None)
+                else:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    found.append(entry[0])
+        return found
+
+    def put_many(self, fn: str, kwargs_list: list, results: list[Result]):
+        digest = source_hash(fn)
+        with self.lock:
+            for kwargs, result in zip(kwargs_list, results):
+                args = canonical(kwargs)
+                if args is None:
+                    continue
+                key = (digest, args)
+                size = len(args) + len(repr(result)) + 128
+                if key in self.entries:
+                    self.bytes -= self.entries.pop(key)[1]
+                self.entries[key] = (result, size)
+                self.bytes += size
+
+            while self.entries and (
+                len(self.entries) > self.max_entries or self.bytes > self.max_bytes
+            ):
+                _, (_, size) = self.entries.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
@@ -0,0 +1,108 @@
+import asyncio
+import shlex
+from time import monotonic
+from typing import Optional
+
+# 128+SIGKILL, what `timeout -s KILL` exits with once it fires
+KILLED = 137
+
+
+class Capture:
+    """keeps the first and last max_bytes/2 of a stream, counting what's dropped"""
+
+    def __init__(self, max_bytes: int):
+        self.head_limit = max_bytes - max_bytes // 2
+        self.tail_limit = max_bytes // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def feed(self, chunk: bytes):
+        self.total += len(chunk)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_limit:
+            self.tail += chunk
+            if len(self.tail) > self.tail_limit:
+                del self.tail[: len(self.tail) - self.tail_limit]
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode(errors="replace")
+        tail = self.tail.decode(errors="replace")
+        if not self.dropped:
+            return head + tail
+        return f"{head}\n[... {self.dropped} bytes truncated ...]\n{tail}"
+
+
+class Output:
+    """stdout / stderr of one command plus how it ended"""
+
+    def __init__(self, max_bytes: int):
+        self.stdout = Capture(max_bytes)
+        self.stderr = Capture(max_bytes)
+        self.exit_code: Optional[int] = None
+        self.timed_out = False
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.stdout.dropped or self.stderr.dropped)
+
+    def metadata(self) -> dict:
+        return {
+            "exit_code": self.exit_code,
+            "timed_out": self.timed_out,
+            "truncated": self.truncated,
+            "stdout_bytes": self.stdout.total,
+            "stderr_bytes": self.stderr.total,
+        }
+
+
+def remote_command(command: str, timeout: float) -> str:
+    """`sh -c command` killed on the far side after `timeout` seconds, since
+    killing the local flyctl / docker exec / ssh client leaves it running;
+    timeout 0 would mean no limit at all, so zero kills right away instead"""
+    return f"timeout -s KILL {max(timeout, 0.001):g} sh -c {shlex.quote(command)}"
+
+
+async def drain(stream, capture: Capture):
+    while chunk := await stream.read(65536):
+        capture.feed(chunk if isinstance(chunk, bytes) else chunk.encode())
+
+
+async def run_process(argv: list[str], timeout: float, max_bytes: int) -> Output:
+    """run a local client (flyctl, docker, sh) whose command is already wrapped
+    in remote_command; the client itself gets a few seconds of grace"""
+    output = Output(max_bytes)
+    start = monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                drain(proc.stdout, output.stdout),
+                drain(proc.stderr, output.stderr),
+                proc.wait(),
+            ),
+            timeout + 5,
+        )
+    except TimeoutError:
+        output.timed_out = True
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+    output.exit_code = proc.returncode
+    if output.exit_code == KILLED and monotonic() - start >= timeout:
+        output.timed_out = True
+    return output
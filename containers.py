@@ -0,0 +1,143 @@
+import asyncio
+from json import loads
+from typing import Optional
+from capture import Output, remote_command, run_process
+from uuid import uuid4
+
+# same hardening as old/sandbox.py's sandbox_docker, except /workspace (a
+# tmpfs the agent can write) and a pids limit a shell session can live with
+HARDENING = [
+    "--network=none",
+    "--cpus=1",
+    "--ulimit",
+    "fsize=1048576:1048576",
+    "--security-opt",
+    "no-new-privileges",
+    "--tmpfs",
+    "/tmp:rw,noexec,nosuid,nodev,size=10m",
+    "--cap-drop=ALL",
+]
+LABEL = "unboxer=sandbox"
+
+
+class ContainerError(Exception):
+    pass
+
+
+class ContainerAPI:
+    """runs sandbox.Dockerfile locally through docker or podman behind the same
+    interface as MachinesAPI, so Sandbox and SandboxPool work unchanged"""
+
+    def __init__(
+        self,
+        runtime: str = "docker",
+        image: str = "unboxer-sandbox",
+        pids_limit: int = 64,
+        workspace_mb: int = 256,
+    ):
+        self.runtime = runtime
+        self.image = image
+        self.pids_limit = pids_limit
+        self.workspace_mb = workspace_mb
+
+    async def cli(self, *args: str, stdin: Optional[bytes] = None) -> tuple[str, str]:
+        proc = await asyncio.create_subprocess_exec(
+            self.runtime,
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate(stdin)
+        if proc.returncode != 0:
+            raise ContainerError(
+                f"{self.runtime} {args[0]} failed: {stderr.decode().strip()}"
+            )
+        return stdout.decode(), stderr.decode()
+
+    async def create_volume(self, payload: dict) -> dict:
+        """/workspace is a tmpfs inside the container, nothing to create"""
+        return {"id": payload["name"], "name": payload["name"]}
+
+    async def create_machine(self, payload: dict) -> dict:
+        name = payload.get("name") or f"sandbox_{uuid4().hex[:6]}"
+        memory_mb = payload.get("config", {}).get("guest", {}).get("memory_mb", 512)
+        stdout, _ = await self.cli(
+            "run",
+            "-d",
+            "--name",
+            name,
+            "--label",
+            LABEL,
+            f"--memory={memory_mb}m",
+            f"--pids-limit={self.pids_limit}",
+            *HARDENING,
+            "--tmpfs",
+            f"/workspace:rw,nosuid,nodev,size={self.workspace_mb}m,mode=1777",
+            "--entrypoint",
+            "sleep",
+            self.image,
+            "infinity",
+        )
+        return {"id": stdout.strip()[:12], "name": name}
+
+    async def inspect(self, *ids: str) -> list[dict]:
+        if not ids:
+            return []
+        stdout, _ = await self.cli("inspect", *ids)
+        return loads(stdout)
+
+    def record(self, info: dict) -> dict:
+        status = info["State"]["Status"]
+        return {
+            "id": info["Id"][:12],
+            "name": info["Name"].lstrip("/"),
+            "state": "started" if status == "running" else status,
+            "created_at": info["Created"],
+        }
+
+    async def get_machine(self, machine_id: str) -> dict:
+        return self.record((await self.inspect(machine_id))[0])
+
+    async def wait_for_state(
+        self, machine_id: str, state: str, timeout: float = 60
+    ) -> bool:
+        """`run -d` returns once the container is up, so one look is enough"""
+        return (await self.get_machine(machine_id))["state"] == state
+
+    async def list_machines(self) -> list[dict]:
+        stdout, _ = await self.cli("ps", "-aq", "--filter", f"label={LABEL}")
+        return [self.record(info) for info in await self.inspect(*stdout.split())]
+
+    async def list_volumes(self) -> list[dict]:
+        return []
+
+    async def delete_machine(self, machine_id: str, force: bool = True):
+        try:
+            await self.cli("rm", "-f", machine_id)
+        except ContainerError:
+            pass
+
+    async def delete_volume(self, volume_id: str):
+        pass
+
+    def ssh_host(self, machine_id: str) -> Optional[str]:
+        return None
+
+    async def exec(
+        self, machine_id: str, command: str, timeout: float, max_bytes: int
+    ) -> Output:
+        return await run_process(
+            [
+                self.runtime,
+                "exec",
+                "-w",
+                "/workspace",
+                machine_id,
+                "sh",
+                "-c",
+                remote_command(command, timeout),
+            ],
+            timeout,
+            max_bytes,
+        )
@@ -1,50 +1,277 @@
+import asyncio
 import asyncpg
+import json
+from datetime import datetime
 from os import environ
+from pathlib import Path
+from time import monotonic
 from typing import Optional
+from trajectory import Trajectory
+import trajectory as trajectories
+import zstandard
+
+# one LIST partition per train_run so a run's writes and lookups touch only
+# its own table, and old runs can be detached and archived whole
+ROLLOUTS_SCHEMA = """
+    CREATE SEQUENCE IF NOT EXISTS unboxer.rollouts_id_seq;
+    CREATE TABLE IF NOT EXISTS unboxer.rollouts (
+        id INTEGER NOT NULL DEFAULT nextval('unboxer.rollouts_id_seq'),
+        train_run INTEGER NOT NULL,
+        train_step INTEGER NOT NULL,
+        train_commit TEXT DEFAULT NULL,
+        rollout_name TEXT NOT NULL,
+        blackbox TEXT NOT NULL,
+        reward REAL DEFAULT 0.0,
+        solved BOOLEAN DEFAULT FALSE,
+        num_turns INTEGER DEFAULT 0,
+        trajectory JSONB DEFAULT NULL,
+        logs JSONB DEFAULT '[]'::jsonb,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, train_run)
+    ) PARTITION BY LIST (train_run);
+    CREATE INDEX IF NOT EXISTS idx_rollouts_train_run ON unboxer.rollouts(train_run);
+    CREATE INDEX IF NOT EXISTS idx_rollouts_solved ON unboxer.rollouts(solved);
+    CREATE INDEX IF NOT EXISTS idx_rollouts_created_at ON unboxer.rollouts(created_at DESC);
+    CREATE TABLE IF NOT EXISTS unboxer.train_runs (
+        train_run INTEGER PRIMARY KEY,
+        train_commit TEXT DEFAULT NULL,
+        partition TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT NULL,
+        archive_path TEXT DEFAULT NULL
+    );
+"""
+# the pre-partitioning table, attached as the DEFAULT partition by migrate()
+LEGACY_TABLE = "rollouts_legacy"
+# get_next_train_run reads only the registry, so a database that has rollouts
+# but was never migrated registers its runs first. rows still in the plain
+# table are the ones migrate() will keep in the legacy partition
+BACKFILL_RUNS = f"""
+    INSERT INTO unboxer.train_runs (train_run, partition)
+    SELECT DISTINCT
+        COALESCE(r.train_run, -1),
+        CASE WHEN c.relname = 'rollouts' THEN '{LEGACY_TABLE}' ELSE c.relname END
+    FROM unboxer.rollouts r
+    JOIN pg_class c ON c.oid = r.tableoid
+    WHERE NOT EXISTS (SELECT 1 FROM unboxer.train_runs)
+    ON CONFLICT DO NOTHING
+"""
+
+
+def partition_name(train_run: int) -> str:
+    run = int(train_run)
+    return f"rollouts_run_{run}" if run >= 0 else f"rollouts_run_neg{-run}"
+
+
+# events get their own append-only table instead of `logs = logs || ...`,
+# which rewrote the rollout's whole jsonb blob and left a dead tuple per event.
+# no foreign key, so appends never lock or look up the parent row
+EVENTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS unboxer.rollout_events (
+        rollout_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        data JSONB NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (rollout_id, seq)
+    );
+    CREATE OR REPLACE VIEW unboxer.rollout_logs AS
+    SELECT
+        r.id AS rollout_id,
+        r.logs || COALESCE(
+            (
+                SELECT jsonb_agg(
+                    jsonb_build_object(
+                        'timestamp', to_char(e.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US'),
+                        'event', e.event,
+                        'data', e.data
+                    )
+                    ORDER BY e.seq
+                )
+                FROM unboxer.rollout_events e
+                WHERE e.rollout_id = r.id
+            ),
+            '[]'::jsonb
+        ) AS logs
+    FROM unboxer.rollouts r;
+"""
+# trajectories default to a zstd blob next to a small jsonb summary. the blob
+# is stored EXTERNAL so postgres doesn't try to pglz it again, and old
+# databases pick the columns up in place
+TRAJECTORY_SCHEMA = """
+    ALTER TABLE unboxer.rollouts ADD COLUMN IF NOT EXISTS trajectory_zstd BYTEA DEFAULT NULL;
+    ALTER TABLE unboxer.rollouts ADD COLUMN IF NOT EXISTS trajectory_summary JSONB DEFAULT NULL;
+    ALTER TABLE unboxer.rollouts ALTER COLUMN trajectory_zstd SET STORAGE EXTERNAL;
+"""
+
+# per (train_run, blackbox) reward totals kept current by add_rollout /
+# update_reward, so the curriculum window reads a few recent rows instead of
+# aggregating every rollout. a NULL train_run is stored as -1, below any real run
+STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS unboxer.blackbox_stats (
+        train_run INTEGER NOT NULL,
+        blackbox_hash TEXT NOT NULL,
+        blackbox TEXT NOT NULL,
+        rollouts INTEGER NOT NULL DEFAULT 0,
+        reward_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        latest_created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (train_run, blackbox_hash)
+    );
+    CREATE INDEX IF NOT EXISTS idx_blackbox_stats_recency
+        ON unboxer.blackbox_stats(latest_created_at DESC);
+"""
+BACKFILL_STATS = """
+    INSERT INTO unboxer.blackbox_stats
+        (train_run, blackbox_hash, blackbox, rollouts, reward_sum, latest_created_at)
+    SELECT COALESCE(train_run, -1), md5(blackbox), blackbox, COUNT(*), SUM(reward), MAX(created_at)
+    FROM unboxer.rollouts
+    GROUP BY COALESCE(train_run, -1), blackbox
+    ON CONFLICT DO NOTHING
+"""
+# how many recent summary rows the window looks at per row it returns; a
+# blackbox reused across runs shows up once per run it appeared in
+WINDOW_SCAN_FACTOR = 4
+
+# insert_rollouts columns in table order, with what a row may leave out
+ROLLOUT_COLUMNS = {
+    "id": None,
+    "train_run": None,
+    "train_step": None,
+    "train_commit": None,
+    "rollout_name": None,
+    "blackbox": None,
+    "reward": 0.0,
+    "trajectory": None,
+    "trajectory_zstd": None,
+    "trajectory_summary": None,
+    "num_turns": 0,
+    "solved": False,
+}
+EVENT_COLUMNS = ["rollout_id", "seq", "event", "data", "created_at"]
+
+
+def open_db(
+    dsn: Optional[str] = None,
+    path: Optional[str] = None,
+    driver: Optional[str] = None,
+    **options,
+) -> "RolloutsDB":
+    """postgres when there's a dsn (or POSTGRES), else the embedded local
+    database at `path` (or UNBOXER_DB, default ./unboxer.db) through
+    `driver` (or UNBOXER_DB_DRIVER, default sqlite3)"""
+    dsn = dsn or environ.get("POSTGRES")
+    if dsn:
+        return RolloutsDB(dsn=dsn, **options)
+
+    from localdb import LocalRolloutsDB
+
+    return LocalRolloutsDB(
+        path or environ.get("UNBOXER_DB", "unboxer.db"),
+        driver=driver or environ.get("UNBOXER_DB_DRIVER", "sqlite3"),
+        **options,
+    )
+
+
+async def export_csv(path: Path, copy, *args, **kwargs) -> int:
+    """stream a COPY ... TO STDOUT (csv with header) through zstd into `path`,
+    returning the row count; restore with zstd -d and COPY ... FROM"""
+    with path.open("wb") as f, zstandard.ZstdCompressor().stream_writer(f) as out:
+
+        async def write(chunk: bytes):
+            out.write(chunk)
+
+        status = await copy(*args, output=write, format="csv", header=True, **kwargs)
+    return int(status.split()[-1])
 
 
 class RolloutsDB:
-    def __init__(self, dsn: Optional[str] = None):
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        window_ttl: float = 5.0,
+        trajectory_storage: str = "zstd",
+    ):
         self.dsn = dsn or environ.get("POSTGRES")
         if not self.dsn:
             raise ValueError("POSTGRES connection string not found in environment")
+        if trajectory_storage not in trajectories.STORAGE_MODES:
+            raise ValueError(f"unknown trajectory_storage {trajectory_storage}")
+        self.trajectory_storage = trajectory_storage
         self.pool: Optional[asyncpg.Pool] = None
+        # next event seq of each rollout still running in this process
+        self.seqs: dict[int, int] = {}
+        self.pending_events: list[tuple] = []
+        self.waiters: list[asyncio.Future] = []
+        self.flusher: Optional[asyncio.Task] = None
+        self.window_ttl = window_ttl
+        self.window_cache: dict[int, tuple[float, list[dict]]] = {}
+        self.train_run: Optional[int] = None
 
     @staticmethod
     async def migrate(dsn: Optional[str] = None):
-        """run migration once before training starts"""
+        """run once before training starts; never drops data. a plain
+        rollouts table from before partitioning becomes the DEFAULT partition
+        of the partitioned one, keeping its rows and ids"""
         connection_string = dsn or environ.get("POSTGRES")
         if not connection_string:
             raise ValueError("POSTGRES connection string not found in environment")
 
         conn = await asyncpg.connect(connection_string)
         try:
-            await conn.execute("DROP SCHEMA IF EXISTS unboxer CASCADE")
-            await conn.execute("CREATE SCHEMA unboxer")
-            await conn.execute("""
-                CREATE TABLE unboxer.rollouts (
-                    id SERIAL PRIMARY KEY,
-                    train_run INTEGER DEFAULT NULL,
-                    train_step INTEGER NOT NULL,
-                    train_commit TEXT DEFAULT NULL,
-                    rollout_name TEXT NOT NULL,
-                    blackbox TEXT NOT NULL,
-                    reward REAL DEFAULT 0.0,
-                    solved BOOLEAN DEFAULT FALSE,
-                    num_turns INTEGER DEFAULT 0,
-                    trajectory JSONB DEFAULT NULL,
-                    logs JSONB DEFAULT '[]'::jsonb,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            await conn.execute("CREATE SCHEMA IF NOT EXISTS unboxer")
+            async with conn.transaction():
+                plain = await conn.fetchval(
+                    "SELECT relkind = 'r' FROM pg_class WHERE oid = to_regclass('unboxer.rollouts')"
                 )
-            """)
-            await conn.execute("""
-                CREATE INDEX idx_rollouts_train_run ON unboxer.rollouts(train_run);
-                CREATE INDEX idx_rollouts_solved ON unboxer.rollouts(solved);
-                CREATE INDEX idx_rollouts_created_at ON unboxer.rollouts(created_at DESC);
-            """)
+                if plain:
+                    await RolloutsDB.partition_legacy(conn)
+                await RolloutsDB.create_schema(conn)
         finally:
             await conn.close()
 
+    @staticmethod
+    async def partition_legacy(conn):
+        # NULL runs move to -1 (the stats table's "no run"), since the
+        # partition key has to be part of the primary key
+        await conn.execute(TRAJECTORY_SCHEMA)
+        await conn.execute(f"""
+            ALTER TABLE unboxer.rollouts RENAME TO {LEGACY_TABLE};
+            ALTER SEQUENCE unboxer.rollouts_id_seq OWNED BY NONE;
+            ALTER INDEX IF EXISTS unboxer.idx_rollouts_train_run RENAME TO idx_rollouts_legacy_train_run;
+            ALTER INDEX IF EXISTS unboxer.idx_rollouts_solved RENAME TO idx_rollouts_legacy_solved;
+            ALTER INDEX IF EXISTS unboxer.idx_rollouts_created_at RENAME TO idx_rollouts_legacy_created_at;
+            UPDATE unboxer.{LEGACY_TABLE} SET train_run = -1 WHERE train_run IS NULL;
+            ALTER TABLE unboxer.{LEGACY_TABLE} ALTER COLUMN train_run SET NOT NULL;
+            ALTER TABLE unboxer.{LEGACY_TABLE} DROP CONSTRAINT rollouts_pkey;
+            ALTER TABLE unboxer.{LEGACY_TABLE} ADD PRIMARY KEY (id, train_run);
+        """)
+        # proves no future run lands here, so creating a run's partition
+        # doesn't have to scan the legacy rows
+        last_run = await conn.fetchval(
+            f"SELECT COALESCE(MAX(train_run), 0) FROM unboxer.{LEGACY_TABLE}"
+        )
+        await conn.execute(f"""
+            ALTER TABLE unboxer.{LEGACY_TABLE}
+                ADD CONSTRAINT {LEGACY_TABLE}_runs CHECK (train_run <= {int(last_run)})
+        """)
+        await conn.execute(ROLLOUTS_SCHEMA)
+        await conn.execute(TRAJECTORY_SCHEMA)
+        await conn.execute(f"""
+            ALTER TABLE unboxer.rollouts ATTACH PARTITION unboxer.{LEGACY_TABLE} DEFAULT;
+            INSERT INTO unboxer.train_runs (train_run, partition)
+            SELECT DISTINCT train_run, '{LEGACY_TABLE}' FROM unboxer.{LEGACY_TABLE}
+            ON CONFLICT DO NOTHING;
+        """)
+
+    @staticmethod
+    async def create_schema(conn):
+        await conn.execute("CREATE SCHEMA IF NOT EXISTS unboxer")
+        await conn.execute(ROLLOUTS_SCHEMA)
+        await conn.execute(TRAJECTORY_SCHEMA)
+        await conn.execute(EVENTS_SCHEMA)
+        await conn.execute(STATS_SCHEMA)
+        await conn.execute(BACKFILL_RUNS)
+
     async def connect(self):
         self.pool = await asyncpg.create_pool(self.dsn)
         await self.init_schema()
@@ -53,28 +280,54 @@ class RolloutsDB:
     async def init_schema(self):
         """ensure schema exists (idempotent, no migration)"""
         async with self.pool.acquire() as conn:
-            await conn.execute("CREATE SCHEMA IF NOT EXISTS unboxer")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS unboxer.rollouts (
-                    id SERIAL PRIMARY KEY,
-                    train_run INTEGER DEFAULT NULL,
-                    train_step INTEGER NOT NULL,
-                    train_commit TEXT DEFAULT NULL,
-                    rollout_name TEXT NOT NULL,
-                    blackbox TEXT NOT NULL,
-                    reward REAL DEFAULT 0.0,
-                    solved BOOLEAN DEFAULT FALSE,
-                    num_turns INTEGER DEFAULT 0,
-                    trajectory JSONB DEFAULT NULL,
-                    logs JSONB DEFAULT '[]'::jsonb,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_rollouts_train_run ON unboxer.rollouts(train_run);
-                CREATE INDEX IF NOT EXISTS idx_rollouts_solved ON unboxer.rollouts(solved);
-                CREATE INDEX IF NOT EXISTS idx_rollouts_created_at ON unboxer.rollouts(created_at DESC);
-            """)
+            await self.create_schema(conn)
+            # first start against a database that predates the summary table
+            empty = await conn.fetchval(
+                """SELECT NOT EXISTS (SELECT 1 FROM unboxer.blackbox_stats)
+                   AND EXISTS (SELECT 1 FROM unboxer.rollouts)"""
+            )
+            if empty:
+                await conn.execute(BACKFILL_STATS)
+
+    async def start_train_run(self, train_run: int, train_commit: Optional[str] = None):
+        """register the run and give it its own partition; later updates and
+        reads from this instance only look in that partition"""
+        table = partition_name(train_run)
+        async with self.pool.acquire() as conn, conn.transaction():
+            # one creator at a time when several envs start the same run
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", train_run)
+            partitioned = await conn.fetchval(
+                "SELECT relkind = 'p' FROM pg_class WHERE oid = 'unboxer.rollouts'::regclass"
+            )
+            registered = await conn.fetchval(
+                "SELECT partition FROM unboxer.train_runs WHERE train_run = $1",
+                train_run,
+            )
+            if registered == LEGACY_TABLE:
+                # a run resumed from before the migration keeps living there
+                table = LEGACY_TABLE
+            elif partitioned:
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS unboxer.{table}
+                        PARTITION OF unboxer.rollouts FOR VALUES IN ({int(train_run)})
+                """)
+            else:
+                # not migrated yet, these rows become part of the legacy partition
+                table = LEGACY_TABLE
+            await conn.execute(
+                """INSERT INTO unboxer.train_runs (train_run, train_commit, partition)
+                   VALUES ($1, $2, $3) ON CONFLICT DO NOTHING""",
+                train_run,
+                train_commit,
+                table,
+            )
+        self.train_run = train_run
+
+    def run_filter(self) -> str:
+        """pins a by-id lookup to the current run's partition"""
+        if self.train_run is None:
+            return ""
+        return f" AND train_run = {int(self.train_run)}"
 
     async def add_rollout(
         self,
@@ -85,12 +338,12 @@ class RolloutsDB:
         train_run: Optional[int] = None,
         train_commit: Optional[str] = None,
     ) -> int:
-        async with self.pool.acquire() as conn:
+        async with self.pool.acquire() as conn, conn.transaction():
             row = await conn.fetchrow(
                 """
                 INSERT INTO unboxer.rollouts (train_run, train_step, train_commit, rollout_name, blackbox, reward)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                RETURNING id
+                VALUES (COALESCE($1, -1), $2, $3, $4, $5, $6)
+                RETURNING id, train_run, blackbox, reward, created_at
                 """,
                 train_run,
                 train_step,
@@ -99,14 +352,89 @@ class RolloutsDB:
                 blackbox,
                 reward,
             )
-            return row["id"]
+            await self.add_stats(conn, [row])
+        self.begin_events(row["id"])
+        return row["id"]
 
-    async def update_reward(self, rollout_id: int, reward: float):
+    async def reserve_rollout_ids(self, n: int) -> list[int]:
+        """ids for insert_rollouts, so writers can hand one out before the row exists"""
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE unboxer.rollouts SET reward = $1 WHERE id = $2",
-                reward,
-                rollout_id,
+            rows = await conn.fetch(
+                "SELECT nextval('unboxer.rollouts_id_seq') AS id FROM generate_series(1, $1)",
+                n,
+            )
+            return [row["id"] for row in rows]
+
+    async def insert_rollouts(self, rows: list[dict]):
+        """multi-row add_rollout for rows with reserved ids; a row may already
+        carry its final reward, trajectory_columns(), num_turns and solved"""
+        columns = [
+            [row.get(key, default) for row in rows]
+            for key, default in ROLLOUT_COLUMNS.items()
+        ]
+        async with self.pool.acquire() as conn, conn.transaction():
+            inserted = await conn.fetch(
+                """
+                INSERT INTO unboxer.rollouts
+                    (id, train_run, train_step, train_commit, rollout_name, blackbox, reward,
+                     trajectory, trajectory_zstd, trajectory_summary, num_turns, solved)
+                SELECT * FROM unnest(
+                    $1::int[], $2::int[], $3::int[], $4::text[], $5::text[], $6::text[],
+                    $7::real[], $8::jsonb[], $9::bytea[], $10::jsonb[], $11::int[], $12::bool[]
+                )
+                RETURNING id, train_run, blackbox, reward, created_at
+                """,
+                *columns,
+            )
+            await self.add_stats(conn, inserted)
+
+    @staticmethod
+    async def add_stats(conn, rows: list):
+        """fold freshly inserted rollouts into blackbox_stats"""
+        totals: dict[tuple, list] = {}
+        for row in rows:
+            key = (row["train_run"], row["blackbox"])
+            total = totals.setdefault(key, [0, 0.0, row["created_at"]])
+            total[0] += 1
+            total[1] += row["reward"]
+            total[2] = max(total[2], row["created_at"])
+        await conn.executemany(
+            """
+            INSERT INTO unboxer.blackbox_stats AS s
+                (train_run, blackbox_hash, blackbox, rollouts, reward_sum, latest_created_at)
+            VALUES (COALESCE($1, -1), md5($2), $2, $3, $4, $5)
+            ON CONFLICT (train_run, blackbox_hash) DO UPDATE SET
+                rollouts = s.rollouts + EXCLUDED.rollouts,
+                reward_sum = s.reward_sum + EXCLUDED.reward_sum,
+                latest_created_at = GREATEST(s.latest_created_at, EXCLUDED.latest_created_at)
+            """,
+            [(run, blackbox, *total) for (run, blackbox), total in totals.items()],
+        )
+
+    async def update_reward(self, rollout_id: int, reward: float):
+        await self.update_rewards([(rollout_id, reward)])
+
+    async def update_rewards(self, rewards: list[tuple[int, float]]):
+        """set (rollout_id, reward) pairs, moving each summary row by the
+        difference from the old reward"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.executemany(
+                f"""
+                WITH old AS (
+                    SELECT id, train_run, blackbox, reward
+                    FROM unboxer.rollouts WHERE id = $1{self.run_filter()} FOR UPDATE
+                ),
+                updated AS (
+                    UPDATE unboxer.rollouts r SET reward = $2::real
+                    FROM old WHERE r.id = old.id AND r.train_run = old.train_run
+                    RETURNING old.train_run, old.blackbox, old.reward AS old_reward
+                )
+                UPDATE unboxer.blackbox_stats s
+                SET reward_sum = s.reward_sum + $2::real - u.old_reward
+                FROM updated u
+                WHERE s.train_run = COALESCE(u.train_run, -1) AND s.blackbox_hash = md5(u.blackbox)
+                """,
+                rewards,
             )
 
     async def update_trajectory(
@@ -115,19 +443,65 @@ class RolloutsDB:
         trajectory: list,
         num_turns: int,
         solved: bool,
+        tokens: Optional[dict] = None,
     ):
-        import json
+        await self.update_trajectories(
+            [
+                (
+                    rollout_id,
+                    *self.trajectory_columns(trajectory, tokens).values(),
+                    num_turns,
+                    solved,
+                )
+            ]
+        )
+
+    def trajectory_columns(
+        self, trajectory: list, tokens: Optional[dict] = None
+    ) -> dict:
+        """trajectory / trajectory_zstd / trajectory_summary values for
+        `trajectory_storage`; the summary is kept in every mode"""
+        summary = json.dumps(trajectories.summarize(trajectory, tokens))
+        return {
+            "trajectory": json.dumps(trajectory)
+            if self.trajectory_storage == "jsonb"
+            else None,
+            "trajectory_zstd": trajectories.encode(trajectory)
+            if self.trajectory_storage == "zstd"
+            else None,
+            "trajectory_summary": summary,
+        }
 
+    async def update_trajectories(self, rows: list[tuple]):
+        """(rollout_id, trajectory, trajectory_zstd, trajectory_summary,
+        num_turns, solved) per row"""
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                """UPDATE unboxer.rollouts 
-                   SET trajectory = $1, num_turns = $2, solved = $3 
-                   WHERE id = $4""",
-                json.dumps(trajectory),
-                num_turns,
-                solved,
+            await conn.executemany(
+                f"""UPDATE unboxer.rollouts 
+                   SET trajectory = $2, trajectory_zstd = $3, trajectory_summary = $4,
+                       num_turns = $5, solved = $6 
+                   WHERE id = $1{self.run_filter()}""",
+                rows,
+            )
+
+    async def get_trajectory(self, rollout_id: int) -> Optional[Trajectory]:
+        """summary right away, messages decompressed only if they're read"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                f"""SELECT trajectory, trajectory_zstd, trajectory_summary
+                   FROM unboxer.rollouts WHERE id = $1{self.run_filter()}""",
                 rollout_id,
             )
+        if row is None:
+            return None
+        summary = row["trajectory_summary"]
+        return Trajectory(
+            json.loads(summary) if summary is not None else None,
+            blob=row["trajectory_zstd"],
+            messages=json.loads(row["trajectory"])
+            if row["trajectory"] is not None
+            else None,
+        )
 
     async def append_log(
         self,
@@ -135,66 +509,200 @@ class RolloutsDB:
         event: str,
         data: dict,
     ):
-        import json
-        from datetime import datetime
+        """insert one event row; events logged while a write is in flight are
+        committed together in the next COPY, so callers still wait for their
+        row to land but concurrent rollouts share round trips"""
+        self.pending_events.append(await self.event_record(rollout_id, event, data))
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_events())
+        await waiter
 
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "event": event,
-            "data": data,
-        }
+    def begin_events(self, rollout_id: int):
+        """a rollout added by this process has no events yet"""
+        self.seqs[rollout_id] = 0
+
+    def end_events(self, rollout_id: int):
+        """forget a finished rollout's seq; logging to it again re-reads it"""
+        self.seqs.pop(rollout_id, None)
+
+    async def next_seq(self, rollout_id: int) -> int:
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                """UPDATE unboxer.rollouts 
-                   SET logs = logs || $1::jsonb 
-                   WHERE id = $2""",
-                json.dumps([log_entry]),
+            return await conn.fetchval(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM unboxer.rollout_events "
+                "WHERE rollout_id = $1",
                 rollout_id,
             )
 
+    async def event_record(self, rollout_id: int, event: str, data: dict) -> tuple:
+        """rollout_events row with the rollout's next seq, read back from the
+        table for a rollout this process didn't begin"""
+        if rollout_id not in self.seqs:
+            seq = await self.next_seq(rollout_id)
+            self.seqs.setdefault(rollout_id, seq)
+        seq = self.seqs[rollout_id]
+        self.seqs[rollout_id] = seq + 1
+        return (rollout_id, seq, event, json.dumps(data), datetime.utcnow())
+
+    async def write_events(self, records: list[tuple]):
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "rollout_events",
+                schema_name="unboxer",
+                columns=EVENT_COLUMNS,
+                records=records,
+            )
+
+    async def flush_events(self):
+        while self.pending_events:
+            records, self.pending_events = self.pending_events, []
+            waiters, self.waiters = self.waiters, []
+            try:
+                await self.write_events(records)
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            else:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
     async def get_rollout_window(self, window_size: int = 100) -> list[dict]:
+        """mean reward of the most recently used blackboxes, each from the
+        latest run it appeared in; reads at most WINDOW_SCAN_FACTOR *
+        window_size summary rows and is cached for `window_ttl` seconds"""
+        cached = self.window_cache.get(window_size)
+        if cached is not None and monotonic() - cached[0] < self.window_ttl:
+            return cached[1]
+
+        window = await self.fetch_window(window_size)
+        self.window_cache[window_size] = (monotonic(), window)
+        return window
+
+    async def fetch_window(self, window_size: int) -> list[dict]:
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
                 """
-                WITH blackbox_stats AS (
-                    SELECT
-                        train_run,
-                        blackbox,
-                        AVG(reward) as mean_reward,
-                        MAX(created_at) as latest_created_at
-                    FROM unboxer.rollouts
-                    GROUP BY train_run, blackbox
+                WITH recent AS (
+                    SELECT train_run, blackbox_hash, blackbox, rollouts, reward_sum, latest_created_at
+                    FROM unboxer.blackbox_stats
+                    ORDER BY latest_created_at DESC
+                    LIMIT $2
                 ),
                 latest_per_blackbox AS (
-                    SELECT
+                    SELECT DISTINCT ON (blackbox_hash)
                         blackbox,
-                        mean_reward,
-                        latest_created_at,
-                        ROW_NUMBER() OVER (PARTITION BY blackbox ORDER BY train_run DESC NULLS LAST) as rn
-                    FROM blackbox_stats
+                        reward_sum / rollouts AS mean_reward,
+                        latest_created_at
+                    FROM recent
+                    ORDER BY blackbox_hash, train_run DESC
                 )
                 SELECT blackbox, mean_reward
                 FROM latest_per_blackbox
-                WHERE rn = 1
                 ORDER BY latest_created_at DESC
                 LIMIT $1
                 """,
                 window_size,
+                window_size * WINDOW_SCAN_FACTOR,
             )
-            return [
-                {"blackbox": row["blackbox"], "mean_reward": float(row["mean_reward"])}
-                for row in rows
-            ]
+        return [
+            {"blackbox": row["blackbox"], "mean_reward": float(row["mean_reward"])}
+            for row in rows
+        ]
 
     async def get_next_train_run(self) -> int:
+        """from the registry, so archived runs' numbers are never reused"""
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT MAX(train_run) as max_run FROM unboxer.rollouts"
+                "SELECT MAX(train_run) as max_run FROM unboxer.train_runs"
             )
             max_run = row["max_run"]
-            return (max_run + 1) if max_run is not None else 1
+            return (max_run + 1) if max_run is not None and max_run > 0 else 1
+
+    async def archive_runs(
+        self,
+        out_dir: Path,
+        keep: int = 2,
+        runs: Optional[list[int]] = None,
+        dry_run: bool = False,
+    ) -> list[dict]:
+        """detach each old run's partition, write it and its events to
+        zstd-compressed csv in `out_dir`, then drop them. `runs` defaults to
+        every unarchived run except the newest `keep` and the current one"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT train_run, partition FROM unboxer.train_runs
+                    WHERE archived_at IS NULL AND partition <> '{LEGACY_TABLE}'
+                    ORDER BY train_run DESC"""
+            )
+        candidates = [(r["train_run"], r["partition"]) for r in rows]
+        if runs is not None:
+            candidates = [(run, table) for run, table in candidates if run in runs]
+        else:
+            candidates = [
+                (run, table)
+                for run, table in candidates[keep:]
+                if run != self.train_run
+            ]
+        if dry_run:
+            return [{"train_run": run, "partition": table} for run, table in candidates]
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        return [
+            await self.archive_run(run, table, out_dir) for run, table in candidates
+        ]
+
+    async def archive_run(self, train_run: int, table: str, out_dir: Path) -> dict:
+        rollouts_path = out_dir / f"{table}.csv.zst"
+        events_path = out_dir / f"rollout_events_run_{train_run}.csv.zst"
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                f"ALTER TABLE unboxer.rollouts DETACH PARTITION unboxer.{table}"
+            )
+            try:
+                rollouts = await export_csv(
+                    rollouts_path, conn.copy_from_table, table, schema_name="unboxer"
+                )
+                events = await export_csv(
+                    events_path,
+                    conn.copy_from_query,
+                    f"""SELECT * FROM unboxer.rollout_events
+                        WHERE rollout_id IN (SELECT id FROM unboxer.{table})
+                        ORDER BY rollout_id, seq""",
+                )
+            except BaseException:
+                await conn.execute(f"""
+                    ALTER TABLE unboxer.rollouts ATTACH PARTITION unboxer.{table}
+                        FOR VALUES IN ({int(train_run)})
+                """)
+                raise
+
+            async with conn.transaction():
+                await conn.execute(f"""
+                    DELETE FROM unboxer.rollout_events
+                    WHERE rollout_id IN (SELECT id FROM unboxer.{table})
+                """)
+                await conn.execute(f"DROP TABLE unboxer.{table}")
+                await conn.execute(
+                    """UPDATE unboxer.train_runs
+                       SET archived_at = CURRENT_TIMESTAMP, archive_path = $2
+                       WHERE train_run = $1""",
+                    train_run,
+                    str(rollouts_path),
+                )
+        return {
+            "train_run": train_run,
+            "partition": table,
+            "rollouts": rollouts,
+            "events": events,
+            "files": [str(rollouts_path), str(events_path)],
+        }
 
     async def close(self):
+        if self.flusher is not None:
+            await asyncio.gather(self.flusher, return_exceptions=True)
         if self.pool:
             await self.pool.close()
 
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+import csv
+import io
+import json
+from datetime import datetime
+from os import environ
+from urllib.parse import urlsplit
+from uuid import uuid4
+import asyncpg
+import pytest
+import pytest_asyncio
+import zstandard
+from db import RolloutsDB, open_db
+from localdb import LocalRolloutsDB
+from recorder import RolloutRecorder
+
+try:
+    import turso
+except ImportError:
+    turso = None
+
+# every local test runs on both embedded drivers
+drivers = pytest.mark.parametrize(
+    "driver",
+    [
+        "sqlite3",
+        pytest.param(
+            "turso",
+            marks=pytest.mark.skipif(turso is None, reason="pyturso not installed"),
+        ),
+    ],
+)
+
+
+@drivers
+@pytest.mark.asyncio
+async def test_local_db_records_rollouts(tmp_path, monkeypatch, driver):
+    """without a dsn open_db falls back to the embedded database, which keeps
+    rollouts, rewards, trajectories, events and the window like postgres does"""
+    monkeypatch.delenv("POSTGRES", raising=False)
+    db = open_db(path=tmp_path / "unboxer.db", driver=driver, window_ttl=0)
+    assert isinstance(db, LocalRolloutsDB)
+
+    async with db:
+        assert await db.get_next_train_run() == 1
+        await db.start_train_run(1, "abc123")
+        assert await db.get_next_train_run() == 2
+
+        first = await db.add_rollout(0, "r0", "def blackbox(a): return a", train_run=1)
+        second = await db.add_rollout(0, "r1", "def blackbox(a): return a", train_run=1)
+        other = await db.add_rollout(0, "r2", "def blackbox(a): return -a", train_run=1)
+        assert first < second < other
+
+        await db.update_reward(first, 1.0)
+        await db.update_reward(second, 0.5)
+        await db.update_trajectory(
+            first, [{"role": "user", "content": "hi"}], num_turns=1, solved=True
+        )
+        await db.append_log(first, "turn", {"n": 0})
+        await db.append_log(first, "turn", {"n": 1})
+
+        window = await db.get_rollout_window(10)
+        assert window[0] == {
+            "blackbox": "def blackbox(a): return -a",
+            "mean_reward": 0.0,
+        }
+        assert window[1] == {
+            "blackbox": "def blackbox(a): return a",
+            "mean_reward": 0.75,
+        }
+
+        stored = await db.get_trajectory(first)
+        assert stored.summary["messages"] == 1
+        assert stored.messages == [{"role": "user", "content": "hi"}]
+        assert [e["data"]["n"] for e in await db.get_events(first)] == [0, 1]
+
+    # reopening the file picks up where the ids and runs left off
+    async with LocalRolloutsDB(tmp_path / "unboxer.db", driver) as db:
+        assert await db.add_rollout(1, "r3", "x", train_run=2) == other + 1
+        assert await db.get_next_train_run() == 2
+
+
+@drivers
+@pytest.mark.asyncio
+async def test_local_db_behind_recorder(tmp_path, driver):
+    """the write-behind recorder batches into the local backend unchanged"""
+    async with LocalRolloutsDB(tmp_path / "unboxer.db", driver, window_ttl=0) as db:
+        recorder = RolloutRecorder(db, id_block=4)
+        ids = [
+            await recorder.add_rollout(0, f"r{i}", "bb", train_run=1) for i in range(6)
+        ]
+        for rollout_id in ids:
+            await recorder.update_reward(rollout_id, 1.0)
+            await recorder.append_log(rollout_id, "done", {})
+        await recorder.close()
+
+        assert recorder.stats()["dropped"] == 0
+        assert await db.get_rollout_window(5) == [
+            {"blackbox": "bb", "mean_reward": 1.0}
+        ]
+        assert len(await db.get_events(ids[-1])) == 1
+
+
+@drivers
+@pytest.mark.asyncio
+async def test_event_seq_survives_forgetting_the_rollout(tmp_path, driver):
+    """a rollout this process no longer tracks picks its seq up from the
+    table instead of restarting at 0 and hitting the primary key"""
+    async with LocalRolloutsDB(tmp_path / "unboxer.db", driver) as db:
+        rollout_id = await db.add_rollout(0, "r0", "bb", train_run=1)
+        await db.append_log(rollout_id, "turn", {"n": 0})
+        db.end_events(rollout_id)
+        await db.append_log(rollout_id, "turn", {"n": 1})
+        assert rollout_id in db.seqs
+
+    async with LocalRolloutsDB(tmp_path / "unboxer.db", driver) as db:
+        await db.append_log(rollout_id, "late", {"n": 2})
+        events = await db.get_events(rollout_id)
+        assert [e["data"]["n"] for e in events] == [0, 1, 2]
+
+
+# the table as it was before partitioning, events and the summary table
+LEGACY_SCHEMA = """
+    CREATE SCHEMA unboxer;
+    CREATE TABLE unboxer.rollouts (
+        id SERIAL PRIMARY KEY,
+        train_run INTEGER DEFAULT NULL,
+        train_step INTEGER NOT NULL,
+        train_commit TEXT DEFAULT NULL,
+        rollout_name TEXT NOT NULL,
+        blackbox TEXT NOT NULL,
+        reward REAL DEFAULT 0.0,
+        solved BOOLEAN DEFAULT FALSE,
+        num_turns INTEGER DEFAULT 0,
+        trajectory JSONB DEFAULT NULL,
+        logs JSONB DEFAULT '[]'::jsonb,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX idx_rollouts_train_run ON unboxer.rollouts(train_run);
+    CREATE INDEX idx_rollouts_solved ON unboxer.rollouts(solved);
+    CREATE INDEX idx_rollouts_created_at ON unboxer.rollouts(created_at DESC);
+"""
+
+
+@pytest_asyncio.fixture
+async def postgres():
+    """dsn of a throwaway database next to the one POSTGRES points at"""
+    dsn = environ.get("POSTGRES")
+    if not dsn:
+        pytest.skip("POSTGRES not set")
+    name = f"unboxer_test_{uuid4().hex[:12]}"
+    admin = await asyncpg.connect(dsn)
+    await admin.execute(f"CREATE DATABASE {name}")
+    try:
+        yield urlsplit(dsn)._replace(path=f"/{name}").geturl()
+    finally:
+        await admin.execute(f"DROP DATABASE {name} WITH (FORCE)")
+        await admin.close()
+
+
+async def legacy_rollouts(dsn: str, rows: list[tuple]) -> list:
+    """a pre-partitioning database holding (train_run, blackbox, reward) rows"""
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(LEGACY_SCHEMA)
+        for second, (train_run, blackbox, reward) in enumerate(rows):
+            await conn.execute(
+                """INSERT INTO unboxer.rollouts (train_run, train_step, rollout_name, blackbox, reward, logs, created_at)
+                   VALUES ($1, 0, 'r', $2, $3, $4::jsonb,
+                           '2025-01-01'::timestamp + make_interval(secs => $5))""",
+                train_run,
+                blackbox,
+                reward,
+                '[{"timestamp": "2025-01-01T00:00:00", "event": "setup", "data": {}}]',
+                second,
+            )
+        return await conn.fetch(
+            "SELECT id, train_run, blackbox, reward, logs FROM unboxer.rollouts ORDER BY id"
+        )
+    finally:
+        await conn.close()
+
+
+# get_rollout_window before the summary table: a GROUP BY over every rollout
+FULL_SCAN_WINDOW = """
+    WITH blackbox_stats AS (
+        SELECT train_run, blackbox, AVG(reward) AS mean_reward, MAX(created_at) AS latest_created_at
+        FROM unboxer.rollouts
+        GROUP BY train_run, blackbox
+    ),
+    latest_per_blackbox AS (
+        SELECT blackbox, mean_reward, latest_created_at,
+            ROW_NUMBER() OVER (PARTITION BY blackbox ORDER BY train_run DESC NULLS LAST) AS rn
+        FROM blackbox_stats
+    )
+    SELECT blackbox, mean_reward FROM latest_per_blackbox
+    WHERE rn = 1
+    ORDER BY latest_created_at DESC
+    LIMIT $1
+"""
+
+
+async def assert_window_matches_full_scan(db: RolloutsDB):
+    for size in (1, 2, 3, 10):
+        async with db.pool.acquire() as conn:
+            expected = [
+                {"blackbox": r["blackbox"], "mean_reward": float(r["mean_reward"])}
+                for r in await conn.fetch(FULL_SCAN_WINDOW, size)
+            ]
+        assert await db.get_rollout_window(size) == expected
+
+
+@pytest.mark.asyncio
+async def test_summary_window_matches_full_scan(postgres):
+    """blackbox_stats, whether backfilled from old rows or kept up by
+    add_rollout and update_rewards, gives the window the old GROUP BY did"""
+    ids = [
+        r["id"]
+        for r in await legacy_rollouts(
+            postgres,
+            [
+                (1, "a", 0.5),
+                (1, "a", 1.0),
+                (None, "b", 0.25),
+                (1, "c", 0.0),
+                (2, "a", 0.0),
+                (2, "c", 1.0),
+                (None, "d", 1.0),
+            ],
+        )
+    ]
+
+    async with RolloutsDB(postgres, window_ttl=0) as db:
+        await assert_window_matches_full_scan(db)
+
+        await db.start_train_run(3)
+        first = await db.add_rollout(0, "r", "b", train_run=3)
+        await db.add_rollout(0, "r", "e", reward=0.5, train_run=3)
+        await db.insert_rollouts(
+            [
+                {
+                    "id": rollout_id,
+                    "train_run": 3,
+                    "train_step": 1,
+                    "rollout_name": "r",
+                    "blackbox": "a",
+                    "reward": 1.0,
+                }
+                for rollout_id in await db.reserve_rollout_ids(2)
+            ]
+        )
+        await assert_window_matches_full_scan(db)
+
+        await db.update_rewards([(first, 1.0)])
+        # older runs' rows, from an instance not pinned to run 3
+        async with RolloutsDB(postgres) as other:
+            await other.update_rewards([(ids[0], 0.0), (ids[2], 0.75)])
+        await assert_window_matches_full_scan(db)
+
+
+@pytest.mark.asyncio
+async def test_rollout_logs_view_matches_old_logs(postgres):
+    """old rows keep their inline logs, and events appended since show up
+    after them in the shape the old append_log wrote"""
+    (legacy,) = await legacy_rollouts(postgres, [(1, "a", 0.0)])
+    await RolloutsDB.migrate(postgres)
+
+    async with RolloutsDB(postgres) as db:
+        await db.start_train_run(2)
+        fresh = await db.add_rollout(0, "r", "b", train_run=2)
+        await db.append_log(legacy["id"], "turn", {"n": 1})
+        for n in range(3):
+            await db.append_log(fresh, "turn", {"n": n})
+        db.end_events(legacy["id"])
+        await db.append_log(legacy["id"], "submit", {"output": 2.5})
+
+        async with db.pool.acquire() as conn:
+            logs = {
+                row["rollout_id"]: json.loads(row["logs"])
+                for row in await conn.fetch(
+                    "SELECT rollout_id, logs FROM unboxer.rollout_logs"
+                )
+            }
+
+    old = json.loads(legacy["logs"])
+    assert logs[legacy["id"]][:1] == old
+    assert [(e["event"], e["data"]) for e in logs[legacy["id"]][1:]] == [
+        ("turn", {"n": 1}),
+        ("submit", {"output": 2.5}),
+    ]
+    assert [e["data"]["n"] for e in logs[fresh]] == [0, 1, 2]
+    for entry in logs[fresh]:
+        assert set(entry) == {"timestamp", "event", "data"}
+        datetime.fromisoformat(entry["timestamp"])
+
+
+@pytest.mark.asyncio
+async def test_migrate_partitions_legacy_rollouts(postgres):
+    """the plain table becomes the DEFAULT partition with every row and id,
+    NULL runs as -1, and new runs get partitions of their own"""
+    before = await legacy_rollouts(
+        postgres, [(1, "a", 0.5), (None, "b", 1.0), (2, "a", 0.0)]
+    )
+    await RolloutsDB.migrate(postgres)
+    await RolloutsDB.migrate(postgres)
+
+    async with RolloutsDB(postgres) as db:
+        async with db.pool.acquire() as conn:
+            assert (
+                await conn.fetchval(
+                    "SELECT relkind::text FROM pg_class WHERE oid = 'unboxer.rollouts'::regclass"
+                )
+                == "p"
+            )
+            after = await conn.fetch(
+                """SELECT id, train_run, blackbox, reward, logs, tableoid::regclass::text AS tbl
+                   FROM unboxer.rollouts ORDER BY id"""
+            )
+        assert [(r["id"], r["blackbox"], r["reward"], r["logs"]) for r in after] == [
+            (r["id"], r["blackbox"], r["reward"], r["logs"]) for r in before
+        ]
+        assert [r["train_run"] for r in after] == [1, -1, 2]
+        assert {r["tbl"] for r in after} == {"unboxer.rollouts_legacy"}
+
+        assert await db.get_next_train_run() == 3
+        await db.start_train_run(3)
+        rollout_id = await db.add_rollout(0, "r", "c", train_run=3)
+        assert rollout_id > before[-1]["id"]
+        async with db.pool.acquire() as conn:
+            assert (
+                await conn.fetchval(
+                    "SELECT tableoid::regclass::text FROM unboxer.rollouts WHERE id = $1",
+                    rollout_id,
+                )
+                == "unboxer.rollouts_run_3"
+            )
+
+
+@pytest.mark.asyncio
+async def test_connect_without_migrate_continues_run_numbers(postgres):
+    """a database that was never migrated still hands out the next run"""
+    await legacy_rollouts(postgres, [(1, "a", 0.5), (4, "b", 1.0), (None, "c", 0.0)])
+    async with RolloutsDB(postgres) as db:
+        assert await db.get_next_train_run() == 5
+
+
+@pytest.mark.asyncio
+async def test_archive_run_round_trips_to_csv(postgres, tmp_path):
+    """an archived run comes back out of its .csv.zst files, and its
+    partition and events are gone from the database"""
+    await RolloutsDB.migrate(postgres)
+    async with RolloutsDB(postgres) as db:
+        await db.start_train_run(1)
+        old = [await db.add_rollout(0, f"r{i}", "a", train_run=1) for i in range(3)]
+        for rollout_id in old:
+            await db.append_log(rollout_id, "turn", {"id": rollout_id})
+        await db.start_train_run(2)
+        kept = await db.add_rollout(0, "r", "a", train_run=2)
+        await db.append_log(kept, "turn", {})
+
+        (archived,) = await db.archive_runs(tmp_path, runs=[1])
+        assert (archived["rollouts"], archived["events"]) == (3, 3)
+
+        rollouts_file, events_file = archived["files"]
+        with open(rollouts_file, "rb") as f:
+            text = zstandard.ZstdDecompressor().stream_reader(f).read().decode()
+        assert sorted(int(r["id"]) for r in csv.DictReader(io.StringIO(text))) == old
+        with open(events_file, "rb") as f:
+            text = zstandard.ZstdDecompressor().stream_reader(f).read().decode()
+        assert [int(r["rollout_id"]) for r in csv.DictReader(io.StringIO(text))] == old
+
+        async with db.pool.acquire() as conn:
+            assert (
+                await conn.fetchval("SELECT to_regclass('unboxer.rollouts_run_1')")
+                is None
+            )
+            assert await conn.fetchval(
+                "SELECT array_agg(rollout_id) FROM unboxer.rollout_events"
+            ) == [kept]
+            assert await conn.fetchval(
+                "SELECT archived_at IS NOT NULL FROM unboxer.train_runs WHERE train_run = 1"
+            )
+            assert await conn.fetchval("SELECT count(*) FROM unboxer.rollouts") == 1
@@ -1,10 +1,18 @@
+import asyncio
 import json
-from typing import Optional
+from contextvars import ContextVar
+from typing import Optional, Union
 from openai import AsyncOpenAI
 import verifiers as vf
 from verifiers.types import Messages, State
 from sandbox import Sandbox
-from db import RolloutsDB
+from machines import MachinesAPI, Reaper, SandboxPool, TeardownQueue
+from containers import ContainerAPI
+from tenants import TenantPool
+from db import RolloutsDB, open_db
+from recorder import RolloutRecorder
+import timing
+import trajectory
 import hypothesis.strategies as st
 import prompts
 
@@ -30,6 +38,11 @@ def sample_kwargs(kwargs_spec: dict) -> dict:
     return {k: round(v.example(), 1) for k, v in kwargs_spec.items()}
 
 
+# the running rollout's state once setup_state has it, so rollout() can finish
+# the episode however the turn loop stops
+episode: ContextVar[Optional[State]] = ContextVar("episode", default=None)
+
+
 class UnboxerEnv(vf.MultiTurnEnv):
     def __init__(
         self,
@@ -40,7 +53,31 @@ class UnboxerEnv(vf.MultiTurnEnv):
         train_run: Optional[int] = None,
         target_solve_rate: float = 0.4,
         dsn: Optional[str] = None,
+        db_path: Optional[str] = None,
         train_commit: Optional[str] = None,
+        sandbox_pool_size: Optional[int] = None,
+        sandbox_max_concurrency: Optional[int] = None,
+        sandbox_cache_entries: Optional[int] = None,
+        sandbox_fast_eval: Optional[bool] = None,
+        sandbox_timings: Optional[bool] = None,
+        sandbox_backend: str = "fly",
+        sandbox_bash_timeout: Optional[float] = None,
+        sandbox_bash_max_bytes: Optional[int] = None,
+        sandbox_image: str = "unboxer-sandbox",
+        sandbox_machines: Optional[int] = None,
+        sandbox_machine_max_uses: int = 20,
+        sandbox_machine_max_age: float = 3600,
+        sandbox_teardown_concurrency: int = 4,
+        sandbox_reap_interval: float = 0,
+        sandbox_reap_min_age: float = 2 * 3600,
+        sandbox_tenants_per_host: int = 0,
+        sandbox_host_memory_mb: int = 4096,
+        sandbox_host_cpus: int = 4,
+        sandbox_tenant_cpus: float = 0.5,
+        sandbox_tenant_memory_mb: int = 512,
+        sandbox_tenant_workspace_mb: int = 256,
+        recorder_max_pending: int = 10_000,
+        trajectory_storage: str = "zstd",
         **kwargs,
     ):
         super().__init__(max_turns=max_turns, **kwargs)
@@ -53,19 +90,109 @@ class UnboxerEnv(vf.MultiTurnEnv):
         self.train_run = train_run
         self.target_solve_rate = target_solve_rate
         self.dsn = dsn or environ.get("POSTGRES")
+        # without a dsn rollouts go to an embedded database file instead
+        self.db_path = db_path
         self.train_commit = train_commit or environ.get("TRAIN_COMMIT")
         self.db: RolloutsDB = None  # type: ignore
+        self.recorder: RolloutRecorder = None  # type: ignore
+        self.recorder_max_pending = recorder_max_pending
+        self.trajectory_storage = trajectory_storage
         self.db_initialized = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.current_complexity = {"num_ops": 1, "num_holes": 0, "num_args": 1}
+        # fly machines when use_remote, or local docker / podman containers
+        # built from the same image, which don't need use_remote
+        self.sandbox_api = None
+        if sandbox_backend in ("docker", "podman"):
+            self.sandbox_api = ContainerAPI(sandbox_backend, image=sandbox_image)
+        elif sandbox_backend != "fly":
+            raise ValueError(f"unknown sandbox_backend {sandbox_backend}")
+        self.bash_enabled = use_remote or self.sandbox_api is not None
+        if sandbox_machines is None:
+            sandbox_machines = 4 if self.sandbox_api is not None else 0
+
+        self.teardown = TeardownQueue(sandbox_teardown_concurrency)
+        self.machine_pool: Optional[Union[SandboxPool, TenantPool]] = None
+        if sandbox_tenants_per_host > 0 and self.sandbox_api is not None:
+            raise ValueError("sandbox_tenants_per_host needs the fly backend")
+        if self.bash_enabled and sandbox_tenants_per_host > 0:
+            # many episodes per larger machine, each its own user + cgroup
+            self.machine_pool = TenantPool(
+                tenants_per_host=sandbox_tenants_per_host,
+                max_age=sandbox_machine_max_age,
+                teardown=self.teardown,
+                host_memory_mb=sandbox_host_memory_mb,
+                host_cpus=sandbox_host_cpus,
+                tenant_cpus=sandbox_tenant_cpus,
+                tenant_memory_mb=sandbox_tenant_memory_mb,
+                tenant_workspace_mb=sandbox_tenant_workspace_mb,
+            )
+        elif self.bash_enabled and sandbox_machines > 0:
+            self.machine_pool = SandboxPool(
+                size=sandbox_machines,
+                max_uses=sandbox_machine_max_uses,
+                max_age=sandbox_machine_max_age,
+                api=self.sandbox_api,
+                teardown=self.teardown,
+            )
+        self.reaper: Optional[Reaper] = None
+        if self.bash_enabled and sandbox_reap_interval > 0:
+            self.reaper = Reaper(
+                self.sandbox_api or MachinesAPI(),
+                min_age=sandbox_reap_min_age,
+                interval=sandbox_reap_interval,
+            )
+
+        if sandbox_pool_size is not None:
+            Sandbox.configure_pool(sandbox_pool_size)
+        if sandbox_max_concurrency is not None:
+            Sandbox.max_concurrency = sandbox_max_concurrency
+        if sandbox_cache_entries is not None:
+            Sandbox.configure_cache(sandbox_cache_entries)
+        if sandbox_fast_eval is not None:
+            Sandbox.fast_eval = sandbox_fast_eval
+        if sandbox_timings is not None:
+            timing.enable(sandbox_timings)
+        if sandbox_bash_timeout is not None:
+            Sandbox.bash_timeout = sandbox_bash_timeout
+        if sandbox_bash_max_bytes is not None:
+            Sandbox.bash_max_bytes = sandbox_bash_max_bytes
 
     async def ensure_db(self):
         if not self.db_initialized:
-            self.db = RolloutsDB(dsn=self.dsn)
+            self.db = open_db(
+                dsn=self.dsn,
+                path=self.db_path,
+                trajectory_storage=self.trajectory_storage,
+            )
             await self.db.connect()
+            # rollout writes leave the turn loop, flushed once per episode
+            self.recorder = RolloutRecorder(
+                self.db, max_pending=self.recorder_max_pending
+            )
             if self.train_run is None:
                 self.train_run = await self.db.get_next_train_run()
+            await self.db.start_train_run(self.train_run, self.train_commit)
+            self.loop = asyncio.get_running_loop()
             self.db_initialized = True
 
+    async def close(self):
+        """shutdown: commit queued rollout writes, then give back every machine.
+        may run on a different loop than the rollouts did: the trainer's
+        generation loop is already closed when training returns"""
+        if self.recorder is not None:
+            if self.loop is not asyncio.get_running_loop():
+                # the old connections went with their loop
+                await self.db.connect()
+            await self.recorder.close()
+        if self.reaper is not None:
+            self.reaper.stop()
+        if self.machine_pool is not None:
+            await self.machine_pool.close()
+        await self.teardown.drain()
+        if self.db is not None:
+            await self.db.close()
+
     async def get_or_create_client(
         self, client: Optional[AsyncOpenAI] = None
     ) -> AsyncOpenAI:
@@ -197,16 +324,18 @@ class UnboxerEnv(vf.MultiTurnEnv):
         sampled_holes = sample_holes(holes_spec)
         blackbox_fn = instantiate_function(blackbox_fn_template, sampled_holes)
 
+        inputs = [sample_kwargs(kwargs_spec) for _ in range(4)]
+        *io_results, expected_result = await Sandbox.local_batch_async(
+            blackbox_fn, inputs
+        )
+        n_plus_one_input = inputs[-1]
+
         n_input_output_pairs = []
-        for _ in range(3):
-            kwargs = sample_kwargs(kwargs_spec)
-            result = Sandbox.local(blackbox_fn, kwargs)
+        for kwargs, result in zip(inputs, io_results):
             if result.is_ok():
                 output = round(result.ok()["output"], 1)
                 n_input_output_pairs.append({"input": kwargs, "output": output})
 
-        n_plus_one_input = sample_kwargs(kwargs_spec)
-        expected_result = Sandbox.local(blackbox_fn, n_plus_one_input)
         n_plus_one_output = (
             round(expected_result.ok()["output"], 1)
             if expected_result.is_ok()
@@ -224,10 +353,24 @@ class UnboxerEnv(vf.MultiTurnEnv):
             },
         )
 
+    async def rollout(self, *args, **kwargs) -> tuple[Messages, State]:
+        episode.set(None)
+        try:
+            return await super().rollout(*args, **kwargs)
+        finally:
+            state = episode.get()
+            if state is not None:
+                await self.finish_episode(state)
+
     async def setup_state(self, state: State, **kwargs) -> State:
         client = kwargs.get("client")
+        episode.set(state)
 
         await self.ensure_db()
+        if self.reaper is not None:
+            self.reaper.start()
+        # no rollout id until add_rollout, so sandbox timings park under the state
+        timing.rollout.set(id(state))
 
         if self.train_step == 0:
             complexity = {"num_ops": 1, "num_holes": 0, "num_args": 1}
@@ -243,8 +386,12 @@ class UnboxerEnv(vf.MultiTurnEnv):
             next_data,
         ) = await self.generate_blackbox_fn(complexity, client)
 
-        if self.use_remote:
-            sandbox = Sandbox()
+        if self.machine_pool is not None:
+            sandbox = await self.machine_pool.acquire()
+            state["sandbox"] = sandbox
+            state["machine_id"] = sandbox.machine_id
+        elif self.bash_enabled:
+            sandbox = Sandbox(api=self.sandbox_api)
             machine_id = await sandbox.create()
             state["sandbox"] = sandbox
             state["machine_id"] = machine_id
@@ -261,7 +408,7 @@ class UnboxerEnv(vf.MultiTurnEnv):
         state["n_plus_one_output"] = next_data["n_plus_one_output"]
         state["kwargs_spec"] = kwargs_spec
 
-        rollout_id = await self.db.add_rollout(
+        rollout_id = await self.recorder.add_rollout(
             train_step=self.train_step,
             rollout_name=state["machine_id"],
             blackbox=blackbox_fn,
@@ -270,6 +417,8 @@ class UnboxerEnv(vf.MultiTurnEnv):
             train_commit=self.train_commit,
         )
         state["rollout_id"] = rollout_id
+        timing.timings.adopt(id(state), rollout_id)
+        timing.rollout.set(rollout_id)
 
         game_prompt = f"""this is an interactive reverse engineering game playing which you will be trained with RL
 at the start of a rollout you have budget of {self.max_turns} turns
@@ -296,7 +445,7 @@ NOT just an expression like "x + 2" — that will fail to execute"""
 
         state["prompt"] = [{"role": "user", "content": game_prompt}]
 
-        await self.db.append_log(
+        await self.recorder.append_log(
             rollout_id=state["rollout_id"],
             event="setup",
             data={
@@ -306,6 +455,7 @@ NOT just an expression like "x + 2" — that will fail to execute"""
                 "next_input": next_data["n_plus_one_input"],
                 "expected_output": next_data["n_plus_one_output"],
                 "budget": self.max_turns,
+                "readiness": state["sandbox"].readiness if state["sandbox"] else None,
             },
         )
 
@@ -327,141 +477,180 @@ NOT just an expression like "x + 2" — that will fail to execute"""
         if "tool_calls" not in last_msg:
             return [], state
 
-        tool_responses = []
+        timing.rollout.set(state["rollout_id"])
 
+        # budgets are fixed up front in call order, so running tools
+        # concurrently can't change what each one sees or where we stop
+        planned = []
+        budget = state["budget"]
         for tool_call in last_msg["tool_calls"]:
-            state["budget"] -= 1
+            budget -= 1
+            planned.append((tool_call, budget))
+            if budget <= 0:
+                break
+
+        tool_responses = []
+        running = []
+        last_bash = None
+        for tool_call, budget in planned:
             tool_name = tool_call["function"]["name"]
 
-            if tool_name == "bash":
-                args = json.loads(tool_call["function"]["arguments"])
-                command = args["command"]
-
-                if state["sandbox"]:
-                    try:
-                        output = await state["sandbox"].bash(command)
-                    except Exception as e:
-                        output = f"error: {str(e)}"
-                else:
-                    output = "error: bash tool only available with remote sandbox"
-
-                tool_responses.append(
-                    {
-                        "role": "tool",
-                        "content": output,
-                        "tool_call_id": tool_call["id"],
-                    }
+            if tool_name == "submit":
+                # barrier: everything before it lands first, nothing after starts early
+                tool_responses += await self.collect(running, state)
+                running = []
+                state["budget"] = budget
+                content = await self.submit_tool(tool_call, state)
+                tool_responses.append(self.tool_message(tool_call, content))
+            elif tool_name == "bash":
+                # bash calls share one machine, so they stay in order among themselves
+                last_bash = asyncio.ensure_future(
+                    self.bash_tool(tool_call, state, after=last_bash)
                 )
-
+                running.append((tool_call, budget, last_bash))
             elif tool_name == "eval":
-                args = json.loads(tool_call["function"]["arguments"])
-                fn = args["fn"]
-                kwargs_str = args.get("kwargs", "[]")
-                try:
-                    kwargs_list = (
-                        json.loads(kwargs_str)
-                        if isinstance(kwargs_str, str)
-                        else kwargs_str
+                task = asyncio.ensure_future(self.eval_tool(tool_call))
+                running.append((tool_call, budget, task))
+
+        tool_responses += await self.collect(running, state)
+        state["budget"] = planned[-1][1] if planned else state["budget"]
+        return tool_responses, state
+
+    async def finish_episode(self, state: State):
+        """record the trajectory and give the machine back, once per episode
+        whether it was solved, ran out of budget or turns, or failed; a write
+        the recorder had to drop is in its stats and doesn't fail the rollout"""
+        if state.get("finished"):
+            return
+        state["finished"] = True
+        # per-rollout histograms go now, however the episode ended
+        timings = timing.timings.pop(state.get("rollout_id", id(state)))
+        try:
+            if "rollout_id" in state:
+                await self.recorder.update_trajectory(
+                    rollout_id=state["rollout_id"],
+                    trajectory=state["completion"],
+                    num_turns=state.get("turn", 0),
+                    solved=state.get("solved", False),
+                    tokens=trajectory.usage(state.get("responses", [])),
+                )
+                if timing.enabled:
+                    await self.recorder.append_log(
+                        rollout_id=state["rollout_id"],
+                        event="sandbox_timings",
+                        data=timings,
                     )
-                except json.JSONDecodeError:
-                    kwargs_list = []
-
-                results = []
-                for kw in kwargs_list:
-                    result = Sandbox.local(fn, kw)
-                    if result.is_ok():
-                        output = round(result.ok()["output"], 1)
-                        results.append({"input": kw, "output": output})
-                    else:
-                        results.append({"input": kw, "error": result.err()})
-
-                await self.db.append_log(
+                await self.recorder.finish(state["rollout_id"])
+        finally:
+            if state.get("sandbox") and self.machine_pool is not None:
+                await self.machine_pool.release(state["sandbox"])
+            elif state.get("sandbox"):
+                self.teardown.submit(state["sandbox"])
+
+    def tool_message(self, tool_call: dict, content: str) -> dict:
+        return {"role": "tool", "content": content, "tool_call_id": tool_call["id"]}
+
+    async def collect(self, running: list, state: State) -> list[dict]:
+        """wait for concurrently started tools, then log and answer in call order"""
+        outcomes = await asyncio.gather(
+            *(task for _, _, task in running), return_exceptions=True
+        )
+        responses = []
+        for (tool_call, budget, _), outcome in zip(running, outcomes):
+            if isinstance(outcome, BaseException):
+                raise outcome
+            if tool_call["function"]["name"] == "eval":
+                fn, kwargs_list, results = outcome
+                await self.recorder.append_log(
                     rollout_id=state["rollout_id"],
                     event="eval",
                     data={
                         "fn": fn,
                         "kwargs_count": len(kwargs_list),
                         "results": results,
-                        "budget_remaining": state["budget"],
+                        "budget_remaining": budget,
                     },
                 )
+                outcome = json.dumps({"results": results})
+            responses.append(self.tool_message(tool_call, outcome))
+        return responses
+
+    async def bash_tool(
+        self, tool_call: dict, state: State, after: Optional[asyncio.Future] = None
+    ) -> str:
+        args = json.loads(tool_call["function"]["arguments"])
+        command = args["command"]
+        if after is not None:
+            await asyncio.wait([after])
+
+        if not state["sandbox"]:
+            return "error: bash tool only available with a remote or container sandbox"
+        try:
+            return await state["sandbox"].bash(command)
+        except Exception as e:
+            return f"error: {str(e)}"
+
+    async def eval_tool(self, tool_call: dict) -> tuple[str, list, list]:
+        args = json.loads(tool_call["function"]["arguments"])
+        fn = args["fn"]
+        kwargs_str = args.get("kwargs", "[]")
+        try:
+            kwargs_list = (
+                json.loads(kwargs_str) if isinstance(kwargs_str, str) else kwargs_str
+            )
+        except json.JSONDecodeError:
+            kwargs_list = []
 
-                tool_responses.append(
-                    {
-                        "role": "tool",
-                        "content": json.dumps({"results": results}),
-                        "tool_call_id": tool_call["id"],
-                    }
-                )
-
-            elif tool_name == "submit":
-                args = json.loads(tool_call["function"]["arguments"])
-                predicted_output = args["output"]
-                submitted_fn = args.get("fn", "")
-
-                await self.db.append_log(
-                    rollout_id=state["rollout_id"],
-                    event="submit",
-                    data={
-                        "fn": submitted_fn,
-                        "predicted_output": predicted_output,
-                        "expected_output": state["n_plus_one_output"],
-                        "budget_remaining": state["budget"],
-                    },
-                )
-
-                expected = state["n_plus_one_output"]
-                tolerance = 0.5
-
-                if abs(predicted_output - expected) <= tolerance:
-                    state["solved"] = True
-                    reward = state["budget"]
-                    await self.db.update_reward(state["rollout_id"], reward)
+        results = []
+        for kw, result in zip(
+            kwargs_list, await Sandbox.local_batch_async(fn, kwargs_list)
+        ):
+            if result.is_ok():
+                output = round(result.ok()["output"], 1)
+                results.append({"input": kw, "output": output})
+            else:
+                results.append({"input": kw, "error": result.err()})
+        return fn, kwargs_list, results
 
-                    tool_responses.append(
-                        {
-                            "role": "tool",
-                            "content": f"✓ correct! reward: {reward}",
-                            "tool_call_id": tool_call["id"],
-                        }
-                    )
-                else:
-                    n_plus_one_input = sample_kwargs(state["kwargs_spec"])
-                    expected_result = Sandbox.local(
-                        state["blackbox_fn"], n_plus_one_input
-                    )
-                    n_plus_one_output = (
-                        round(expected_result.ok()["output"], 1)
-                        if expected_result.is_ok()
-                        else None
-                    )
+    async def submit_tool(self, tool_call: dict, state: State) -> str:
+        args = json.loads(tool_call["function"]["arguments"])
+        predicted_output = args["output"]
+        submitted_fn = args.get("fn", "")
 
-                    state["n_plus_one_input"] = n_plus_one_input
-                    state["n_plus_one_output"] = n_plus_one_output
+        await self.recorder.append_log(
+            rollout_id=state["rollout_id"],
+            event="submit",
+            data={
+                "fn": submitted_fn,
+                "predicted_output": predicted_output,
+                "expected_output": state["n_plus_one_output"],
+                "budget_remaining": state["budget"],
+            },
+        )
 
-                    tool_responses.append(
-                        {
-                            "role": "tool",
-                            "content": f"✗ incorrect. expected: {expected}, got: {predicted_output} (tolerance: ±{tolerance}). try predicting output for: {state['n_plus_one_input']}",
-                            "tool_call_id": tool_call["id"],
-                        }
-                    )
+        expected = state["n_plus_one_output"]
+        tolerance = 0.5
 
-            if state["budget"] <= 0:
-                break
+        if abs(predicted_output - expected) <= tolerance:
+            state["solved"] = True
+            reward = state["budget"]
+            await self.recorder.update_reward(state["rollout_id"], reward)
+            return f"✓ correct! reward: {reward}"
 
-        if state.get("solved") or state["budget"] <= 0:
-            await self.db.update_trajectory(
-                rollout_id=state["rollout_id"],
-                trajectory=state["completion"],
-                num_turns=state.get("turn", 0),
-                solved=state.get("solved", False),
-            )
+        n_plus_one_input = sample_kwargs(state["kwargs_spec"])
+        expected_result = await Sandbox.local_async(
+            state["blackbox_fn"], n_plus_one_input
+        )
+        n_plus_one_output = (
+            round(expected_result.ok()["output"], 1)
+            if expected_result.is_ok()
+            else None
+        )
 
-            if state["sandbox"]:
-                await state["sandbox"].destroy()
+        state["n_plus_one_input"] = n_plus_one_input
+        state["n_plus_one_output"] = n_plus_one_output
 
-        return tool_responses, state
+        return f"✗ incorrect. expected: {expected}, got: {predicted_output} (tolerance: ±{tolerance}). try predicting output for: {state['n_plus_one_input']}"
 
 
 def load_environment(
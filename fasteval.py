@@ -0,0 +1,237 @@
+import ast
+import math
+from functools import lru_cache
+from json import loads, dumps
+from typing import Callable
+from result import Result, Ok, Err
+
+# no loops, so these bound the work of any accepted function; the messages
+# match the guards in sandbox.template.py
+INT_BITS_LIMIT = 1 << 16
+ROUND_DIGITS_LIMIT = 1000
+
+MATH_FUNCTIONS = {
+    name
+    for name in dir(math)
+    if callable(getattr(math, name))
+    and not name.startswith("_")
+    and name not in {"factorial", "comb", "perm", "prod", "fsum", "sumprod", "dist"}
+}
+BUILTINS = {"abs", "min", "max", "round", "int", "float", "bool"}
+CONSTANTS = {"pi", "e", "tau", "inf", "nan"}
+
+ALLOWED = (
+    ast.FunctionDef,
+    ast.arguments,
+    ast.arg,
+    ast.Return,
+    ast.Assign,
+    ast.AugAssign,
+    ast.If,
+    ast.Pass,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Store,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.USub,
+    ast.UAdd,
+    ast.Not,
+    ast.And,
+    ast.Or,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+
+
+class Rejected(Exception):
+    pass
+
+
+class TooExpensive(Exception):
+    pass
+
+
+def _pow(base, exponent):
+    if (
+        isinstance(base, int)
+        and isinstance(exponent, int)
+        and exponent > 0
+        and abs(base) > 1
+        and base.bit_length() * exponent > INT_BITS_LIMIT
+    ):
+        raise TooExpensive(
+            f"too expensive: integer power exceeds {INT_BITS_LIMIT} bits"
+        )
+    return base**exponent
+
+
+def _mul(a, b):
+    if (
+        isinstance(a, int)
+        and isinstance(b, int)
+        and a.bit_length() + b.bit_length() > INT_BITS_LIMIT
+    ):
+        raise TooExpensive(
+            f"too expensive: integer product exceeds {INT_BITS_LIMIT} bits"
+        )
+    return a * b
+
+
+def _round(number, ndigits=None):
+    if ndigits is not None and abs(ndigits) > ROUND_DIGITS_LIMIT:
+        raise TooExpensive(f"too expensive: round ndigits exceeds {ROUND_DIGITS_LIMIT}")
+    return round(number, ndigits)
+
+
+SCOPE = {
+    **{name: getattr(math, name) for name in MATH_FUNCTIONS | CONSTANTS},
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "round": _round,
+    "_pow": _pow,
+    "_mul": _mul,
+}
+
+
+class Guard(ast.NodeTransformer):
+    """route ** and * through the int size guards"""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.expr:
+        self.generic_visit(node)
+        name = {ast.Pow: "_pow", ast.Mult: "_mul"}.get(type(node.op))
+        if name is None:
+            return node
+        call = ast.Call(ast.Name(name, ast.Load()), [node.left, node.right], [])
+        return ast.copy_location(call, node)
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> ast.stmt:
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Pow | ast.Mult):
+            return node
+        value = self.visit_BinOp(
+            ast.BinOp(ast.Name(node.target.id, ast.Load()), node.op, node.value)
+        )
+        return ast.copy_location(ast.Assign([node.target], value), node)
+
+
+class Validator(ast.NodeVisitor):
+    """accept one plain `def` of arithmetic, comparisons, conditionals and math
+    calls; no attributes, subscripts, imports, loops or comprehensions"""
+
+    def __init__(self, func: ast.FunctionDef):
+        self.names = {a.arg for a in func.args.posonlyargs + func.args.args}
+        for node in ast.walk(func):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                self.names.add(node.id)
+        self.callable = MATH_FUNCTIONS | BUILTINS
+
+    def generic_visit(self, node: ast.AST):
+        if not isinstance(node, ALLOWED):
+            raise Rejected(f"{type(node).__name__} is not allowed")
+        super().generic_visit(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        args = node.args
+        if (
+            args.vararg
+            or args.kwarg
+            or args.kwonlyargs
+            or node.decorator_list
+            or node.type_params
+        ):
+            raise Rejected("only plain arguments are allowed")
+        for annotation in [a.annotation for a in args.args] + [node.returns]:
+            if annotation is not None and not (
+                isinstance(annotation, ast.Name) and annotation.id in BUILTINS
+            ):
+                raise Rejected("annotations must be builtin numeric types")
+        for default in args.defaults:
+            self.visit(default)
+        for i, stmt in enumerate(node.body):
+            docstring = isinstance(stmt, ast.Expr) and isinstance(
+                stmt.value, ast.Constant
+            )
+            if not (i == 0 and docstring and isinstance(stmt.value.value, str)):
+                self.visit(stmt)
+
+    def visit_Constant(self, node: ast.Constant):
+        if type(node.value) not in (int, float, bool):
+            raise Rejected("only numeric constants are allowed")
+
+    def visit_Name(self, node: ast.Name):
+        if node.id not in self.names | self.callable | CONSTANTS:
+            raise Rejected(f"unknown name {node.id}")
+
+    def visit_Call(self, node: ast.Call):
+        if (
+            not isinstance(node.func, ast.Name)
+            or node.func.id in self.names
+            or node.func.id not in self.callable
+        ):
+            raise Rejected("only calls to math functions are allowed")
+        if node.keywords or any(isinstance(a, ast.Starred) for a in node.args):
+            raise Rejected("only positional call arguments are allowed")
+        for arg in node.args:
+            self.visit(arg)
+
+
+def validate(tree: ast.Module):
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+        raise Rejected("expected a single function definition")
+    Validator(tree.body[0]).visit(tree.body[0])
+
+
+@lru_cache(maxsize=4096)
+def compile_fn(fn: str) -> Result[Callable, str]:
+    """whitelist-check fn and compile it for in-process calls"""
+    try:
+        tree = ast.parse(fn)
+        validate(tree)
+        tree = ast.fix_missing_locations(Guard().visit(tree))
+    except SyntaxError as e:
+        return Err(f"syntax error: {e}")
+    except Rejected as e:
+        return Err(str(e))
+    except (RecursionError, MemoryError):
+        return Err("too deeply nested for the fast path")
+
+    scope = {"__builtins__": {}, **SCOPE}
+    local_vars = {}
+    try:
+        exec(compile(tree, "<blackbox>", "exec"), scope, local_vars)
+    except Exception as e:
+        return Err(str(e))
+    return Ok(next(iter(local_vars.values())))
+
+
+def call(func: Callable, kwargs: dict) -> Result[dict, str]:
+    """same shape as a sandbox round trip, output included"""
+    try:
+        result = func(**kwargs)
+    except Exception as e:
+        return Err(str(e))
+
+    try:
+        return Ok({"output": loads(dumps(result))})
+    except Exception as e:
+        return Err(f"unserializable result: {e}")
@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+from db import ROLLOUT_COLUMNS, WINDOW_SCAN_FACTOR, RolloutsDB
+from trajectory import Trajectory
+
+try:
+    import turso
+except ImportError:  # pragma: no cover
+    turso = None
+
+DRIVERS = ("sqlite3", "turso")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rollouts (
+        id INTEGER PRIMARY KEY,
+        train_run INTEGER NOT NULL,
+        train_step INTEGER NOT NULL,
+        train_commit TEXT DEFAULT NULL,
+        rollout_name TEXT NOT NULL,
+        blackbox TEXT NOT NULL,
+        reward REAL DEFAULT 0.0,
+        solved INTEGER DEFAULT 0,
+        num_turns INTEGER DEFAULT 0,
+        trajectory TEXT DEFAULT NULL,
+        trajectory_zstd BLOB DEFAULT NULL,
+        trajectory_summary TEXT DEFAULT NULL,
+        created_at TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_rollouts_train_run ON rollouts(train_run)",
+    """CREATE TABLE IF NOT EXISTS rollout_events (
+        rollout_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (rollout_id, seq)
+    )""",
+    """CREATE TABLE IF NOT EXISTS blackbox_stats (
+        train_run INTEGER NOT NULL,
+        blackbox_hash TEXT NOT NULL,
+        blackbox TEXT NOT NULL,
+        rollouts INTEGER NOT NULL DEFAULT 0,
+        reward_sum REAL NOT NULL DEFAULT 0,
+        latest_created_at TEXT NOT NULL,
+        PRIMARY KEY (train_run, blackbox_hash)
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_blackbox_stats_recency
+        ON blackbox_stats(latest_created_at DESC)""",
+    """CREATE TABLE IF NOT EXISTS train_runs (
+        train_run INTEGER PRIMARY KEY,
+        train_commit TEXT DEFAULT NULL,
+        created_at TEXT NOT NULL
+    )""",
+    # stands in for postgres' rollouts_id_seq so ids can be handed out early
+    """CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""",
+]
+
+# the postgres window's bounded scan; turso has no window functions, so the
+# latest run per blackbox is picked in python rather than with DISTINCT ON
+RECENT_STATS = """
+    SELECT train_run, blackbox_hash, blackbox, reward_sum / rollouts, latest_created_at
+    FROM blackbox_stats
+    ORDER BY latest_created_at DESC
+    LIMIT ?
+"""
+
+
+def md5(text: str) -> str:
+    """matches postgres md5() so both backends key blackboxes the same way"""
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def query(cur, sql: str, args: tuple = ()) -> list:
+    cur.execute(sql, args)
+    return cur.fetchall()
+
+
+class LocalRolloutsDB(RolloutsDB):
+    """RolloutsDB on an embedded file, through the stdlib sqlite3 driver or
+    turso. one connection in WAL mode, owned by a single thread that runs
+    every call as one transaction off the event loop (turso connections
+    can't be touched from any other thread), so single-node runs need no
+    postgres"""
+
+    def __init__(self, path: str = "unboxer.db", driver: str = "sqlite3", **options):
+        # the file path plays the dsn's part
+        super().__init__(dsn=str(path), **options)
+        if driver not in DRIVERS:
+            raise ValueError(f"unknown driver {driver}")
+        if driver == "turso" and turso is None:
+            raise ValueError("driver turso needs the pyturso package")
+        self.path = Path(path)
+        self.driver = driver
+        self.conn = None
+        self.cursor = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def open(self):
+        if self.driver == "turso":
+            self.conn = turso.connect(str(self.path))
+        else:
+            # journal_mode can't change inside the transaction that
+            # autocommit=False keeps open, so set the pragmas first
+            self.conn = sqlite3.connect(self.path, autocommit=True)
+        # one cursor for the connection's life: closing a turso cursor
+        # closes its connection too
+        self.cursor = self.conn.cursor()
+        query(self.cursor, "PRAGMA journal_mode=WAL")
+        query(self.cursor, "PRAGMA synchronous=NORMAL")
+        if self.driver == "sqlite3":
+            self.conn.autocommit = False
+
+    def transaction(self, work: Callable):
+        """work(cursor), then one commit; both drivers begin implicitly"""
+        try:
+            result = work(self.cursor)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return result
+
+    async def run(self, work: Callable):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.transaction, work
+        )
+
+    async def connect(self):
+        # the connection isn't tied to a loop, so reconnecting keeps it
+        if self.conn is None:
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="localdb")
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.open)
+        await self.init_schema()
+        return self
+
+    async def init_schema(self):
+        def work(cur):
+            for statement in SCHEMA:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT OR IGNORE INTO sequences (name, value) "
+                "SELECT 'rollouts', COALESCE(MAX(id), 0) FROM rollouts"
+            )
+
+        await self.run(work)
+
+    async def start_train_run(self, train_run: int, train_commit: Optional[str] = None):
+        await self.run(
+            lambda cur: query(
+                cur,
+                "INSERT OR IGNORE INTO train_runs (train_run, train_commit, created_at) "
+                "VALUES (?, ?, ?)",
+                (train_run, train_commit, now()),
+            )
+        )
+        self.train_run = train_run
+
+    async def reserve_rollout_ids(self, n: int) -> list[int]:
+        def work(cur):
+            ((last,),) = query(
+                cur, "SELECT value FROM sequences WHERE name = 'rollouts'"
+            )
+            cur.execute(
+                "UPDATE sequences SET value = ? WHERE name = 'rollouts'", (last + n,)
+            )
+            return list(range(last + 1, last + n + 1))
+
+        return await self.run(work)
+
+    async def add_rollout(
+        self,
+        train_step: int,
+        rollout_name: str,
+        blackbox: str,
+        reward: float = 0.0,
+        train_run: Optional[int] = None,
+        train_commit: Optional[str] = None,
+    ) -> int:
+        (rollout_id,) = await self.reserve_rollout_ids(1)
+        await self.insert_rollouts(
+            [
+                {
+                    "id": rollout_id,
+                    "train_run": train_run,
+                    "train_step": train_step,
+                    "train_commit": train_commit,
+                    "rollout_name": rollout_name,
+                    "blackbox": blackbox,
+                    "reward": reward,
+                }
+            ]
+        )
+        self.begin_events(rollout_id)
+        return rollout_id
+
+    async def insert_rollouts(self, rows: list[dict]):
+        created_at = now()
+        records = []
+        for row in rows:
+            record = [row.get(key, default) for key, default in ROLLOUT_COLUMNS.items()]
+            record[1] = -1 if record[1] is None else record[1]
+            records.append((*record, created_at))
+
+        def work(cur):
+            for record in records:
+                cur.execute(
+                    f"INSERT INTO rollouts ({', '.join(ROLLOUT_COLUMNS)}, created_at) "
+                    f"VALUES ({', '.join('?' * (len(ROLLOUT_COLUMNS) + 1))})",
+                    record,
+                )
+            for record in records:
+                train_run, blackbox, reward = record[1], record[5], record[6]
+                cur.execute(
+                    """INSERT INTO blackbox_stats
+                           (train_run, blackbox_hash, blackbox, rollouts, reward_sum, latest_created_at)
+                       VALUES (?, ?, ?, 1, ?, ?)
+                       ON CONFLICT (train_run, blackbox_hash) DO UPDATE SET
+                           rollouts = rollouts + 1,
+                           reward_sum = reward_sum + excluded.reward_sum,
+                           latest_created_at = MAX(latest_created_at, excluded.latest_created_at)""",
+                    (train_run, md5(blackbox), blackbox, reward, created_at),
+                )
+
+        await self.run(work)
+
+    async def update_rewards(self, rewards: list[tuple[int, float]]):
+        def work(cur):
+            for rollout_id, reward in rewards:
+                rows = query(
+                    cur,
+                    "SELECT train_run, blackbox, reward FROM rollouts WHERE id = ?",
+                    (rollout_id,),
+                )
+                if not rows:
+                    continue
+                (old,) = rows
+                cur.execute(
+                    "UPDATE rollouts SET reward = ? WHERE id = ?", (reward, rollout_id)
+                )
+                cur.execute(
+                    """UPDATE blackbox_stats SET reward_sum = reward_sum + ?
+                       WHERE train_run = ? AND blackbox_hash = ?""",
+                    (reward - old[2], old[0], md5(old[1])),
+                )
+
+        await self.run(work)
+
+    async def update_trajectories(self, rows: list[tuple]):
+        def work(cur):
+            for rollout_id, *columns in rows:
+                cur.execute(
+                    """UPDATE rollouts
+                       SET trajectory = ?, trajectory_zstd = ?, trajectory_summary = ?,
+                           num_turns = ?, solved = ?
+                       WHERE id = ?""",
+                    (*columns, rollout_id),
+                )
+
+        await self.run(work)
+
+    async def get_trajectory(self, rollout_id: int) -> Optional[Trajectory]:
+        rows = await self.run(
+            lambda cur: query(
+                cur,
+                """SELECT trajectory, trajectory_zstd, trajectory_summary
+                   FROM rollouts WHERE id = ?""",
+                (rollout_id,),
+            )
+        )
+        if not rows:
+            return None
+        ((messages, blob, summary),) = rows
+        return Trajectory(
+            json.loads(summary) if summary is not None else None,
+            blob=bytes(blob) if blob is not None else None,
+            messages=json.loads(messages) if messages is not None else None,
+        )
+
+    async def write_events(self, records: list[tuple]):
+        rows = [
+            (rollout_id, seq, event, data, created_at.isoformat())
+            for rollout_id, seq, event, data, created_at in records
+        ]
+
+        def work(cur):
+            for row in rows:
+                cur.execute(
+                    "INSERT INTO rollout_events (rollout_id, seq, event, data, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    row,
+                )
+
+        await self.run(work)
+
+    async def next_seq(self, rollout_id: int) -> int:
+        ((seq,),) = await self.run(
+            lambda cur: query(
+                cur,
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM rollout_events "
+                "WHERE rollout_id = ?",
+                (rollout_id,),
+            )
+        )
+        return seq
+
+    async def get_events(self, rollout_id: int) -> list[dict]:
+        """the rollout's log in order, what postgres' rollout_logs view rebuilds"""
+        rows = await self.run(
+            lambda cur: query(
+                cur,
+                """SELECT created_at, event, data FROM rollout_events
+                   WHERE rollout_id = ? ORDER BY seq""",
+                (rollout_id,),
+            )
+        )
+        return [
+            {"timestamp": created_at, "event": event, "data": json.loads(data)}
+            for created_at, event, data in rows
+        ]
+
+    async def fetch_window(self, window_size: int) -> list[dict]:
+        rows = await self.run(
+            lambda cur: query(cur, RECENT_STATS, (window_size * WINDOW_SCAN_FACTOR,))
+        )
+        # each blackbox from the latest run it appeared in, newest first
+        latest: dict[str, tuple] = {}
+        for row in rows:
+            if row[1] not in latest or row[0] > latest[row[1]][0]:
+                latest[row[1]] = row
+        recent = sorted(latest.values(), key=lambda row: row[4], reverse=True)
+        return [
+            {"blackbox": blackbox, "mean_reward": float(mean_reward)}
+            for _, _, blackbox, mean_reward, _ in recent[:window_size]
+        ]
+
+    async def get_next_train_run(self) -> int:
+        ((max_run,),) = await self.run(
+            lambda cur: query(cur, "SELECT MAX(train_run) FROM train_runs")
+        )
+        return (max_run + 1) if max_run is not None and max_run > 0 else 1
+
+    async def close(self):
+        if self.flusher is not None:
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        if self.conn is not None:
+            # closed and released on its own thread, which turso insists on
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.release
+            )
+            self.executor.shutdown()
+            self.executor = None
+
+    def release(self):
+        self.cursor = None
+        conn, self.conn = self.conn, None
+        conn.close()
@@ -0,0 +1,621 @@
+import asyncio
+import random
+import shlex
+import shutil
+import tempfile
+from collections import deque
+from datetime import datetime, timezone
+from importlib.util import find_spec
+from os import environ, mkdir
+from time import monotonic
+from typing import Optional
+from weakref import WeakKeyDictionary
+import httpx
+from capture import Output, remote_command, run_process
+import xxhash
+from uuid import uuid4
+
+
+# only these are safe to resend after the server may have acted on them
+IDEMPOTENT = {"GET", "HEAD", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SharedClient:
+    """one keep-alive httpx client per event loop for every Sandbox, with a cap
+    on in-flight requests and backoff retries on 429 / 5xx"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.transport = transport
+        self.clients: WeakKeyDictionary = WeakKeyDictionary()
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def client(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            client = httpx.AsyncClient(
+                http2=find_spec("h2") is not None,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                transport=self.transport,
+            )
+            self.clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return self.clients[loop]
+
+    def delay(self, attempt: int, resp: Optional[httpx.Response]) -> float:
+        retry_after = resp.headers.get("retry-after") if resp is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        base = min(self.backoff * 2**attempt, self.max_backoff)
+        return base * random.uniform(0.5, 1.0)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """send with retries; the last response is returned even if it failed"""
+        client, semaphore = self.client()
+        retry_on_status = method in IDEMPOTENT
+        attempt = 0
+        while True:
+            resp = None
+            async with semaphore:
+                self.in_flight += 1
+                self.requests += 1
+                try:
+                    resp = await client.request(method, url, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                    # never reached the server, safe to resend any method
+                    if attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                except httpx.TransportError:
+                    if not retry_on_status or attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                finally:
+                    self.in_flight -= 1
+
+            if resp is not None:
+                retryable = resp.status_code == 429 or (
+                    retry_on_status and resp.status_code in RETRY_STATUSES
+                )
+                if not retryable or attempt >= self.max_retries:
+                    if resp.is_error:
+                        self.failures += 1
+                    return resp
+
+            self.retries += 1
+            await asyncio.sleep(self.delay(attempt, resp))
+            attempt += 1
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        entry = self.clients.pop(loop, None)
+        if entry is not None:
+            await entry[0].aclose()
+
+
+shared_client = SharedClient()
+
+
+class MachinesAPI:
+    """thin client for the fly.io machines api plus `flyctl machine exec`"""
+
+    def __init__(self, app_name: str = "unboxer", http: Optional[SharedClient] = None):
+        self.app_name = app_name
+        self.http = http if http is not None else shared_client
+        self.fly_api_token = environ.get("FLY_API_TOKEN")
+        if not self.fly_api_token:
+            raise ValueError("FLY_API_TOKEN not found in environment")
+
+        self.base_url = "https://api.machines.dev/v1"
+        self.headers = {
+            "Authorization": f"Bearer {self.fly_api_token}",
+            "Content-Type": "application/json",
+        }
+
+    @property
+    def app_url(self) -> str:
+        return f"{self.base_url}/apps/{self.app_name}"
+
+    async def create_volume(self, payload: dict) -> dict:
+        resp = await self.http.request(
+            "POST", f"{self.app_url}/volumes", headers=self.headers, json=payload
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def create_machine(self, payload: dict) -> dict:
+        resp = await self.http.request(
+            "POST", f"{self.app_url}/machines", headers=self.headers, json=payload
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_machine(self, machine_id: str) -> dict:
+        resp = await self.http.request(
+            "GET", f"{self.app_url}/machines/{machine_id}", headers=self.headers
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def wait_for_state(
+        self, machine_id: str, state: str, timeout: float = 60
+    ) -> bool:
+        """server-side blocking wait, False if `timeout` seconds pass first"""
+        seconds = int(min(max(timeout, 1), 60))
+        resp = await self.http.request(
+            "GET",
+            f"{self.app_url}/machines/{machine_id}/wait",
+            headers=self.headers,
+            params={"state": state, "timeout": seconds},
+            timeout=seconds + 10,
+        )
+        if resp.status_code == 408:
+            return False
+        resp.raise_for_status()
+        return True
+
+    async def list_machines(self) -> list[dict]:
+        resp = await self.http.request(
+            "GET", f"{self.app_url}/machines", headers=self.headers
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def list_volumes(self) -> list[dict]:
+        resp = await self.http.request(
+            "GET", f"{self.app_url}/volumes", headers=self.headers
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def delete_machine(self, machine_id: str, force: bool = False):
+        await self.http.request(
+            "DELETE",
+            f"{self.app_url}/machines/{machine_id}",
+            headers=self.headers,
+            params={"force": "true"} if force else None,
+        )
+
+    async def delete_volume(self, volume_id: str):
+        await self.http.request(
+            "DELETE", f"{self.app_url}/volumes/{volume_id}", headers=self.headers
+        )
+
+    def ssh_host(self, machine_id: str) -> Optional[str]:
+        """private-network address of the machine's sshd, reachable over wireguard"""
+        return f"{machine_id}.vm.{self.app_name}.internal"
+
+    async def exec(
+        self, machine_id: str, command: str, timeout: float, max_bytes: int
+    ) -> Output:
+        """run `sh -c command` on the machine, killed remotely after `timeout`"""
+        return await run_process(
+            [
+                "flyctl",
+                "machine",
+                "exec",
+                "-a",
+                self.app_name,
+                machine_id,
+                remote_command(command, timeout),
+            ],
+            timeout,
+            max_bytes,
+        )
+
+
+# machine paths the fake maps into each machine's temp dir; /tmp goes first
+# since the temp dir itself usually lives under it
+FAKE_PATHS = {"/tmp": "tmp", "/workspace": "workspace", "~agent": "home"}
+
+
+class FakeMachinesAPI:
+    """in-process stand-in for tests: machines start instantly and each one's
+    /workspace, /tmp and ~agent are local temp dirs that commands run against"""
+
+    def __init__(self, app_name: str = "unboxer"):
+        self.app_name = app_name
+        self.machines: dict[str, dict] = {}
+        self.volumes: dict[str, dict] = {}
+        self.created = 0
+        self.deleted = 0
+
+    async def create_volume(self, payload: dict) -> dict:
+        volume_id = f"vol_{xxhash.xxh64(str(uuid4()).encode()).hexdigest()[:14]}"
+        self.volumes[volume_id] = {
+            "id": volume_id,
+            "attached_machine_id": None,
+            "created_at": now(),
+            **payload,
+        }
+        return self.volumes[volume_id]
+
+    async def create_machine(self, payload: dict) -> dict:
+        machine_id = xxhash.xxh64(str(uuid4()).encode()).hexdigest()[:14]
+        root = tempfile.mkdtemp(prefix="fake_machine_")
+        for path in FAKE_PATHS.values():
+            mkdir(f"{root}/{path}")
+        self.machines[machine_id] = {
+            "id": machine_id,
+            "state": "started",
+            "root": root,
+            "created_at": now(),
+            **payload,
+        }
+        for mount in payload.get("config", {}).get("mounts", []):
+            if mount["volume"] in self.volumes:
+                self.volumes[mount["volume"]]["attached_machine_id"] = machine_id
+        self.created += 1
+        return self.machines[machine_id]
+
+    async def get_machine(self, machine_id: str) -> dict:
+        if machine_id not in self.machines:
+            raise httpx.HTTPStatusError(
+                "machine not found",
+                request=httpx.Request("GET", machine_id),
+                response=httpx.Response(404),
+            )
+        return self.machines[machine_id]
+
+    async def wait_for_state(
+        self, machine_id: str, state: str, timeout: float = 60
+    ) -> bool:
+        return (await self.get_machine(machine_id))["state"] == state
+
+    async def list_machines(self) -> list[dict]:
+        return list(self.machines.values())
+
+    async def list_volumes(self) -> list[dict]:
+        return list(self.volumes.values())
+
+    async def delete_machine(self, machine_id: str, force: bool = False):
+        machine = self.machines.pop(machine_id, None)
+        if machine is not None:
+            shutil.rmtree(machine["root"], ignore_errors=True)
+            for volume in self.volumes.values():
+                if volume.get("attached_machine_id") == machine_id:
+                    volume["attached_machine_id"] = None
+            self.deleted += 1
+
+    async def delete_volume(self, volume_id: str):
+        self.volumes.pop(volume_id, None)
+
+    def ssh_host(self, machine_id: str) -> Optional[str]:
+        return None
+
+    async def exec(
+        self, machine_id: str, command: str, timeout: float, max_bytes: int
+    ) -> Output:
+        root = self.machines[machine_id]["root"]
+        for path, local in FAKE_PATHS.items():
+            command = command.replace(path, f"{root}/{local}")
+        workspace = f"{root}/workspace"
+        return await run_process(
+            [
+                "sh",
+                "-c",
+                f"cd {shlex.quote(workspace)} && {remote_command(command, timeout)}",
+            ],
+            timeout,
+            max_bytes,
+        )
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def age(record: dict) -> float:
+    """seconds since a machines api record was created, inf if unknown"""
+    try:
+        created = datetime.fromisoformat(record["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return float("inf")
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
+
+# machine and volume ids this process created and hasn't destroyed yet
+live: set[str] = set()
+
+
+def local_tasks(tasks) -> list:
+    """the ones started on the running loop; a task left on another loop (the
+    trainer's generation loop, closed by shutdown) can't be awaited or cancelled"""
+    loop = asyncio.get_running_loop()
+    return [task for task in tasks if task.get_loop() is loop]
+
+
+class TeardownQueue:
+    """destroys sandboxes in the background, at most `concurrency` at a time,
+    so episode completion never waits on the machines api"""
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = concurrency
+        self.semaphores: WeakKeyDictionary = WeakKeyDictionary()
+        self.tasks: set[asyncio.Task] = set()
+        self.destroyed = 0
+        self.failed = 0
+
+    def submit(self, sandbox):
+        task = asyncio.ensure_future(self.destroy(sandbox))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    async def destroy(self, sandbox):
+        async with self.semaphore():
+            try:
+                await sandbox.destroy()
+                self.destroyed += 1
+            except Exception:
+                # whatever is left behind is the reaper's problem
+                self.failed += 1
+
+    async def drain(self):
+        # a finished task leaves `tasks` in a callback, which awaiting an
+        # already-done gather never yields to, so skip those
+        while tasks := [t for t in local_tasks(self.tasks) if not t.done()]:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.tasks),
+            "destroyed": self.destroyed,
+            "failed": self.failed,
+        }
+
+
+class Reaper:
+    """deletes `sandbox_*` machines and `vol_*` volumes nobody owns any more.
+
+    other processes share the app, so anything younger than `min_age` is left
+    alone; it should comfortably exceed an episode plus SandboxPool.max_age"""
+
+    def __init__(self, api, min_age: float = 2 * 3600, interval: float = 600):
+        self.api = api
+        self.min_age = min_age
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.reclaimed = {"machines": 0, "volumes": 0}
+
+    async def reap(self, dry_run: bool = False) -> dict:
+        machines = [
+            m
+            for m in await self.api.list_machines()
+            if m.get("name", "").startswith("sandbox_")
+            and m["id"] not in live
+            and m.get("state") != "destroyed"
+            and age(m) >= self.min_age
+        ]
+        doomed = {m["id"] for m in machines}
+        volumes = [
+            v
+            for v in await self.api.list_volumes()
+            if v.get("name", "").startswith("vol_")
+            and v["id"] not in live
+            and v.get("state") != "destroyed"
+            and (
+                v.get("attached_machine_id") in doomed
+                or (v.get("attached_machine_id") is None and age(v) >= self.min_age)
+            )
+        ]
+
+        if not dry_run:
+            for machine in machines:
+                await self.api.delete_machine(machine["id"], force=True)
+            for volume in volumes:
+                await self.api.delete_volume(volume["id"])
+            self.reclaimed["machines"] += len(machines)
+            self.reclaimed["volumes"] += len(volumes)
+
+        return {
+            "dry_run": dry_run,
+            "machines": [{"id": m["id"], "name": m.get("name")} for m in machines],
+            "volumes": [{"id": v["id"], "name": v.get("name")} for v in volumes],
+        }
+
+    async def run(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            if not self.task.get_loop().is_closed():
+                self.task.cancel()
+            self.task = None
+
+
+# kills whatever the episode left running as the agent user (sparing the
+# proxy and this command's own ssh / exec chain), then wipes every place it
+# could have written to
+RESET_COMMAND = """keep=" $(pgrep -d ' ' -x proxy) "
+pid=$$
+while [ "$pid" -gt 1 ]; do keep="$keep$pid "; pid=$(ps -o ppid= -p "$pid" | tr -d ' '); done
+for p in $(pgrep -u agent); do
+    case "$keep" in *" $p "*) ;; *) kill -KILL "$p" 2>/dev/null ;; esac
+done
+find /workspace /tmp ~agent -mindepth 1 -delete && echo sandbox-reset"""
+
+
+class SandboxPool:
+    """owns `size` started remote sandboxes so setup_state doesn't pay volume +
+    machine creation; machines are reset and reused until they hit `max_uses`
+    or `max_age` seconds, then destroyed and replaced in the background"""
+
+    def __init__(
+        self,
+        size: int = 4,
+        max_uses: int = 20,
+        max_age: float = 3600,
+        api=None,
+        teardown: Optional[TeardownQueue] = None,
+        **sandbox_options,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.api = api
+        self.sandbox_options = sandbox_options
+        self.ready: deque = deque()
+        self.pending: set[asyncio.Task] = set()
+        # resets in flight; their machines still belong to the pool
+        self.resetting: set[asyncio.Task] = set()
+        self.teardown = teardown if teardown is not None else TeardownQueue()
+        self.leased = 0
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+
+    def new_sandbox(self):
+        from sandbox import Sandbox
+
+        return Sandbox(api=self.api, **self.sandbox_options)
+
+    async def provision(self):
+        sandbox = self.new_sandbox()
+        await sandbox.create()
+        return sandbox
+
+    def owned(self) -> int:
+        return len(self.ready) + len(self.pending) + len(self.resetting) + self.leased
+
+    def fill(self):
+        """provision in the background until the pool owns `size` machines"""
+        while not self.closed and self.owned() < self.size:
+            task = asyncio.ensure_future(self.provision())
+            self.pending.add(task)
+            task.add_done_callback(self.provisioned)
+
+    def provisioned(self, task: asyncio.Task):
+        self.pending.discard(task)
+        if task.cancelled() or task.exception() is not None:
+            return
+        sandbox = task.result()
+        if self.closed:
+            self.retire(sandbox)
+        else:
+            self.ready.append(sandbox)
+
+    def expired(self, sandbox) -> bool:
+        return (
+            sandbox.uses >= self.max_uses
+            or monotonic() - sandbox.created_at >= self.max_age
+        )
+
+    async def acquire(self):
+        """a started sandbox, the most recently returned one when any are ready"""
+        while self.ready and self.expired(self.ready[0]):
+            self.retire(self.ready.popleft())
+
+        self.leased += 1
+        if self.ready:
+            self.hits += 1
+            sandbox = self.ready.pop()
+        else:
+            self.misses += 1
+            self.fill()
+            try:
+                sandbox = await self.provision()
+            except BaseException:
+                self.leased -= 1
+                raise
+        sandbox.uses += 1
+        return sandbox
+
+    async def release(self, sandbox):
+        """reset the machine and hand it back, or destroy it if the reset
+        fails, it has served its quota or the pool is closed or at `size`"""
+        self.leased -= 1
+        if self.closed or self.expired(sandbox) or self.owned() >= self.size:
+            self.retire(sandbox)
+            return
+
+        task = asyncio.ensure_future(sandbox.bash(RESET_COMMAND))
+        self.resetting.add(task)
+        try:
+            output = await task
+        except asyncio.CancelledError:
+            self.retire(sandbox)
+            raise
+        except Exception:
+            output = ""
+        finally:
+            self.resetting.discard(task)
+        # the pool may have closed or refilled while this one was resetting
+        if "sandbox-reset" not in output or self.closed or self.owned() >= self.size:
+            self.retire(sandbox)
+            return
+        self.ready.append(sandbox)
+
+    def retire(self, sandbox):
+        """destroy in the background and provision a replacement"""
+        self.recycled += 1
+        self.teardown.submit(sandbox)
+        self.fill()
+
+    async def close(self):
+        self.closed = True
+        pending = local_tasks(self.pending)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # releases retire their machines once the reset they're awaiting ends
+        await asyncio.gather(*local_tasks(self.resetting), return_exceptions=True)
+        while self.ready:
+            self.retire(self.ready.popleft())
+        await self.teardown.drain()
+
+    def stats(self) -> dict:
+        return {
+            "ready": len(self.ready),
+            "pending": len(self.pending),
+            "resetting": len(self.resetting),
+            "leased": self.leased,
+            "hits": self.hits,
+            "misses": self.misses,
+            "recycled": self.recycled,
+        }
@@ -0,0 +1,247 @@
+import asyncio
+from time import perf_counter
+from typing import Optional
+from timing import Histogram
+
+
+class RolloutRecorder:
+    """write-behind front for RolloutsDB's rollout writes. calls return once
+    the write is queued; a background task coalesces them per rollout and
+    commits each batch with one statement per kind. writers wait when
+    `max_pending` writes are queued, and flush() waits for everything queued
+    so far to land"""
+
+    def __init__(
+        self,
+        db,
+        max_pending: int = 10_000,
+        id_block: int = 64,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.db = db
+        self.max_pending = max_pending
+        self.id_block = id_block
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.ids: list[int] = []
+        self.ids_lock: Optional[asyncio.Lock] = None
+        # rollout id -> row still to insert, later writes merge into it
+        self.rollouts: dict[int, dict] = {}
+        # rollout id -> latest value, for rows already inserted or in flight
+        self.rewards: dict[int, float] = {}
+        self.trajectories: dict[int, tuple] = {}
+        self.events: list[tuple] = []
+
+        self.waiters: list[asyncio.Future] = []
+        self.wake: Optional[asyncio.Event] = None
+        self.space: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.writing = False
+
+        self.flush_latency = Histogram()
+        self.max_depth = 0
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+        self.backpressured = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def depth(self) -> int:
+        return (
+            len(self.rollouts)
+            + len(self.rewards)
+            + len(self.trajectories)
+            + len(self.events)
+        )
+
+    def start(self):
+        # a writer left on another loop (one that's been closed, say) never runs again
+        if (
+            self.task is None
+            or self.task.done()
+            or self.task.get_loop() is not asyncio.get_running_loop()
+        ):
+            self.ids_lock = None
+            self.wake = asyncio.Event()
+            self.space = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+
+    async def enqueued(self):
+        """kick the writer, then hold the caller while the queue is full"""
+        self.start()
+        self.max_depth = max(self.max_depth, self.depth())
+        self.wake.set()
+        while self.depth() >= self.max_pending and not self.task.done():
+            self.backpressured += 1
+            self.space.clear()
+            await self.space.wait()
+
+    async def next_id(self) -> int:
+        if self.ids_lock is None:
+            self.ids_lock = asyncio.Lock()
+        async with self.ids_lock:
+            if not self.ids:
+                self.ids = await self.db.reserve_rollout_ids(self.id_block)
+            return self.ids.pop(0)
+
+    async def add_rollout(
+        self,
+        train_step: int,
+        rollout_name: str,
+        blackbox: str,
+        reward: float = 0.0,
+        train_run: Optional[int] = None,
+        train_commit: Optional[str] = None,
+    ) -> int:
+        """the id comes from a reserved block, so it's usable before the row lands"""
+        rollout_id = await self.next_id()
+        self.db.begin_events(rollout_id)
+        self.rollouts[rollout_id] = {
+            "id": rollout_id,
+            "train_run": train_run,
+            "train_step": train_step,
+            "train_commit": train_commit,
+            "rollout_name": rollout_name,
+            "blackbox": blackbox,
+            "reward": reward,
+        }
+        await self.enqueued()
+        return rollout_id
+
+    async def update_reward(self, rollout_id: int, reward: float):
+        row = self.rollouts.get(rollout_id)
+        if row is not None:
+            row["reward"] = reward
+            self.coalesced += 1
+        else:
+            self.coalesced += rollout_id in self.rewards
+            self.rewards[rollout_id] = reward
+        await self.enqueued()
+
+    async def update_trajectory(
+        self,
+        rollout_id: int,
+        trajectory: list,
+        num_turns: int,
+        solved: bool,
+        tokens: Optional[dict] = None,
+    ):
+        columns = self.db.trajectory_columns(trajectory, tokens)
+        row = self.rollouts.get(rollout_id)
+        if row is not None:
+            row.update(columns, num_turns=num_turns, solved=solved)
+            self.coalesced += 1
+        else:
+            self.coalesced += rollout_id in self.trajectories
+            self.trajectories[rollout_id] = (
+                rollout_id,
+                *columns.values(),
+                num_turns,
+                solved,
+            )
+        await self.enqueued()
+
+    async def append_log(self, rollout_id: int, event: str, data: dict):
+        self.events.append(await self.db.event_record(rollout_id, event, data))
+        await self.enqueued()
+
+    async def flush(self) -> bool:
+        """wait until every write queued before this call is committed or
+        dropped; False when something was dropped, which is counted in stats()
+        rather than raised, since the batch may hold other rollouts' writes"""
+        if not self.depth() and not self.writing:
+            return True
+        self.start()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.wake.set()
+        return await waiter
+
+    async def finish(self, rollout_id: int) -> bool:
+        """flush at the end of a rollout, then stop tracking its event seq"""
+        try:
+            return await self.flush()
+        finally:
+            self.db.end_events(rollout_id)
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            # swap everything out at once so a flush() waiter covers exactly
+            # the writes queued before it
+            rollouts, self.rollouts = self.rollouts, {}
+            rewards, self.rewards = self.rewards, {}
+            trajectories, self.trajectories = self.trajectories, {}
+            events, self.events = self.events, []
+            waiters, self.waiters = self.waiters, []
+            self.space.set()
+
+            self.writing = True
+            start = perf_counter()
+            try:
+                error = await self.write(rollouts, rewards, trajectories, events)
+            finally:
+                self.writing = False
+            self.flush_latency.add(perf_counter() - start)
+            self.flushes += 1
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(error is None)
+
+    async def write(
+        self, rollouts: dict, rewards: dict, trajectories: dict, events: list
+    ) -> Optional[Exception]:
+        """inserts first so updates and events find their rows; each kind is
+        retried with backoff, then dropped so one bad batch can't wedge the queue.
+        returns the last error of anything dropped"""
+        steps = [
+            (self.db.insert_rollouts, list(rollouts.values())),
+            (self.db.update_rewards, list(rewards.items())),
+            (self.db.update_trajectories, list(trajectories.values())),
+            (self.db.write_events, events),
+        ]
+        error = None
+        for write, rows in steps:
+            if not rows:
+                continue
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await write(rows)
+                    self.written += len(rows)
+                    break
+                except Exception as e:
+                    self.errors += 1
+                    if attempt == self.max_retries:
+                        self.dropped += len(rows)
+                        error = e
+                    else:
+                        await asyncio.sleep(self.backoff * 2**attempt)
+        return error
+
+    async def close(self):
+        """flush what's queued and stop the writer"""
+        try:
+            await self.flush()
+        finally:
+            if self.task is not None:
+                self.task.cancel()
+                await asyncio.gather(self.task, return_exceptions=True)
+                self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "max_depth": self.max_depth,
+            "flushes": self.flushes,
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "backpressured": self.backpressured,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "flush": self.flush_latency.summary(),
+        }
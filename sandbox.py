@@ -1,16 +1,62 @@
 import asyncio
-import httpx
+from array import array
+import signal
 from pathlib import Path
 from os import environ
 from json import loads, dumps
 from subprocess import run
 from result import Result, Ok, Err
-from typing import Optional
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional, Sequence
 from uuid import uuid4
+from weakref import WeakKeyDictionary
 import xxhash
+from workers import BulkBuffer, WorkerPool, WorkerError
+from cache import ResultCache
+from machines import MachinesAPI
+from capture import Output
+import machines
+from ssh import SSHSession
+import ssh
+import fasteval
+import timing
+import vector
+
+
+_template: Optional[str] = None
+
+# host-side failures that say nothing about the function, so never cached
+TRANSIENT_ERRORS = (
+    "python execution failed",
+    "json decode failed",
+    "malformed batch reply",
+)
+
+
+def template_code() -> str:
+    global _template
+    if _template is None:
+        with timing.phase("template_read"):
+            _template = (Path(__file__).parent / "sandbox.template.py").read_text()
+    return _template
 
 
 class Sandbox:
+    pool: Optional[WorkerPool] = None
+    pool_size: int = int(environ.get("SANDBOX_POOL_SIZE", "4"))
+    pool_options: dict = {}
+    pool_lock = Lock()
+    max_concurrency: int = int(environ.get("SANDBOX_MAX_CONCURRENCY", "8"))
+    semaphores: WeakKeyDictionary = WeakKeyDictionary()
+    cache_entries: int = int(environ.get("SANDBOX_CACHE_ENTRIES", "100000"))
+    cache: Optional[ResultCache] = ResultCache(cache_entries) if cache_entries else None
+    fast_eval: bool = environ.get("SANDBOX_FAST_EVAL", "1") == "1"
+    vectorize_min_batch: int = int(environ.get("SANDBOX_VECTORIZE_MIN_BATCH", "64"))
+    call_cpu_seconds: float = float(environ.get("SANDBOX_CALL_CPU_SECONDS", "0.25"))
+    bash_timeout: float = float(environ.get("SANDBOX_BASH_TIMEOUT", "60"))
+    bash_max_bytes: int = int(environ.get("SANDBOX_BASH_MAX_BYTES", str(64 * 1024)))
+
     def __init__(
         self,
         app_name: str = "unboxer",
@@ -18,123 +64,147 @@ class Sandbox:
         volume_size_gb: int = 1,
         memory_mb: int = 512,
         cpus: int = 1,
+        api=None,
+        ssh_probe: bool = environ.get("SANDBOX_SSH_PROBE", "1") == "1",
     ):
         self.app_name = app_name
         self.region = region
         self.volume_size_gb = volume_size_gb
         self.memory_mb = memory_mb
         self.cpus = cpus
-        self.fly_api_token = environ.get("FLY_API_TOKEN")
-        if not self.fly_api_token:
-            raise ValueError("FLY_API_TOKEN not found in environment")
+        self.api = api if api is not None else MachinesAPI(app_name)
 
         self.machine_name = xxhash.xxh64(str(uuid4()).encode()).hexdigest()[:6]
         self.machine_id: Optional[str] = None
         self.volume_name: Optional[str] = None
         self.volume_id: Optional[str] = None
-        self.base_url = "https://api.machines.dev/v1"
-        self.headers = {
-            "Authorization": f"Bearer {self.fly_api_token}",
-            "Content-Type": "application/json",
-        }
+        self.created_at = monotonic()
+        self.uses = 0
+        self.ssh: Optional[SSHSession] = None
+        self.ssh_enabled = True
+        self.ssh_probe = ssh_probe
+        self.readiness: dict[str, float] = {}
 
     async def create(self) -> str:
-        async with httpx.AsyncClient() as client:
+        """volume_size_gb=0 skips the volume, for hosts whose tenants work on tmpfs"""
+        if self.volume_size_gb > 0:
             self.volume_name = f"vol_{self.machine_name}"
             volume_payload = {
                 "name": self.volume_name,
                 "size_gb": self.volume_size_gb,
                 "region": self.region,
             }
-
-            vol_resp = await client.post(
-                f"{self.base_url}/apps/{self.app_name}/volumes",
-                headers=self.headers,
-                json=volume_payload,
-            )
-            vol_resp.raise_for_status()
-            vol_data = vol_resp.json()
+            vol_data = await self.api.create_volume(volume_payload)
             self.volume_id = vol_data["id"]
+            machines.live.add(self.volume_id)
 
-            machine_payload = {
-                "name": f"sandbox_{self.machine_name}",
-                "region": self.region,
-                "config": {
-                    "image": f"registry.fly.io/{self.app_name}:latest",
-                    "services": [
-                        {
-                            "ports": [{"port": 22}],
-                            "protocol": "tcp",
-                            "internal_port": 2222,
-                        }
-                    ],
-                    "mounts": [
-                        {
-                            "volume": self.volume_id,
-                            "path": "/workspace",
-                        }
-                    ],
-                    "guest": {
-                        "cpu_kind": "shared",
-                        "cpus": self.cpus,
-                        "memory_mb": self.memory_mb,
-                    },
+        machine_payload = {
+            "name": f"sandbox_{self.machine_name}",
+            "region": self.region,
+            "config": {
+                "image": f"registry.fly.io/{self.app_name}:latest",
+                "services": [
+                    {
+                        "ports": [{"port": 22}],
+                        "protocol": "tcp",
+                        "internal_port": 2222,
+                    }
+                ],
+                "mounts": [
+                    {
+                        "volume": self.volume_id,
+                        "path": "/workspace",
+                    }
+                ]
+                if self.volume_id
+                else [],
+                "guest": {
+                    "cpu_kind": "shared",
+                    "cpus": self.cpus,
+                    "memory_mb": self.memory_mb,
                 },
-            }
-
-            machine_resp = await client.post(
-                f"{self.base_url}/apps/{self.app_name}/machines",
-                headers=self.headers,
-                json=machine_payload,
-            )
-            machine_resp.raise_for_status()
-            machine_data = machine_resp.json()
-            self.machine_id = machine_data["id"]
+            },
+        }
+        requested = monotonic()
+        machine_data = await self.api.create_machine(machine_payload)
+        self.machine_id = machine_data["id"]
+        machines.live.add(self.machine_id)
+        self.readiness["create_s"] = monotonic() - requested
 
-            await self.wait_for_machine()
+        await self.wait_for_machine()
+        self.created_at = monotonic()
+        self.readiness["ready_s"] = self.created_at - requested
+        timing.timings.record("machine_ready", self.readiness["ready_s"])
 
-            return self.machine_id
+        return self.machine_id
 
     async def wait_for_machine(self, timeout: int = 120):
-        start = asyncio.get_event_loop().time()
-        async with httpx.AsyncClient() as client:
-            while True:
-                if asyncio.get_event_loop().time() - start > timeout:
-                    raise TimeoutError(
-                        f"machine {self.machine_id} did not start in {timeout}s"
-                    )
-
-                resp = await client.get(
-                    f"{self.base_url}/apps/{self.app_name}/machines/{self.machine_id}",
-                    headers=self.headers,
+        """block on the api's state transition, then on sshd if we'll use it"""
+        start = monotonic()
+        while True:
+            remaining = timeout - (monotonic() - start)
+            if await self.api.wait_for_state(self.machine_id, "started", remaining):
+                break
+            if monotonic() - start > timeout:
+                raise TimeoutError(
+                    f"machine {self.machine_id} did not start in {timeout}s"
                 )
-                resp.raise_for_status()
-                data = resp.json()
+        self.readiness["started_s"] = monotonic() - start
 
-                if data.get("state") == "started":
-                    break
+        if self.ssh_probe and await self.probe_ssh(timeout - (monotonic() - start)):
+            self.readiness["ssh_s"] = monotonic() - start
 
-                await asyncio.sleep(2)
+    async def probe_ssh(self, timeout: float) -> bool:
+        """connect the persistent session now so the first bash never races sshd
+        startup; gives up on ssh for this machine if it never answers"""
+        host = self.api.ssh_host(self.machine_id) if ssh.available() else None
+        if host is None:
+            return False
 
-    async def bash(self, command: str) -> str:
-        if not self.machine_id:
-            raise ValueError("machine not created yet")
+        self.ssh = SSHSession(host)
+        deadline = monotonic() + max(timeout, 1)
+        delay = 0.05
+        while True:
+            try:
+                await self.ssh.connection()
+                return True
+            except (OSError, ssh.asyncssh.Error):
+                if monotonic() + delay > deadline:
+                    await self.close_ssh()
+                    self.ssh_enabled = False
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
 
-        import shlex
-        
-        shell_cmd = f"sh -c {shlex.quote(command)}"
-        full_command = f"flyctl machine exec -a {self.app_name} {self.machine_id} {shlex.quote(shell_cmd)}"
+    async def bash(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> str:
+        return (await self.bash_result(command, timeout, max_bytes))["output"]
 
-        proc = await asyncio.create_subprocess_shell(
-            full_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+    async def bash_result(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> dict:
+        """combined output for the agent plus truncation / timeout metadata"""
+        if not self.machine_id:
+            raise ValueError("machine not created yet")
 
-        stdout, stderr = await proc.communicate()
+        if timeout is None:
+            timeout = Sandbox.bash_timeout
+        if max_bytes is None:
+            max_bytes = Sandbox.bash_max_bytes
+        output = await self.run_remote(command, timeout, max_bytes)
+        return Sandbox.describe(output, timeout)
 
-        stdout_str = stdout.decode().strip()
-        stderr_str = stderr.decode().strip()
+    @staticmethod
+    def describe(output: Output, timeout: float) -> dict:
+        stdout_str = output.stdout.text().strip()
+        stderr_str = output.stderr.text().strip()
 
         combined = stdout_str
         if stderr_str:
@@ -143,54 +213,428 @@ class Sandbox:
             else:
                 combined = f"stderr:\n{stderr_str}"
 
-        return combined or "(no output)"
+        notes = []
+        if output.truncated:
+            notes.append(
+                f"output truncated: {output.stdout.total} stdout / "
+                f"{output.stderr.total} stderr bytes, middle omitted"
+            )
+        if output.timed_out:
+            notes.append(f"command killed after {timeout:g}s timeout")
+        if notes:
+            combined = "\n".join([combined, *(f"[{n}]" for n in notes)]).strip()
+
+        return {"output": combined or "(no output)", **output.metadata()}
+
+    async def run_remote(self, command: str, timeout: float, max_bytes: int) -> Output:
+        """persistent ssh when it's reachable, `flyctl machine exec` otherwise"""
+        if self.ssh is None and self.ssh_enabled and ssh.available():
+            host = self.api.ssh_host(self.machine_id)
+            if host is not None:
+                self.ssh = SSHSession(host)
+
+        if self.ssh is not None:
+            try:
+                await self.ssh.connection()
+            except (OSError, ssh.asyncssh.Error):
+                # no wireguard route or sshd not up, stop trying for this machine
+                await self.close_ssh()
+                self.ssh_enabled = False
+            else:
+                return await self.ssh.run(command, timeout, max_bytes)
+        return await self.api.exec(self.machine_id, command, timeout, max_bytes)
+
+    async def close_ssh(self):
+        if self.ssh is not None:
+            try:
+                await self.ssh.close()
+            except Exception:
+                pass
+            self.ssh = None
 
     async def destroy(self):
-        async with httpx.AsyncClient() as client:
-            if self.machine_id:
-                try:
-                    await client.delete(
-                        f"{self.base_url}/apps/{self.app_name}/machines/{self.machine_id}",
-                        headers=self.headers,
-                    )
-                except httpx.HTTPStatusError:
-                    pass
-
-            if self.volume_id:
-                try:
-                    await client.delete(
-                        f"{self.base_url}/apps/{self.app_name}/volumes/{self.volume_id}",
-                        headers=self.headers,
-                    )
-                except httpx.HTTPStatusError:
-                    pass
+        await self.close_ssh()
+        if self.machine_id:
+            await self.api.delete_machine(self.machine_id)
+        if self.volume_id:
+            await self.api.delete_volume(self.volume_id)
 
+        machines.live.discard(self.machine_id)
+        machines.live.discard(self.volume_id)
         self.machine_id = None
         self.volume_id = None
 
+    @classmethod
+    def configure_pool(cls, size: int, **options):
+        """set local worker pool size, 0 falls back to one-shot interpreters"""
+        with cls.pool_lock:
+            if cls.pool is not None:
+                cls.pool.close()
+            cls.pool = None
+            cls.pool_size = size
+            cls.pool_options = options
+
+    @classmethod
+    def get_pool(cls) -> Optional[WorkerPool]:
+        with cls.pool_lock:
+            if cls.pool is None and cls.pool_size > 0:
+                cls.pool = WorkerPool(
+                    template_code(),
+                    size=cls.pool_size,
+                    **{"call_cpu_seconds": cls.call_cpu_seconds, **cls.pool_options},
+                )
+            return cls.pool
+
     @staticmethod
     def local(fn: str, kwargs: dict) -> Result[dict, str]:
-        script_dir = Path(__file__).parent
-        sandbox_run_code = (script_dir / "sandbox.template.py").read_text()
+        return Sandbox.local_batch(fn, [kwargs])[0]
 
-        payload = dumps({"fn": fn, "kwargs": kwargs})
+    @staticmethod
+    def local_batch(fn: str, kwargs_list: list) -> list[Result[dict, str]]:
+        """evaluate every kwargs dict: cache first, then numpy for big batches,
+        then one sandbox round trip for the rest"""
+        results, misses = Sandbox.recall(fn, kwargs_list)
+        if misses:
+            todo = [kwargs_list[i] for i in misses]
+            if len(todo) >= Sandbox.vectorize_min_batch:
+                computed = Sandbox.local_vectorized(fn, todo)
+            else:
+                computed = Sandbox.batch(fn, todo)
+            Sandbox.remember(fn, todo, computed)
+            for i, result in zip(misses, computed):
+                results[i] = result
+        return results
+
+    @staticmethod
+    async def local_async(fn: str, kwargs: dict) -> Result[dict, str]:
+        return (await Sandbox.local_batch_async(fn, [kwargs]))[0]
 
+    @staticmethod
+    async def local_batch_async(fn: str, kwargs_list: list) -> list[Result[dict, str]]:
+        """awaitable local_batch that never blocks the event loop"""
+        results, misses = Sandbox.recall(fn, kwargs_list)
+        if misses:
+            todo = [kwargs_list[i] for i in misses]
+            if len(todo) >= Sandbox.vectorize_min_batch:
+                computed = await Sandbox.local_vectorized_async(fn, todo)
+            else:
+                computed = await Sandbox.batch_async(fn, todo)
+            Sandbox.remember(fn, todo, computed)
+            for i, result in zip(misses, computed):
+                results[i] = result
+        return results
+
+    @staticmethod
+    def local_bulk(
+        fn: str, columns: dict[str, Sequence[float]], timeout: float = 60
+    ) -> Result[tuple[array, dict[int, str]], str]:
+        """evaluate fn over equal-length float64 columns, one per argument.
+        inputs and outputs travel through a shared mmap and only a small
+        control message uses the pipe; returns float64 outputs (nan where a
+        row failed) and {row: error} for the failed rows"""
+        buffer = Sandbox.bulk_buffer(columns)
+        if buffer.is_err():
+            return buffer
+        buffer = buffer.ok()
         try:
-            result = run(
-                ["python3", "-c", sandbox_run_code],
-                input=payload,
-                capture_output=True,
-                text=True,
-                timeout=15,
+            executed = Sandbox.execute(
+                Sandbox.bulk_payload(fn, columns, buffer), timeout
             )
+            return Sandbox.unpack_bulk(executed, buffer)
+        finally:
+            buffer.close()
+
+    @staticmethod
+    async def local_bulk_async(
+        fn: str, columns: dict[str, Sequence[float]], timeout: float = 60
+    ) -> Result[tuple[array, dict[int, str]], str]:
+        buffer = Sandbox.bulk_buffer(columns)
+        if buffer.is_err():
+            return buffer
+        buffer = buffer.ok()
+        try:
+            executed = await Sandbox.execute_async(
+                Sandbox.bulk_payload(fn, columns, buffer), timeout
+            )
+            return Sandbox.unpack_bulk(executed, buffer)
+        finally:
+            buffer.close()
+
+    @staticmethod
+    def bulk_buffer(columns: dict[str, Sequence[float]]) -> Result[BulkBuffer, str]:
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            return Err("bulk columns must all have the same length")
+
+        buffer = BulkBuffer(lengths.pop() if lengths else 0, len(columns))
+        try:
+            with timing.phase("bulk_pack"):
+                for i, values in enumerate(columns.values()):
+                    buffer.write(i, values)
+        except (TypeError, ValueError) as e:
+            buffer.close()
+            return Err(f"bulk columns must be float64: {e}")
+        return Ok(buffer)
+
+    @staticmethod
+    def bulk_payload(fn: str, columns: dict, buffer: BulkBuffer) -> dict:
+        spec = {"path": buffer.path, "n": buffer.n, "args": list(columns)}
+        return {"fn": fn, "bulk": spec}
+
+    @staticmethod
+    def unpack_bulk(
+        executed: Result[dict, str], buffer: BulkBuffer
+    ) -> Result[tuple[array, dict[int, str]], str]:
+        if executed.is_err():
+            return executed
+        data = executed.ok()
+        if "error" in data:
+            return Err(data["error"])
+        if not isinstance(data.get("errors"), dict):
+            return Err(f"malformed bulk reply: {data}")
+        with timing.phase("bulk_unpack"):
+            errors = {int(row): error for row, error in data["errors"].items()}
+            return Ok((buffer.output(), errors))
+
+    @staticmethod
+    def recall(fn: str, kwargs_list: list) -> tuple[list, list[int]]:
+        """cached results with None holes, plus the indices still to compute"""
+        if Sandbox.cache is None:
+            return [None] * len(kwargs_list), list(range(len(kwargs_list)))
+        with timing.phase("cache"):
+            results = Sandbox.cache.get_many(fn, kwargs_list)
+        return results, [i for i, result in enumerate(results) if result is None]
+
+    @staticmethod
+    def remember(fn: str, kwargs_list: list, results: list[Result[dict, str]]):
+        """cache values and the function's own errors, never infrastructure failures"""
+        if Sandbox.cache is None:
+            return
+        keep = [
+            (kwargs, result)
+            for kwargs, result in zip(kwargs_list, results)
+            if result.is_ok() or not result.err().startswith(TRANSIENT_ERRORS)
+        ]
+        Sandbox.cache.put_many(fn, [k for k, _ in keep], [r for _, r in keep])
+
+    @classmethod
+    def configure_cache(cls, max_entries: int, max_bytes: int = 64 * 1024**2):
+        """replace the shared result cache, 0 entries disables it"""
+        cls.cache = ResultCache(max_entries, max_bytes) if max_entries > 0 else None
+
+    @staticmethod
+    def local_vectorized(fn: str, kwargs_list: list) -> list[Result[dict, str]]:
+        """one numpy pass over every row; rows numpy can't vouch for (domain
+        errors, overflow, inexact ints) and untranslatable fns use the sandbox"""
+        results, redo = Sandbox.vectorize(fn, kwargs_list)
+        rerun = Sandbox.batch(fn, [kwargs_list[i] for i in redo])
+        for i, result in zip(redo, rerun):
+            results[i] = result
+        return results
+
+    @staticmethod
+    async def local_vectorized_async(
+        fn: str, kwargs_list: list
+    ) -> list[Result[dict, str]]:
+        results, redo = Sandbox.vectorize(fn, kwargs_list)
+        rerun = await Sandbox.batch_async(fn, [kwargs_list[i] for i in redo])
+        for i, result in zip(redo, rerun):
+            results[i] = result
+        return results
+
+    @staticmethod
+    def vectorize(fn: str, kwargs_list: list) -> tuple[list, list[int]]:
+        """numpy results with None holes, plus the row indices left for the sandbox"""
+        compiled = vector.compile(fn)
+        if compiled.is_err():
+            return [None] * len(kwargs_list), list(range(len(kwargs_list)))
+
+        vectorized = compiled.ok()
+        cols = vector.columns(vectorized.args, kwargs_list)
+        if cols.is_err():
+            return [None] * len(kwargs_list), list(range(len(kwargs_list)))
+
+        with timing.phase("vectorize"):
+            values, kinds, bad = vectorized(cols.ok(), len(kwargs_list))
+        results = [
+            None if redo else Ok({"output": vector.KINDS[kind](value)})
+            for value, kind, redo in zip(values.tolist(), kinds.tolist(), bad.tolist())
+        ]
+        return results, [i for i, redo in enumerate(bad.tolist()) if redo]
+
+    @staticmethod
+    def batch(fn: str, kwargs_list: list) -> list[Result[dict, str]]:
+        """scalar path: whitelisted fns run in-process, anything else compiles
+        once and evaluates every kwargs dict in one sandbox round trip"""
+        if not kwargs_list:
+            return []
+
+        fast = Sandbox.fast(fn)
+        if fast is not None:
+            with timing.phase("fast"):
+                return [fasteval.call(fast, kwargs) for kwargs in kwargs_list]
+
+        executed = Sandbox.execute({"fn": fn, "kwargs_list": kwargs_list})
+        return Sandbox.unpack_batch(executed, len(kwargs_list))
+
+    @staticmethod
+    async def batch_async(fn: str, kwargs_list: list) -> list[Result[dict, str]]:
+        if not kwargs_list:
+            return []
+
+        fast = Sandbox.fast(fn)
+        if fast is not None:
+            with timing.phase("fast"):
+                return [fasteval.call(fast, kwargs) for kwargs in kwargs_list]
+
+        executed = await Sandbox.execute_async({"fn": fn, "kwargs_list": kwargs_list})
+        return Sandbox.unpack_batch(executed, len(kwargs_list))
+
+    @staticmethod
+    def fast(fn: str) -> Optional[Callable]:
+        """compiled in-process fn if it passes the AST whitelist, else None"""
+        if not Sandbox.fast_eval:
+            return None
+        compiled = fasteval.compile_fn(fn)
+        return compiled.ok() if compiled.is_ok() else None
+
+    @staticmethod
+    def unpack_batch(executed: Result[dict, str], n: int) -> list[Result[dict, str]]:
+        if executed.is_err():
+            return [executed for _ in range(n)]
+
+        results = executed.ok().get("results")
+        if not isinstance(results, list) or len(results) != n:
+            error = Err(f"malformed batch reply: {executed.ok()}")
+            return [error for _ in range(n)]
+        return [Sandbox.unpack(data) for data in results]
+
+    @staticmethod
+    def unpack(data: dict) -> Result[dict, str]:
+        if "error" in data:
+            return Err(data["error"])
+        return Ok({"output": data["result"]})
+
+    @staticmethod
+    def execute(payload: dict, timeout: float = 15) -> Result[dict, str]:
+        """run one job in the worker pool, or a fresh interpreter if it's disabled"""
+        payload = Sandbox.timed(payload)
+        pool = Sandbox.get_pool()
+        if pool is None:
+            return Sandbox.local_oneshot(payload, timeout)
+
+        try:
+            return Ok(Sandbox.record(pool.run(payload, timeout)))
+        except WorkerError as e:
+            return Sandbox.worker_failure(e)
+
+    @staticmethod
+    def worker_failure(e: WorkerError) -> Result[dict, str]:
+        """a worker killed by its cpu rlimit ran away, anything else is infra"""
+        if e.returncode == -signal.SIGXCPU:
+            return Err("too expensive: cpu time limit exceeded")
+        return Err(f"python execution failed: {str(e)}")
+
+    @staticmethod
+    def timed(payload: dict) -> dict:
+        """ask the worker to report its own exec / call split"""
+        return {**payload, "timed": True} if timing.enabled else payload
+
+    @staticmethod
+    def record(data: dict) -> dict:
+        for phase, seconds in data.pop("timings", {}).items():
+            timing.timings.record(phase, seconds)
+        return data
+
+    @classmethod
+    def semaphore(cls) -> asyncio.Semaphore:
+        """per event loop cap on in-flight async sandbox jobs"""
+        loop = asyncio.get_running_loop()
+        if loop not in cls.semaphores:
+            cls.semaphores[loop] = asyncio.Semaphore(cls.max_concurrency)
+        return cls.semaphores[loop]
+
+    @staticmethod
+    async def execute_async(payload: dict, timeout: float = 15) -> Result[dict, str]:
+        """like execute, but the worker is killed if the caller is cancelled"""
+        payload = Sandbox.timed(payload)
+        async with Sandbox.semaphore():
+            pool = Sandbox.get_pool()
+            if pool is None:
+                return await Sandbox.local_oneshot_async(payload, timeout)
+
+            acquiring = asyncio.ensure_future(asyncio.to_thread(pool.acquire))
+            try:
+                worker = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                acquiring.add_done_callback(
+                    lambda f: f.cancelled() or f.exception() or pool.release(f.result())
+                )
+                raise
+
+            healthy = False
+            try:
+                data = await asyncio.wait_for(
+                    asyncio.to_thread(worker.call, payload, timeout), timeout + 1
+                )
+                healthy = True
+                return Ok(Sandbox.record(data))
+            except WorkerError as e:
+                return Sandbox.worker_failure(e)
+            except TimeoutError:
+                return Err(
+                    f"python execution failed: timed out after {timeout} seconds"
+                )
+            finally:
+                pool.release(worker, healthy)
+
+    @staticmethod
+    async def local_oneshot_async(payload: dict, timeout: float) -> Result[dict, str]:
+        proc = await asyncio.create_subprocess_exec(
+            "python3",
+            "-c",
+            template_code(),
+            str(Sandbox.call_cpu_seconds),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            with timing.phase("oneshot"):
+                stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(dumps(payload).encode()), timeout
+                )
+        except TimeoutError:
+            return Err(f"python execution failed: timed out after {timeout} seconds")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+        try:
+            return Ok(Sandbox.record(loads(stdout)))
+        except Exception:
+            return Err(
+                f"json decode failed - stderr: {stderr.decode()}, stdout: {stdout.decode()}"
+            )
+
+    @staticmethod
+    def local_oneshot(payload: dict, timeout: float = 15) -> Result[dict, str]:
+        """fresh interpreter per call, used when the worker pool is disabled"""
+        try:
+            with timing.phase("oneshot"):
+                result = run(
+                    ["python3", "-c", template_code(), str(Sandbox.call_cpu_seconds)],
+                    input=dumps(payload),
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                )
         except Exception as e:
             return Err(f"python execution failed: {str(e)}")
 
         try:
-            data = loads(result.stdout)
-            if "error" in data:
-                return Err(data["error"])
-            return Ok({"output": data["result"]})
+            return Ok(Sandbox.record(loads(result.stdout)))
         except Exception:
             return Err(
                 f"json decode failed - stderr: {result.stderr}, stdout: {result.stdout}"
@@ -1,29 +1,294 @@
 from math import *  # noqa: F403
 from json import loads, dumps
+import ast
+import builtins
+import math
+import signal
+from time import perf_counter
 
+# fail-fast guards, keep in sync with fasteval.py
+INT_BITS_LIMIT = 1 << 16
+ROUND_DIGITS_LIMIT = 1000
+SEQUENCE_LIMIT = 1 << 20
+COMBINATORIC_LIMIT = 20_000
+# per call; workers and one-shot runs get the host's setting at startup
+CPU_SECONDS_LIMIT = 0.25
+OUTPUT_BYTES_LIMIT = 1 << 20
 
-def run(data: dict) -> dict:
+
+class TooExpensive(BaseException):
+    """not an Exception, so a blackbox's own `except Exception` can't swallow it"""
+
+
+def expire(signum, frame):
+    raise TooExpensive(f"too expensive: cpu time exceeds {CPU_SECONDS_LIMIT}s")
+
+
+signal.signal(signal.SIGPROF, expire)
+
+
+def limited(f, kwargs: dict):
+    signal.setitimer(signal.ITIMER_PROF, CPU_SECONDS_LIMIT)
+    try:
+        return f(**kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+def guarded_pow(base, exponent):
+    if (
+        isinstance(base, int)
+        and isinstance(exponent, int)
+        and exponent > 0
+        and abs(base) > 1
+        and base.bit_length() * exponent > INT_BITS_LIMIT
+    ):
+        raise TooExpensive(
+            f"too expensive: integer power exceeds {INT_BITS_LIMIT} bits"
+        )
+    return base**exponent
+
+
+def guarded_mul(a, b):
+    if (
+        isinstance(a, int)
+        and isinstance(b, int)
+        and a.bit_length() + b.bit_length() > INT_BITS_LIMIT
+    ):
+        raise TooExpensive(
+            f"too expensive: integer product exceeds {INT_BITS_LIMIT} bits"
+        )
+    for seq, n in ((a, b), (b, a)):
+        if (
+            isinstance(n, int)
+            and isinstance(seq, (str, bytes, list, tuple))
+            and len(seq) * n > SEQUENCE_LIMIT
+        ):
+            raise TooExpensive(
+                f"too expensive: repetition exceeds {SEQUENCE_LIMIT} items"
+            )
+    return a * b
+
+
+def guarded_lshift(a, b):
+    if (
+        isinstance(a, int)
+        and isinstance(b, int)
+        and a.bit_length() + b > INT_BITS_LIMIT
+    ):
+        raise TooExpensive(
+            f"too expensive: integer shift exceeds {INT_BITS_LIMIT} bits"
+        )
+    return a << b
+
+
+def guarded_round(number, ndigits=None):
+    if ndigits is not None and abs(ndigits) > ROUND_DIGITS_LIMIT:
+        raise TooExpensive(f"too expensive: round ndigits exceeds {ROUND_DIGITS_LIMIT}")
+    return builtins.round(number, ndigits)
+
+
+def combinatoric(f):
+    def guarded(*args):
+        if any(isinstance(a, int) and a > COMBINATORIC_LIMIT for a in args):
+            raise TooExpensive(
+                f"too expensive: {f.__name__} argument exceeds {COMBINATORIC_LIMIT}"
+            )
+        return f(*args)
+
+    guarded.__name__ = f.__name__
+    return guarded
+
+
+GUARDED_OPS = {
+    ast.Pow: "guarded_pow",
+    ast.Mult: "guarded_mul",
+    ast.LShift: "guarded_lshift",
+}
+
+
+class Guard(ast.NodeTransformer):
+    """route ops that can blow up ints or memory through the guards above"""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.expr:
+        self.generic_visit(node)
+        name = GUARDED_OPS.get(type(node.op))
+        if name is None:
+            return node
+        call = ast.Call(ast.Name(name, ast.Load()), [node.left, node.right], [])
+        return ast.copy_location(call, node)
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> ast.stmt:
+        self.generic_visit(node)
+        if type(node.op) not in GUARDED_OPS or not isinstance(node.target, ast.Name):
+            return node
+        value = self.visit_BinOp(
+            ast.BinOp(ast.Name(node.target.id, ast.Load()), node.op, node.value)
+        )
+        return ast.copy_location(ast.Assign([node.target], value), node)
+
+
+def namespace() -> dict:
+    """fresh globals per job so one function can't poison the next"""
+    scope = dict(globals())
+    scope["__builtins__"] = dict(vars(builtins), round=guarded_round)
+    for name in ("factorial", "comb", "perm"):
+        scope[name] = combinatoric(getattr(math, name))
+    return scope
+
+
+def load(fn: str):
+    tree = ast.fix_missing_locations(Guard().visit(ast.parse(fn, "<string>")))
     local_vars = {}
-    exec(data["fn"], globals(), local_vars)
+    exec(compile(tree, "<string>", "exec"), namespace(), local_vars)
 
+    for name, obj in local_vars.items():
+        if callable(obj):
+            return obj
+    return None
+
+
+def call(func, kwargs: dict) -> dict:
     try:
-        func = None
-        for name, obj in local_vars.items():
-            if callable(obj):
-                func = obj
-                break
+        return {"result": limited(func, kwargs)}
+    except MemoryError:
+        return {"error": "too expensive: memory limit exceeded"}
+    except (Exception, TooExpensive) as e:
+        return {"error": str(e)}
+
+
+def bulk(func, spec: dict) -> dict:
+    """evaluate func over the float64 columns in spec["path"], writing outputs
+    into the last column; only failed rows come back, as a sparse dict"""
+    import mmap
+
+    n, names = spec["n"], spec["args"]
+    with open(spec["path"], "r+b") as f:
+        buffer = mmap.mmap(f.fileno(), 0)
+    view = memoryview(buffer).cast("d")
+    columns = [view[i * n : (i + 1) * n] for i in range(len(names))]
+    out = view[len(names) * n : (len(names) + 1) * n]
+
+    errors = {}
+    for row in range(n):
+        result = call(func, {name: column[row] for name, column in zip(names, columns)})
+        value = result.get("result")
+        if "error" in result:
+            errors[row] = result["error"]
+        elif type(value) not in (int, float, bool):
+            errors[row] = f"non-numeric result: {type(value).__name__}"
+        else:
+            try:
+                out[row] = float(value)
+                continue
+            except OverflowError as e:
+                errors[row] = str(e)
+        out[row] = nan  # noqa: F405
+
+    del columns, out
+    view.release()
+    buffer.close()
+    return {"errors": errors}
 
+
+def run(data: dict) -> dict:
+    start = perf_counter()
+    try:
+        func = limited(load, {"fn": data["fn"]})
+    except (Exception, TooExpensive) as e:
+        func, error = None, str(e)
+    else:
+        error = "no function found in code"
+    loaded = perf_counter()
+
+    if "bulk" in data:
+        result = {"error": error} if func is None else bulk(func, data["bulk"])
+    elif "kwargs_list" in data:
         if func is None:
-            return {"error": "no function found in code"}
+            result = {"results": [{"error": error} for _ in data["kwargs_list"]]}
+        else:
+            result = {"results": [call(func, kw) for kw in data["kwargs_list"]]}
+    elif func is None:
+        result = {"error": error}
+    else:
+        result = call(func, data["kwargs"])
 
-        result = func(**data["kwargs"])
-        return {"result": result}
+    if data.get("timed"):
+        result["timings"] = {"exec": loaded - start, "call": perf_counter() - loaded}
+    return result
+
+
+def encode(item: dict) -> str:
+    try:
+        text = dumps(item)
     except Exception as e:
-        return {"error": str(e)}
+        return dumps({"error": f"unserializable result: {e}"})
+    if len(text) > OUTPUT_BYTES_LIMIT:
+        return dumps(
+            {"error": f"too expensive: output exceeds {OUTPUT_BYTES_LIMIT} bytes"}
+        )
+    return text
+
+
+def reply(data: dict) -> str:
+    result = run(data)
+    if "results" not in result:
+        return encode(result)
+
+    results = ", ".join(map(encode, result.pop("results")))
+    extra = "".join(f", {dumps(key)}: {dumps(value)}" for key, value in result.items())
+    return '{"results": [' + results + "]" + extra + "}"
+
+
+def limit(
+    cpu_seconds: int,
+    max_jobs: int,
+    memory_mb: int,
+    address_space_mb: int,
+    call_cpu_seconds: float = CPU_SECONDS_LIMIT,
+):
+    import resource
+
+    global CPU_SECONDS_LIMIT
+    CPU_SECONDS_LIMIT = call_cpu_seconds
+    lifetime = cpu_seconds * (max_jobs + 1)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, lifetime))
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_mb * 1024**2, memory_mb * 1024**2))
+    resource.setrlimit(
+        resource.RLIMIT_AS, (address_space_mb * 1024**2, address_space_mb * 1024**2)
+    )
+
+
+def serve(limits: dict):
+    """long-lived worker: one json job per line on stdin, one json reply per line"""
+    import os
+    import resource
+    import sys
+
+    limit(**limits)
+
+    out = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    for line in sys.stdin:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime) + 1
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(
+            resource.RLIMIT_CPU, (min(used + limits["cpu_seconds"], hard), hard)
+        )
+
+        out.write(reply(loads(line)) + "\n")
+        out.flush()
 
 
 if __name__ == "__main__":
     import sys
 
-    data = loads(sys.stdin.read())
-    print(dumps(run(data)))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(loads(sys.argv[2]))
+    else:
+        if len(sys.argv) > 1:
+            CPU_SECONDS_LIMIT = float(sys.argv[1])
+        print(reply(loads(sys.stdin.read())))
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
+import asyncio
+import os
 import pytest
 from dotenv import load_dotenv
 from sandbox import Sandbox
+import vector
 
 load_dotenv()
 
@@ -48,3 +51,676 @@ def blackbox(a: float, b: float) -> float:
 
     expected = 1.0 + (sin(1.0) * 2.0) ** 2
     assert abs(output - expected) < 1e-10
+
+
+def test_sandbox_local_pool_reuses_workers():
+    """sequential calls share one warm worker, recycled after max_jobs"""
+    from workers import WorkerPool
+    from sandbox import template_code
+
+    pool = WorkerPool(template_code(), size=1, max_jobs=3)
+    try:
+        for x in range(5):
+            data = pool.run({"fn": "def blackbox(x): return x * 2", "kwargs": {"x": x}})
+            assert data == {"result": x * 2}
+
+        assert pool.spawned == 2
+        assert pool.recycled == 1
+    finally:
+        pool.close()
+
+
+def test_sandbox_local_pool_recovers_from_crash():
+    """a worker that dies mid-job is replaced and later calls still succeed"""
+    Sandbox.configure_pool(1)
+    try:
+        crash = """
+def blackbox(x):
+    import os
+    os._exit(3)
+"""
+        result = Sandbox.local(crash, {"x": 1.0})
+        assert result.is_err()
+        assert "worker exited" in result.err()
+
+        result = Sandbox.local("def blackbox(x): return x + 1", {"x": 1.0})
+        assert result.ok() == {"output": 2.0}
+    finally:
+        Sandbox.configure_pool(4)
+
+
+def test_sandbox_local_oneshot_fallback():
+    """pool size 0 keeps the one interpreter per call behaviour"""
+    Sandbox.configure_pool(0)
+    Sandbox.fast_eval = False
+    try:
+        assert Sandbox.get_pool() is None
+        result = Sandbox.local("def blackbox(x): return x - 1", {"x": 1.0})
+        assert result.ok() == {"output": 0.0}
+
+        result = Sandbox.local("def blackbox(x): return 1 / x", {"x": 0})
+        assert result.err() == "division by zero"
+    finally:
+        Sandbox.configure_pool(4)
+        Sandbox.fast_eval = True
+
+
+def test_sandbox_call_cpu_limit_is_configurable():
+    """the per-call cpu budget reaches pooled workers and one-shot runs"""
+    spin = """
+def blackbox(x):
+    n = 0
+    while n < 10**9:
+        n += 1
+    return x
+"""
+    Sandbox.call_cpu_seconds = 0.05
+    Sandbox.fast_eval = False
+    try:
+        for size in (1, 0):
+            Sandbox.configure_pool(size)
+            result = Sandbox.local(spin, {"x": size})
+            assert result.err() == "too expensive: cpu time exceeds 0.05s"
+    finally:
+        Sandbox.call_cpu_seconds = 0.25
+        Sandbox.fast_eval = True
+        Sandbox.configure_pool(4)
+
+
+def test_sandbox_local_batch_isolates_errors():
+    """one round trip returns a result or error per input, in order"""
+    fn = "def blackbox(x): return 1 / x"
+    results = Sandbox.local_batch(fn, [{"x": 2}, {"x": 0}, {"y": 1}, {"x": 4}])
+
+    assert results[0].ok() == {"output": 0.5}
+    assert results[1].err() == "division by zero"
+    assert "unexpected keyword argument" in results[2].err()
+    assert results[3].ok() == {"output": 0.25}
+
+    broken = Sandbox.local_batch("def blackbox(x) return x", [{"x": 1}, {"x": 2}])
+    assert all(r.is_err() for r in broken)
+    assert Sandbox.local_batch(fn, []) == []
+
+
+@pytest.mark.asyncio
+async def test_sandbox_local_async_overlaps_and_times_out():
+    """slow jobs run side by side and a runaway job is killed at its timeout"""
+    import asyncio
+    import time
+
+    Sandbox.configure_pool(4)
+    sleepy = """
+def blackbox(x):
+    import time
+    time.sleep(0.5)
+    return x
+"""
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[Sandbox.local_async(sleepy, {"x": i}) for i in range(4)]
+    )
+    assert [r.ok()["output"] for r in results] == [0, 1, 2, 3]
+    assert time.monotonic() - start < 1.5
+
+    stuck = "def blackbox(x):\n    import time\n    time.sleep(60)"
+    start = time.monotonic()
+    result = await Sandbox.execute_async({"fn": stuck, "kwargs": {"x": 1}}, timeout=0.5)
+    assert "timed out" in result.err()
+    assert time.monotonic() - start < 1.5
+
+    task = asyncio.create_task(Sandbox.local_async(stuck, {"x": 1}))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    batch = await Sandbox.local_batch_async("def blackbox(x): return -x", [{"x": 1}])
+    assert batch[0].ok() == {"output": -1}
+
+
+def test_sandbox_local_vectorized_matches_scalar():
+    """numpy backend agrees with the template, errors included"""
+    from math import isclose
+
+    fns = [
+        "def blackbox(a, b): return a + (sin(a) * b) ** 2",
+        "def blackbox(a, b): return log(a, 2) if a > b else sqrt(a) / b",
+        "def blackbox(a, b):\n    c = a // b\n    c += a % b\n    return max(c, 0, a) ** a",
+        "def blackbox(a, b): return log(a, 0) if b > 0 else log(a, b + 3)",
+    ]
+    # int results stay ints (and bools bools) as long as python's would
+    int_fns = [
+        "def blackbox(a, b): return a * b - a // 3 if a > b else floor(a) + (a > 0)",
+        "def blackbox(a, b): return max(a, b, 0) ** b + abs(a > b)",
+        "def blackbox(a, b): return a / 2 + round(a) if b else (a < b) or b",
+    ]
+    grid = [(a, b) for a in range(-10, 11, 3) for b in range(-6, 7, 2)]
+    float_kwargs = [{"a": a / 2, "b": b / 2} for a, b in grid]
+    int_kwargs = [{"a": a, "b": b} for a, b in grid] + [{"a": True, "b": 2}]
+    cases = [(fn, float_kwargs) for fn in fns] + [
+        (fn, int_kwargs) for fn in fns + int_fns
+    ]
+
+    for fn, kwargs_list in cases:
+        assert vector.compile(fn).is_ok()
+        vectorized = Sandbox.local_vectorized(fn, kwargs_list)
+        scalar = Sandbox.batch(fn, kwargs_list)
+        for v, s in zip(vectorized, scalar):
+            assert v.is_err() == s.is_err()
+            if s.is_err():
+                assert v.err() == s.err()
+            else:
+                assert type(v.ok()["output"]) is type(s.ok()["output"])
+                assert isclose(v.ok()["output"], s.ok()["output"], rel_tol=1e-12)
+
+    assert vector.compile("def blackbox(x):\n    import os\n    return x").is_err()
+    deep = "def blackbox(x):\n    return " + "+".join(["x"] * 5000)
+    assert vector.compile(deep).is_err()
+    results = Sandbox.local_vectorized("def blackbox(x): return [x]", [{"x": 1}])
+    assert results[0].ok() == {"output": [1]}
+
+
+def test_sandbox_result_cache():
+    """repeat evaluations are served from the cache, errors stay errors"""
+    Sandbox.configure_cache(1000)
+    try:
+        fn = "def blackbox(x): return 1 / x"
+        first = Sandbox.local_batch(fn, [{"x": 2}, {"x": 0}])
+        assert Sandbox.cache.stats()["hits"] == 0
+
+        reformatted = "def blackbox(x):\n    # same function\n    return 1/x\n"
+        second = Sandbox.local_batch(reformatted, [{"x": 0}, {"x": 2}, {"x": 4}])
+        assert second[:2] == first[::-1]
+        assert second[0].err() == "division by zero"
+
+        stats = Sandbox.cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 3, 3)
+
+        crash = "def blackbox(x):\n    import os\n    os._exit(1)"
+        Sandbox.local(crash, {"x": 1})
+        assert Sandbox.cache.stats()["entries"] == 3
+
+        Sandbox.configure_cache(2)
+        Sandbox.local_batch(fn, [{"x": 1}, {"x": 2}, {"x": 3}])
+        assert Sandbox.cache.stats()["entries"] == 2
+        assert Sandbox.cache.stats()["evictions"] == 1
+
+        # too deep to normalize, yet still hashed and answered with an Err
+        deep = "def blackbox(x):\n    return " + "+".join(["x"] * 5000)
+        assert "recursion" in Sandbox.local(deep, {"x": 1}).err()
+    finally:
+        Sandbox.configure_cache(100_000)
+
+
+def test_sandbox_fast_eval_whitelist():
+    """whitelisted fns run in-process with the same results as the subprocess"""
+    import fasteval
+
+    fn = """
+def blackbox(a: float, b: float) -> float:
+    if a > b:
+        return log(a, 2) if a > 0 else a ** 2
+    c = a // b
+    c += round(a, 1)
+    return max(c, 0) ** b
+"""
+    assert fasteval.compile_fn(fn).is_ok()
+    kwargs_list = [{"a": a / 2, "b": b} for a in range(-6, 7) for b in (-1, 0, 2)]
+    kwargs_list.append({"a": 1})
+
+    fast = Sandbox.batch(fn, kwargs_list)
+    slow = [Sandbox.execute({"fn": fn, "kwargs": kw}) for kw in kwargs_list]
+    assert fast == [executed.and_then(Sandbox.unpack) for executed in slow]
+
+    for rejected in [
+        "def blackbox(x):\n    import os\n    return x",
+        "def blackbox(x): return x.real",
+        "def blackbox(x): return [i for i in range(x)]",
+        "def blackbox(x): return factorial(x)",
+        "def blackbox(x): return blackbox(x)",
+        "def blackbox(x):\n    while x:\n        pass",
+    ]:
+        assert fasteval.compile_fn(rejected).is_err()
+
+    result = Sandbox.local("def blackbox(x): return x ** x ** x ** x", {"x": 10})
+    assert "exceeds" in result.err()
+
+    # too deep for the in-process parser, so the subprocess answers instead
+    deep = "def blackbox(x):\n    return " + "+".join(["x"] * 5000)
+    assert fasteval.compile_fn(deep).is_err()
+    Sandbox.configure_cache(0)
+    try:
+        assert "recursion" in Sandbox.local(deep, {"x": 1}).err()
+    finally:
+        Sandbox.configure_cache(100_000)
+
+
+def test_sandbox_fails_fast_on_pathological_functions():
+    """runaway computations come back as `too expensive` in milliseconds"""
+    import time
+
+    Sandbox.configure_cache(0)
+    try:
+        cases = [
+            "def blackbox(x):\n    import os\n    return x ** x ** x ** x",
+            "def blackbox(x):\n    import os\n    return factorial(x ** 6)",
+            "def blackbox(x):\n    import os\n    return 'a' * 10 ** x",
+            "def blackbox(x):\n    import os\n    return 1 << 10 ** x",
+            "def blackbox(x):\n    y = x\n    while True:\n        try:\n            y += 1\n        except Exception:\n            pass",
+            "def blackbox(x):\n    import os\n    return list(range(10 ** x))",
+        ]
+        for fn in cases:
+            start = time.monotonic()
+            result = Sandbox.local(fn, {"x": 10})
+            assert result.err().startswith("too expensive"), result
+            assert time.monotonic() - start < 1.0
+
+        fast = Sandbox.local("def blackbox(x): return x ** x ** x", {"x": 10})
+        slow = Sandbox.execute(
+            {"fn": "def blackbox(x): return x ** x ** x", "kwargs": {"x": 10}}
+        )
+        assert fast.err() == slow.ok()["error"]
+    finally:
+        Sandbox.configure_cache(100_000)
+
+
+def test_sandbox_timings_per_rollout():
+    """opt-in phase timings land on both the process and the current rollout"""
+    import timing
+
+    Sandbox.configure_cache(0)
+    timing.enable()
+    timing.timings.reset()
+    token = timing.rollout.set("rollout-1")
+    try:
+        fn = "def blackbox(x):\n    import os\n    return x + 1"
+        assert Sandbox.local(fn, {"x": 1}).ok() == {"output": 2}
+        assert Sandbox.local("def blackbox(x): return x * 2", {"x": 3}).ok() == {
+            "output": 6
+        }
+
+        phases = timing.timings.summary("rollout-1")
+        for phase in ("roundtrip", "exec", "call", "fast"):
+            assert phases[phase]["count"] >= 1, phases
+        assert phases["roundtrip"]["p50_ms"] <= phases["roundtrip"]["max_ms"]
+        assert timing.timings.summary()["exec"]["count"] >= 1
+
+        assert timing.timings.pop("rollout-1") == phases
+        assert timing.timings.summary("rollout-1") == {}
+    finally:
+        timing.rollout.reset(token)
+        timing.enable(False)
+        timing.timings.reset()
+        Sandbox.configure_cache(100_000)
+
+
+def test_sandbox_bench_report():
+    """the offline benchmark runs every scenario and leaves Sandbox as it was"""
+    import json
+    import bench
+
+    before = (Sandbox.pool_size, Sandbox.fast_eval, Sandbox.cache)
+    report = bench.run_suite(["fast", "pool"], repeat=2)
+    assert (Sandbox.pool_size, Sandbox.fast_eval, Sandbox.cache) == before
+
+    scenarios = {(r["backend"], r["scenario"]) for r in report["results"]}
+    assert ("pool", "batch_1000") in scenarios
+    assert ("fast", "pathological_spin") in scenarios
+    assert all(r["p50_ms"] <= r["max_ms"] for r in report["results"])
+
+    rows = bench.compare(json.loads(json.dumps(report)), report)
+    assert rows and all(r["ratio"] == 1.0 for r in rows)
+
+
+def test_sandbox_local_bulk_matches_batch():
+    """bulk float64 mode agrees with the json path, failures come back sparse"""
+    import math
+    import random
+
+    fn = "def blackbox(x, y):\n    import os\n    if x > 90:\n        return 'big'\n    return log(x) * y"
+    rng = random.Random(0)
+    xs = [rng.uniform(-100, 100) for _ in range(2000)]
+    ys = [rng.uniform(0, 1) for _ in range(2000)]
+
+    values, errors = Sandbox.local_bulk(fn, {"x": xs, "y": ys}).ok()
+    assert len(values) == 2000
+    batch = Sandbox.local_batch(fn, [{"x": x, "y": y} for x, y in zip(xs, ys)])
+    for i, result in enumerate(batch):
+        if result.is_err():
+            assert errors[i] == result.err()
+            assert math.isnan(values[i])
+        elif isinstance(result.ok()["output"], str):
+            assert errors[i] == "non-numeric result: str"
+        else:
+            assert i not in errors and values[i] == result.ok()["output"]
+
+    assert Sandbox.local_bulk(fn, {"x": [1.0], "y": []}).is_err()
+    assert Sandbox.local_bulk("def f(:", {"x": [1.0]}).is_err()
+
+
+@pytest.mark.asyncio
+async def test_remote_sandbox_pool_reuses_machines():
+    """pooled machines come back with a clean workspace, /tmp and home until
+    they hit max_uses"""
+    from machines import FakeMachinesAPI, SandboxPool
+
+    api = FakeMachinesAPI()
+    pool = SandboxPool(size=2, max_uses=2, api=api)
+    try:
+        first = await pool.acquire()
+        await first.bash("echo secret > /workspace/notes.txt")
+        await first.bash("mkdir /tmp/scratch && touch ~agent/.history")
+        assert "notes.txt" in await first.bash("ls /workspace")
+        await pool.release(first)
+
+        second = await pool.acquire()
+        assert second is first
+        for path in ("/workspace", "/tmp", "~agent"):
+            assert await second.bash(f"ls -A {path}") == "(no output)"
+        await pool.release(second)
+
+        third = await pool.acquire()
+        assert third is not first and third.machine_id in api.machines
+        await asyncio.sleep(0)
+        assert first.machine_id is None
+        assert pool.stats()["recycled"] == 1
+        await pool.release(third)
+    finally:
+        await pool.close()
+    assert api.machines == {} and api.volumes == {}
+
+
+@pytest.mark.asyncio
+async def test_machines_api_shared_client_retries(monkeypatch):
+    """429s and 5xx on idempotent calls are retried on one shared client"""
+    import httpx
+    from machines import MachinesAPI, SharedClient
+
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.method)
+        if request.method == "GET" and len(seen) == 1:
+            return httpx.Response(429, headers={"retry-after": "0"})
+        if request.method == "GET" and len(seen) == 2:
+            return httpx.Response(503)
+        if request.method == "POST":
+            return httpx.Response(500)
+        return httpx.Response(200, json={"id": "m1", "state": "started"})
+
+    monkeypatch.setenv("FLY_API_TOKEN", "test")
+    http = SharedClient(backoff=0.001, transport=httpx.MockTransport(handler))
+    api = MachinesAPI(http=http)
+    try:
+        assert (await api.get_machine("m1"))["state"] == "started"
+        assert http.metrics()["retries"] == 2
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await api.create_machine({})
+        assert seen.count("POST") == 1
+        assert http.metrics()["in_flight"] == 0
+        assert http.client()[0] is http.client()[0]
+    finally:
+        await http.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    not os.environ.get("SANDBOX_SSH_TEST_HOST"),
+    reason="needs a local sshd container, e.g. the sandbox image on port 2222",
+)
+async def test_ssh_session_multiplexes_commands():
+    """one connection serves many commands, each on its own channel, quickly"""
+    import time
+    from ssh import SSHSession
+
+    host, _, port = os.environ["SANDBOX_SSH_TEST_HOST"].partition(":")
+    session = SSHSession(host, port=int(port or 2222))
+    try:
+        assert (await session.run("echo warm")).stdout.text().strip() == "warm"
+
+        start = time.monotonic()
+        outputs = await asyncio.gather(*(session.run(f"echo {i}") for i in range(10)))
+        assert [o.stdout.text().strip() for o in outputs] == [str(i) for i in range(10)]
+        assert time.monotonic() - start < 1.0
+
+        output = await session.run("head -c 100000 /dev/zero", max_bytes=1000)
+        assert output.truncated and output.stdout.dropped == 99000
+    finally:
+        await session.close()
+
+
+def test_ssh_requires_the_pinned_host_key(tmp_path, monkeypatch):
+    """sessions only trust the image's host key, and with no key to pin ssh
+    stays off instead of connecting unverified"""
+    import ssh
+
+    host_key = tmp_path / "unboxer_ssh_host.pub"
+    monkeypatch.setenv("SANDBOX_SSH_HOST_KEY", str(host_key))
+    assert ssh.host_key_path() is None and not ssh.available()
+
+    host_key.write_text("ssh-ed25519 AAAA unboxer\n")
+    assert ssh.SSHSession("sandbox").host_key == host_key
+
+
+@pytest.mark.asyncio
+async def test_remote_sandbox_waits_on_state_transition(monkeypatch):
+    """readiness blocks on the machines api wait endpoint instead of polling"""
+    import httpx
+    from machines import MachinesAPI, SharedClient
+
+    waits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/wait"):
+            waits.append(dict(request.url.params))
+            return httpx.Response(408 if len(waits) == 1 else 200, json={})
+        return httpx.Response(200, json={"id": "m1"})
+
+    monkeypatch.setenv("FLY_API_TOKEN", "test")
+    http = SharedClient(transport=httpx.MockTransport(handler))
+    sandbox = Sandbox(api=MachinesAPI(http=http), ssh_probe=False)
+    try:
+        assert await sandbox.create() == "m1"
+        assert waits == [{"state": "started", "timeout": "60"}] * 2
+        assert sandbox.readiness["ready_s"] >= sandbox.readiness["started_s"]
+        assert "ssh_s" not in sandbox.readiness
+    finally:
+        await http.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_sandbox_teardown_and_reaper():
+    """teardown runs in the background; the reaper only takes what nobody owns"""
+    import machines
+    from machines import FakeMachinesAPI, Reaper, TeardownQueue
+
+    api = FakeMachinesAPI()
+    kept, leaked, finished = (Sandbox(api=api) for _ in range(3))
+    for sandbox in (kept, leaked, finished):
+        await sandbox.create()
+
+    teardown = TeardownQueue(concurrency=1)
+    teardown.submit(finished)
+    await teardown.drain()
+    assert teardown.stats() == {"pending": 0, "destroyed": 1, "failed": 0}
+
+    # a crashed process: the machine and volume exist but nothing owns them
+    leaked_ids = {leaked.machine_id, leaked.volume_id}
+    machines.live.difference_update(leaked_ids)
+    api.volumes["vol_stray"] = {"id": "vol_stray", "name": "vol_stray"}
+
+    reaper = Reaper(api, min_age=0)
+    report = await reaper.reap(dry_run=True)
+    assert {m["id"] for m in report["machines"]} == leaked_ids & set(api.machines)
+    assert len(api.machines) == 2
+
+    report = await reaper.reap()
+    reclaimed = {r["id"] for r in report["machines"] + report["volumes"]}
+    assert reclaimed == leaked_ids | {"vol_stray"}
+    assert set(api.machines) == {kept.machine_id}
+    assert set(api.volumes) == {kept.volume_id}
+
+    assert (await Reaper(api, min_age=3600).reap())["machines"] == []
+    await kept.destroy()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    not os.environ.get("SANDBOX_CONTAINER_RUNTIME"),
+    reason="needs docker or podman and `un build --local <runtime>`",
+)
+async def test_container_sandbox_bash():
+    """the local container backend behaves like a remote machine, only faster"""
+    import time
+    from containers import ContainerAPI
+    from machines import SandboxPool
+
+    pool = SandboxPool(
+        size=1, api=ContainerAPI(os.environ["SANDBOX_CONTAINER_RUNTIME"])
+    )
+    try:
+        sandbox = await pool.acquire()
+        await sandbox.bash("echo hello > /workspace/greeting.txt")
+        start = time.monotonic()
+        assert await sandbox.bash("cat greeting.txt") == "hello"
+        assert time.monotonic() - start < 0.5
+        offline = (
+            "python3 -c \"import socket; socket.create_connection(('1.1.1.1', 53), 2)\""
+        )
+        assert "stderr" in await sandbox.bash(offline)
+        await pool.release(sandbox)
+
+        again = await pool.acquire()
+        assert again is sandbox
+        assert await again.bash("ls /workspace") == "(no output)"
+        await pool.release(again)
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_sandbox_pool_counts_resetting_machines():
+    """a machine mid-reset still counts toward `size`, and one whose reset
+    ends after close is destroyed rather than parked in the pool"""
+    from machines import FakeMachinesAPI, SandboxPool
+
+    class SlowResetAPI(FakeMachinesAPI):
+        def __init__(self):
+            super().__init__()
+            self.resumed = asyncio.Event()
+
+        async def exec(self, machine_id, command, timeout, max_bytes):
+            if "sandbox-reset" in command:
+                await self.resumed.wait()
+            return await super().exec(machine_id, command, timeout, max_bytes)
+
+    api = SlowResetAPI()
+    pool = SandboxPool(size=1, api=api)
+    try:
+        first = await pool.acquire()
+        release = asyncio.ensure_future(pool.release(first))
+        await asyncio.sleep(0.01)
+        second = await pool.acquire()
+        assert second is not first and pool.owned() == 2
+
+        api.resumed.set()
+        await release
+        assert first not in pool.ready and pool.owned() == 1
+
+        api.resumed.clear()
+        release = asyncio.ensure_future(pool.release(second))
+        await asyncio.sleep(0.01)
+        closing = asyncio.ensure_future(pool.close())
+        await asyncio.sleep(0.01)
+        api.resumed.set()
+        await asyncio.gather(release, closing)
+        assert not pool.ready
+    finally:
+        await pool.close()
+    assert api.machines == {}
+
+
+@pytest.mark.asyncio
+async def test_remote_sandbox_bash_caps_output_and_time():
+    """big outputs keep their head and tail, runaway commands are killed"""
+    import time
+    from machines import FakeMachinesAPI
+
+    sandbox = Sandbox(api=FakeMachinesAPI())
+    await sandbox.create()
+    try:
+        result = await sandbox.bash_result("seq 1 100000", max_bytes=1000)
+        assert result["truncated"] and not result["timed_out"]
+        assert result["output"].startswith("1\n2\n3\n")
+        assert "100000\n[output truncated" in result["output"]
+        assert "bytes truncated ..." in result["output"]
+        assert result["stdout_bytes"] == len("\n".join(map(str, range(1, 100001)))) + 1
+
+        start = time.monotonic()
+        result = await sandbox.bash_result("echo started; sleep 30", timeout=0.5)
+        assert time.monotonic() - start < 5
+        assert result["timed_out"] and result["output"].startswith("started")
+        assert result["output"].endswith("[command killed after 0.5s timeout]")
+
+        # an explicit zero is a timeout, not a request for the default
+        result = await sandbox.bash_result("sleep 30", timeout=0)
+        assert result["timed_out"]
+
+        assert await sandbox.bash("echo ok") == "ok"
+    finally:
+        await sandbox.destroy()
+
+
+@pytest.mark.asyncio
+async def test_tenant_pool_packs_episodes_onto_hosts():
+    """episodes share hosts up to tenants_per_host, each as its own user, and
+    drained hosts beyond one warm spare are destroyed"""
+    from capture import Output
+    from machines import FakeMachinesAPI
+    from tenants import TenantPool
+
+    class RecordingAPI(FakeMachinesAPI):
+        """answers the root scripts instead of running useradd / mount here"""
+
+        def __init__(self):
+            super().__init__()
+            self.commands = []
+
+        async def exec(self, machine_id, command, timeout, max_bytes):
+            self.commands.append((machine_id, command))
+            output = Output(max_bytes)
+            output.exit_code = 0
+            for marker in ("tenant-ready", "tenant-reset"):
+                if f"echo {marker}" in command:
+                    output.stdout.feed(marker.encode())
+            if "runuser" in command:
+                output.stdout.feed(b"hi")
+            return output
+
+    api = RecordingAPI()
+    pool = TenantPool(tenants_per_host=2, api=api)
+    try:
+        tenants = await asyncio.gather(*(pool.acquire() for _ in range(3)))
+        assert len(api.machines) == 2 and pool.stats()["tenants"] == 3
+        assert all(
+            v == [] for v in (m["config"]["mounts"] for m in api.machines.values())
+        )
+        assert len({t.name for t in tenants}) == 3
+
+        assert await tenants[0].bash("whoami") == "hi"
+        command = api.commands[-1][1]
+        assert f"runuser -u {tenants[0].name}" in command
+        assert f"/sys/fs/cgroup/unboxer/{tenants[0].name}/cgroup.procs" in command
+
+        for tenant in tenants:
+            await pool.release(tenant)
+        await pool.teardown.drain()
+        assert len(api.machines) == 1 and pool.stats()["recycled"] == 1
+
+        again = await pool.acquire()
+        assert again.machine_id in api.machines and pool.stats()["hits"] >= 1
+        await pool.release(again)
+    finally:
+        await pool.close()
+    assert api.machines == {}
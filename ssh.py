@@ -0,0 +1,114 @@
+import asyncio
+from os import environ
+from pathlib import Path
+from time import monotonic
+from typing import Optional
+from capture import KILLED, Output, drain, remote_command
+
+try:
+    import asyncssh
+except ImportError:  # pragma: no cover
+    asyncssh = None
+
+# the image's `proxy` forwards this port to sshd
+SSH_PORT = 2222
+SSH_USER = "agent"
+
+
+def key_path() -> Optional[Path]:
+    """private half of unboxer_ssh.pub baked into the sandbox image"""
+    path = Path(environ.get("SANDBOX_SSH_KEY", Path(__file__).parent / "unboxer_ssh"))
+    return path if path.is_file() else None
+
+
+def host_key_path() -> Optional[Path]:
+    """public half of the sshd host key baked into the sandbox image, the only
+    key a sandbox may present; without it ssh is off rather than unverified"""
+    path = Path(
+        environ.get(
+            "SANDBOX_SSH_HOST_KEY", Path(__file__).parent / "unboxer_ssh_host.pub"
+        )
+    )
+    return path if path.is_file() else None
+
+
+def available() -> bool:
+    return (
+        asyncssh is not None
+        and environ.get("SANDBOX_SSH", "1") == "1"
+        and key_path() is not None
+        and host_key_path() is not None
+    )
+
+
+class SSHSession:
+    """one persistent ssh connection per sandbox, each command on its own channel"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = SSH_PORT,
+        username: str = SSH_USER,
+        key: Optional[Path] = None,
+        host_key: Optional[Path] = None,
+        connect_timeout: float = 10,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.key = key or key_path()
+        self.host_key = host_key or host_key_path()
+        self.connect_timeout = connect_timeout
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    async def connection(self):
+        async with self.lock:
+            if self.conn is None or self.conn.is_closed():
+                self.conn = await asyncio.wait_for(
+                    asyncssh.connect(
+                        self.host,
+                        port=self.port,
+                        username=self.username,
+                        client_keys=[str(self.key)],
+                        # every sandbox shares the image's host key, so it's
+                        # trusted whatever address the machine comes up on
+                        known_hosts=([str(self.host_key)], [], []),
+                        keepalive_interval=15,
+                    ),
+                    self.connect_timeout,
+                )
+            return self.conn
+
+    async def run(
+        self, command: str, timeout: float = 60, max_bytes: int = 64 * 1024
+    ) -> Output:
+        """run `command` on a fresh channel, streaming both outputs into
+        head+tail captures; it's killed remotely after `timeout`"""
+        output = Output(max_bytes)
+        conn = await self.connection()
+        start = monotonic()
+        async with conn.create_process(
+            remote_command(command, timeout), encoding=None
+        ) as process:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        drain(process.stdout, output.stdout),
+                        drain(process.stderr, output.stderr),
+                    ),
+                    timeout + 5,
+                )
+                output.exit_code = (await process.wait()).exit_status
+            except TimeoutError:
+                output.timed_out = True
+                process.kill()
+        if output.exit_code == KILLED and monotonic() - start >= timeout:
+            output.timed_out = True
+        return output
+
+    async def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            await self.conn.wait_closed()
+            self.conn = None
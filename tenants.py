@@ -0,0 +1,279 @@
+import asyncio
+import shlex
+from time import monotonic
+from typing import Optional
+from uuid import uuid4
+import xxhash
+from capture import KILLED, Output, remote_command
+from machines import TeardownQueue, local_tasks
+
+# every tenant's cgroup lives under this one, so its controllers are enabled once
+CGROUP_ROOT = "/sys/fs/cgroup/unboxer"
+TENANT_ROOT = "/tenants"
+CONTROLLERS = "+cpu +memory +pids"
+# cfs period the cpu quota is expressed against
+CPU_PERIOD_US = 100_000
+
+
+def setup_script(
+    name: str, cpus: float, memory_mb: int, pids: int, workspace_mb: int
+) -> str:
+    """unix user with its home on a private tmpfs, plus a cgroup capping it"""
+    home = f"{TENANT_ROOT}/{name}"
+    cgroup = f"{CGROUP_ROOT}/{name}"
+    return f"""set -e
+useradd --no-create-home --home-dir {home} --shell /bin/bash --user-group {name}
+mkdir -p {home}
+mount -t tmpfs -o size={workspace_mb}m,mode=0700,uid=$(id -u {name}),gid=$(id -g {name}) tmpfs {home}
+mkdir -p {CGROUP_ROOT}
+echo '{CONTROLLERS}' > /sys/fs/cgroup/cgroup.subtree_control
+echo '{CONTROLLERS}' > {CGROUP_ROOT}/cgroup.subtree_control
+mkdir {cgroup}
+echo '{int(cpus * CPU_PERIOD_US)} {CPU_PERIOD_US}' > {cgroup}/cpu.max
+echo {memory_mb}M > {cgroup}/memory.max
+echo 0 > {cgroup}/memory.swap.max 2>/dev/null || true
+echo {pids} > {cgroup}/pids.max
+echo tenant-ready"""
+
+
+def teardown_script(name: str) -> str:
+    """kill whatever the episode left running, then drop its tmpfs, cgroup and user"""
+    home = f"{TENANT_ROOT}/{name}"
+    cgroup = f"{CGROUP_ROOT}/{name}"
+    return f"""echo 1 > {cgroup}/cgroup.kill 2>/dev/null || pkill -KILL -u {name} || true
+for _ in $(seq 50); do [ -s {cgroup}/cgroup.procs ] || break; sleep 0.1; done
+set -e
+rmdir {cgroup}
+umount {home}
+rmdir {home}
+userdel {name}
+echo tenant-reset"""
+
+
+def tenant_command(name: str, command: str, timeout: float) -> str:
+    """join the tenant's cgroup as root, then drop to its user in its home with
+    a clean environment; the kill timer runs inside so it hits the tenant's
+    processes rather than sudo"""
+    home = f"{TENANT_ROOT}/{name}"
+    inner = (
+        f"echo $$ > {CGROUP_ROOT}/{name}/cgroup.procs && cd {home} && "
+        f"exec runuser -u {name} -- env -i HOME={home} USER={name} "
+        f"PATH=/usr/local/bin:/usr/bin:/bin {remote_command(command, timeout)}"
+    )
+    return f"sudo sh -c {shlex.quote(inner)}"
+
+
+def as_root(script: str) -> str:
+    return f"sudo sh -c {shlex.quote(script)}"
+
+
+class Tenant:
+    """one episode's slice of a shared host: same bash interface as Sandbox,
+    but commands run as its own user inside its own cgroup"""
+
+    def __init__(self, host: "Host", name: str):
+        self.host = host
+        self.name = name
+        self.readiness: dict[str, float] = {}
+
+    @property
+    def machine_id(self) -> Optional[str]:
+        return self.host.sandbox.machine_id
+
+    async def bash(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> str:
+        return (await self.bash_result(command, timeout, max_bytes))["output"]
+
+    async def bash_result(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> dict:
+        from sandbox import Sandbox
+
+        if timeout is None:
+            timeout = Sandbox.bash_timeout
+        if max_bytes is None:
+            max_bytes = Sandbox.bash_max_bytes
+        output = await self.run_remote(command, timeout, max_bytes)
+        return Sandbox.describe(output, timeout)
+
+    async def run_remote(self, command: str, timeout: float, max_bytes: int) -> Output:
+        # the host's own kill timer gets a little slack so the tenant's fires first
+        start = monotonic()
+        output = await self.host.sandbox.run_remote(
+            tenant_command(self.name, command, timeout), timeout + 2, max_bytes
+        )
+        if output.exit_code == KILLED and monotonic() - start >= timeout:
+            output.timed_out = True
+        return output
+
+
+class Host:
+    """a bigger remote sandbox shared by up to `capacity` tenants"""
+
+    def __init__(self, sandbox, capacity: int):
+        self.sandbox = sandbox
+        self.capacity = capacity
+        self.tenants: set[str] = set()
+        self.reserved = 0
+        self.ready: Optional[asyncio.Task] = None
+        self.healthy = True
+
+    def load(self) -> int:
+        return len(self.tenants) + self.reserved
+
+    def has_room(self) -> bool:
+        return self.healthy and self.load() < self.capacity
+
+
+class TenantPool:
+    """packs episodes onto shared hosts, each episode getting its own unix user,
+    tmpfs home and cgroup cpu / memory / pids limits, so machine count follows
+    total load instead of the number of concurrent rollouts. drop-in for
+    SandboxPool: acquire() hands out a Tenant, release() tears it down"""
+
+    def __init__(
+        self,
+        tenants_per_host: int = 8,
+        max_age: float = 3600,
+        api=None,
+        teardown: Optional[TeardownQueue] = None,
+        host_memory_mb: int = 4096,
+        host_cpus: int = 4,
+        tenant_cpus: float = 0.5,
+        tenant_memory_mb: int = 512,
+        tenant_pids: int = 128,
+        tenant_workspace_mb: int = 256,
+        **sandbox_options,
+    ):
+        self.tenants_per_host = tenants_per_host
+        self.max_age = max_age
+        self.api = api
+        self.teardown = teardown if teardown is not None else TeardownQueue()
+        self.host_options = {
+            "memory_mb": host_memory_mb,
+            "cpus": host_cpus,
+            "volume_size_gb": 0,
+            **sandbox_options,
+        }
+        self.limits = {
+            "cpus": tenant_cpus,
+            "memory_mb": tenant_memory_mb,
+            "pids": tenant_pids,
+            "workspace_mb": tenant_workspace_mb,
+        }
+        self.hosts: list[Host] = []
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+
+    def new_host(self) -> Host:
+        from sandbox import Sandbox
+
+        host = Host(Sandbox(api=self.api, **self.host_options), self.tenants_per_host)
+        host.ready = asyncio.ensure_future(host.sandbox.create())
+        self.hosts.append(host)
+        return host
+
+    def expired(self, host: Host) -> bool:
+        return monotonic() - host.sandbox.created_at >= self.max_age
+
+    def place(self) -> Host:
+        """fullest host with room, so the others drain and can be retired"""
+        candidates = [h for h in self.hosts if h.has_room() and not self.expired(h)]
+        if candidates:
+            self.hits += 1
+            return max(candidates, key=Host.load)
+        self.misses += 1
+        return self.new_host()
+
+    async def acquire(self) -> Tenant:
+        if self.closed:
+            raise RuntimeError("tenant pool is closed")
+
+        # the slot is claimed before any await so concurrent acquires spread out
+        host = self.place()
+        host.reserved += 1
+        start = monotonic()
+        name = f"ep_{xxhash.xxh64(str(uuid4()).encode()).hexdigest()[:8]}"
+        try:
+            await asyncio.shield(host.ready)
+            output = await host.sandbox.bash(as_root(setup_script(name, **self.limits)))
+        except BaseException:
+            host.reserved -= 1
+            self.drop_if_broken(host)
+            raise
+        host.reserved -= 1
+        if "tenant-ready" not in output:
+            host.healthy = False
+            self.drop_if_broken(host)
+            raise RuntimeError(
+                f"tenant setup failed on {host.sandbox.machine_id}: {output}"
+            )
+
+        host.tenants.add(name)
+        tenant = Tenant(host, name)
+        tenant.readiness = {
+            **host.sandbox.readiness,
+            "tenant_s": monotonic() - start,
+        }
+        return tenant
+
+    async def release(self, tenant: Tenant):
+        """tear the tenant down; a host that can't clean up takes no more
+        tenants and is destroyed once its last one leaves"""
+        host = tenant.host
+        try:
+            output = await host.sandbox.bash(as_root(teardown_script(tenant.name)))
+        except Exception:
+            output = ""
+        if "tenant-reset" not in output:
+            host.healthy = False
+        host.tenants.discard(tenant.name)
+
+        if host.load() == 0 and self.idle(host):
+            self.retire(host)
+
+    def idle(self, host: Host) -> bool:
+        """an empty host goes unless it's the one spare kept warm"""
+        if self.closed or not host.healthy or self.expired(host):
+            return True
+        return any(h is not host and h.load() == 0 for h in self.hosts)
+
+    def drop_if_broken(self, host: Host):
+        if host.ready.done() and (host.ready.cancelled() or host.ready.exception()):
+            host.healthy = False
+        if not host.healthy and host.load() == 0:
+            self.retire(host)
+
+    def retire(self, host: Host):
+        if host in self.hosts:
+            self.hosts.remove(host)
+            self.recycled += 1
+            self.teardown.submit(host.sandbox)
+
+    async def close(self):
+        self.closed = True
+        for host in list(self.hosts):
+            for ready in local_tasks([host.ready]):
+                ready.cancel()
+                await asyncio.gather(ready, return_exceptions=True)
+            if host.load() == 0:
+                self.retire(host)
+        await self.teardown.drain()
+
+    def stats(self) -> dict:
+        return {
+            "hosts": len(self.hosts),
+            "tenants": sum(len(h.tenants) for h in self.hosts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "recycled": self.recycled,
+        }
@@ -0,0 +1,121 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from os import environ
+from threading import Lock
+from time import perf_counter
+from typing import Hashable, Optional
+
+enabled: bool = environ.get("SANDBOX_TIMINGS", "0") == "1"
+
+# whose sandbox calls these are; asyncio tasks and to_thread copy it along
+rollout: ContextVar[Optional[Hashable]] = ContextVar("rollout", default=None)
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+class Histogram:
+    """log2 buckets over microseconds, cheap enough for every sandbox call"""
+
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram"):
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """upper bound of the bucket holding the q-th quantile, in seconds"""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q * self.count:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "p50_ms": self.percentile(0.5) * 1e3,
+            "p90_ms": self.percentile(0.9) * 1e3,
+            "p99_ms": self.percentile(0.99) * 1e3,
+            "max_ms": self.max * 1e3,
+        }
+
+
+class Timings:
+    """per-phase histograms for the whole process and for each rollout"""
+
+    def __init__(self):
+        self.process: dict[str, Histogram] = {}
+        self.rollouts: dict[Hashable, dict[str, Histogram]] = {}
+        self.lock = Lock()
+
+    def record(self, phase: str, seconds: float):
+        if not enabled:
+            return
+        owner = rollout.get()
+        with self.lock:
+            self.process.setdefault(phase, Histogram()).add(seconds)
+            if owner is not None:
+                phases = self.rollouts.setdefault(owner, {})
+                phases.setdefault(phase, Histogram()).add(seconds)
+
+    def adopt(self, old: Hashable, new: Hashable):
+        """move timings recorded under a provisional key to the real rollout id"""
+        with self.lock:
+            phases = self.rollouts.pop(old, {})
+            target = self.rollouts.setdefault(new, {})
+            for phase, histogram in phases.items():
+                target.setdefault(phase, Histogram()).merge(histogram)
+
+    def summary(self, owner: Optional[Hashable] = None) -> dict:
+        with self.lock:
+            phases = self.process if owner is None else self.rollouts.get(owner, {})
+            return {phase: h.summary() for phase, h in sorted(phases.items())}
+
+    def pop(self, owner: Hashable) -> dict:
+        """summary for a finished rollout, dropping its histograms"""
+        summary = self.summary(owner)
+        with self.lock:
+            self.rollouts.pop(owner, None)
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.process.clear()
+            self.rollouts.clear()
+
+
+timings = Timings()
+
+
+@contextmanager
+def _measure(name: str):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(name, perf_counter() - start)
+
+
+def phase(name: str):
+    """time a block into `name`, a no-op unless timings are enabled"""
+    return _measure(name) if enabled else nullcontext()
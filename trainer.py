@@ -44,7 +44,12 @@ def train(config_path: str = "configs/unboxer.toml") -> dict:
         rl_config.run_name = environ["TRAIN_COMMIT"]
 
     trainer = vf.RLTrainer(model=model, env=env, args=rl_config)
-    trainer.train()
+    try:
+        trainer.train()
+    finally:
+        # commit queued rollout writes and give back the machines
+        if hasattr(env, "close"):
+            asyncio.run(env.close())
 
     if "HF_TOKEN" in environ:
         hf_token = environ["HF_TOKEN"]
@@ -0,0 +1,77 @@
+import json
+from typing import Optional
+import zstandard
+
+# "zstd" keeps the whole trajectory compressed plus the inline summary,
+# "summary" keeps only the summary, "jsonb" is the old uncompressed column
+STORAGE_MODES = ("zstd", "summary", "jsonb")
+LEVEL = 3
+
+_compressor = zstandard.ZstdCompressor(level=LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode(trajectory: list) -> bytes:
+    return _compressor.compress(json.dumps(trajectory, separators=(",", ":")).encode())
+
+
+def decode(blob: bytes) -> list:
+    return json.loads(_decompressor.decompress(blob))
+
+
+def usage(responses: list) -> Optional[dict]:
+    """token counts from the chat completions behind a trajectory, the last
+    prompt being the longest context the model saw"""
+    counted = [r.usage for r in responses if getattr(r, "usage", None) is not None]
+    if not counted:
+        return None
+    return {
+        "prompt_tokens": counted[-1].prompt_tokens,
+        "completion_tokens": sum(u.completion_tokens for u in counted),
+    }
+
+
+def summarize(trajectory: list, tokens: Optional[dict] = None) -> dict:
+    """what's worth querying without the messages: sizes and which tools ran"""
+    roles: dict[str, int] = {}
+    tool_calls: dict[str, int] = {}
+    chars = 0
+    for message in trajectory:
+        roles[message.get("role", "?")] = roles.get(message.get("role", "?"), 0) + 1
+        chars += len(message.get("content") or "")
+        for call in message.get("tool_calls") or []:
+            name = call.get("function", {}).get("name", "?")
+            tool_calls[name] = tool_calls.get(name, 0) + 1
+    return {
+        "messages": len(trajectory),
+        "roles": roles,
+        "content_chars": chars,
+        "tool_calls": tool_calls,
+        "tokens": tokens,
+    }
+
+
+class Trajectory:
+    """a stored trajectory as read back: the summary is at hand, the
+    messages are only decompressed the first time they're asked for"""
+
+    def __init__(
+        self,
+        summary: Optional[dict],
+        blob: Optional[bytes] = None,
+        messages: Optional[list] = None,
+    ):
+        self.summary = summary
+        self.blob = blob
+        self._messages = messages
+
+    @property
+    def stored(self) -> bool:
+        return self._messages is not None or self.blob is not None
+
+    @property
+    def messages(self) -> Optional[list]:
+        """None when only the summary was kept"""
+        if self._messages is None and self.blob is not None:
+            self._messages = decode(self.blob)
+        return self._messages
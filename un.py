@@ -14,9 +14,29 @@ def cli():
 
 
 @cli.command()
-def build():
+@click.option(
+    "--local",
+    type=click.Choice(["docker", "podman"]),
+    help="build the image for the local container backend instead",
+)
+def build(local):
     """build and push unboxer sandbox image to fly.io"""
     script_dir = Path(__file__).parent
+    host_key = script_dir / "unboxer_ssh_host"
+    if not host_key.exists():
+        # the sshd host key ssh.py pins; kept out of git like unboxer_ssh
+        run(
+            ["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", str(host_key)],
+            check=True,
+        )
+    if local:
+        run(
+            [local, "build", "-t", "unboxer-sandbox", "-f", "sandbox.Dockerfile", "."],
+            cwd=script_dir,
+            check=True,
+        )
+        return
+
     build_script = script_dir / "sandbox.sh"
 
     run(["bash", str(build_script)], cwd=script_dir, check=True)
@@ -72,6 +92,77 @@ def sonnet():
     )
 
 
+@cli.command()
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(["oneshot", "pool", "fast", "vectorized", "cache", "bulk"]),
+    help="backends to run, all by default",
+)
+@click.option("--repeat", default=20, help="runs per scenario")
+@click.option("--seed", default=0, help="input sampling seed")
+@click.option("--out", type=click.Path(), help="write the json report here")
+@click.option(
+    "--baseline", type=click.Path(exists=True), help="report to compare p50s against"
+)
+def bench(backends, repeat, seed, out, baseline):
+    """benchmark the local sandbox offline and emit json"""
+    import json
+    import bench as sandbox_bench
+
+    report = sandbox_bench.run_suite(list(backends), repeat=repeat, seed=seed)
+    if baseline:
+        report["comparison"] = sandbox_bench.compare(
+            json.loads(Path(baseline).read_text()), report
+        )
+
+    text = json.dumps(report, indent=2)
+    if out:
+        Path(out).write_text(text + "\n")
+        for r in report.get("comparison", []):
+            click.echo(f"{r['backend']:>10} {r['scenario']:<28} {r['ratio']:.2f}x")
+    else:
+        click.echo(text)
+
+
+@cli.command()
+@click.option(
+    "--min-age", default=2 * 3600.0, help="only reap resources older than this, seconds"
+)
+@click.option("--dry-run", is_flag=True, help="list what would be deleted")
+def reap(min_age, dry_run):
+    """delete orphaned sandbox machines and volumes on fly.io"""
+    import asyncio
+    import json
+    from machines import MachinesAPI, Reaper
+
+    report = asyncio.run(Reaper(MachinesAPI(), min_age=min_age).reap(dry_run=dry_run))
+    click.echo(json.dumps(report, indent=2))
+
+
+@cli.command()
+@click.option("--keep", default=2, help="newest runs to leave in place")
+@click.option("--run", "runs", type=int, multiple=True, help="archive only these runs")
+@click.option(
+    "--out", default="archive", type=click.Path(), help="directory for .csv.zst files"
+)
+@click.option("--dry-run", is_flag=True, help="list which runs would be archived")
+def archive(keep, runs, out, dry_run):
+    """detach old train_run partitions and archive them as zstd-compressed csv"""
+    import asyncio
+    import json
+    from db import RolloutsDB
+
+    async def go():
+        async with RolloutsDB() as db:
+            return await db.archive_runs(
+                Path(out), keep=keep, runs=list(runs) or None, dry_run=dry_run
+            )
+
+    click.echo(json.dumps(asyncio.run(go()), indent=2))
+
+
 @cli.command()
 def setup():
     """create modal volume for training (run once)"""
@@ -118,7 +209,9 @@ def train():
     )
 
     if "TRAIN_COMMIT=" not in env_text:
-        env_text_updated = env_text_updated.rstrip() + f"\nTRAIN_COMMIT={commit_6_chars}\n"
+        env_text_updated = (
+            env_text_updated.rstrip() + f"\nTRAIN_COMMIT={commit_6_chars}\n"
+        )
 
     env_file.write_text(env_text_updated)
 
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import asyncio
+import pytest
+from openai.types.chat import ChatCompletion
+from localdb import LocalRolloutsDB
+from unboxer import load_environment
+import timing
+
+
+class FakeMachine:
+    machine_id = "fake-machine"
+    readiness = {}
+
+
+class FakePool:
+    def __init__(self):
+        self.released = []
+
+    async def acquire(self):
+        return FakeMachine()
+
+    async def release(self, sandbox):
+        self.released.append(sandbox)
+
+    async def close(self):
+        pass
+
+
+def make_env(tmp_path, monkeypatch, **kwargs):
+    """env on a local db with a fake machine pool and a canned blackbox"""
+    monkeypatch.delenv("POSTGRES", raising=False)
+    env = load_environment(
+        use_remote=False, db_path=str(tmp_path / "unboxer.db"), **kwargs
+    )
+    env.machine_pool = FakePool()
+
+    async def generate_blackbox_fn(complexity, client=None):
+        return (
+            "def blackbox(x: float) -> float:\n    return x + 2",
+            {},
+            {},
+            [{"input": {"x": 1.0}, "output": 3.0}],
+            {"n_plus_one_input": {"x": 2.0}, "n_plus_one_output": 4.0},
+        )
+
+    monkeypatch.setattr(env, "generate_blackbox_fn", generate_blackbox_fn)
+    return env
+
+
+def reply(content: str) -> ChatCompletion:
+    return ChatCompletion(
+        id="reply",
+        created=0,
+        model="test",
+        object="chat.completion",
+        choices=[
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+    )
+
+
+@pytest.mark.asyncio
+async def test_episode_finishes_without_submit(tmp_path, monkeypatch):
+    """an episode that runs out of turns without a tool call still records
+    its trajectory and hands its machine back"""
+    monkeypatch.setattr(timing, "enabled", True)
+    env = make_env(tmp_path, monkeypatch, max_turns=2)
+
+    async def get_model_response(*args, **kwargs):
+        return reply("thinking")
+
+    monkeypatch.setattr(env, "get_model_response", get_model_response)
+    try:
+        completion, state = await env.rollout(
+            client=None, model="test", prompt=[{"role": "user", "content": "go"}]
+        )
+        assert state["finished"]
+        assert len(env.machine_pool.released) == 1
+        assert state["rollout_id"] not in timing.timings.rollouts
+        assert state["rollout_id"] not in env.db.seqs
+        stored = await env.db.get_trajectory(state["rollout_id"])
+        assert stored.summary["messages"] == len(completion) == 2
+    finally:
+        await env.close()
+
+
+@pytest.mark.asyncio
+async def test_episode_end_survives_dropped_writes(tmp_path, monkeypatch):
+    """a batch the recorder gives up on is counted, not raised into the
+    episode, and the machine is released either way"""
+    env = make_env(tmp_path, monkeypatch, max_turns=2)
+    await env.ensure_db()
+    env.recorder.max_retries = 0
+
+    async def broken(rows):
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(env.db, "update_trajectories", broken)
+    state = {"rollout_id": 1, "completion": [], "sandbox": FakeMachine()}
+    try:
+        await env.finish_episode(state)
+        await env.finish_episode(state)
+        assert env.recorder.stats()["dropped"] == 1
+        assert len(env.machine_pool.released) == 1
+    finally:
+        await env.close()
+
+
+def test_env_closes_on_another_loop(tmp_path, monkeypatch):
+    """the trainer closes the env after its generation loop is gone, and the
+    writes still queued then must land"""
+    env = make_env(tmp_path, monkeypatch)
+
+    async def generate():
+        await env.ensure_db()
+        rollout_id = await env.recorder.add_rollout(0, "r", "bb", train_run=1)
+        await env.recorder.update_reward(rollout_id, 1.0)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(generate())
+    loop.close()
+
+    asyncio.run(env.close())
+
+    async def window():
+        async with LocalRolloutsDB(tmp_path / "unboxer.db") as db:
+            return await db.get_rollout_window(5)
+
+    assert asyncio.run(window()) == [{"blackbox": "bb", "mean_reward": 1.0}]
+
+
+def tool_call(call_id: str, name: str) -> dict:
+    return {"id": call_id, "function": {"name": name, "arguments": "{}"}}
+
+
+@pytest.mark.asyncio
+async def test_env_response_keeps_call_order(tmp_path, monkeypatch):
+    """tools run concurrently but answer in call order, bash calls run one
+    after another, nothing after a submit starts before it finishes, and
+    calls past the end of the budget never run"""
+    env = make_env(tmp_path, monkeypatch)
+    await env.ensure_db()
+    delays = {"a": 0.05, "b": 0.04, "c": 0.0, "d": 0.0, "s": 0.01, "e": 0.0}
+    events = []
+
+    async def run(call):
+        events.append(("start", call["id"]))
+        await asyncio.sleep(delays[call["id"]])
+        events.append(("end", call["id"]))
+
+    async def eval_tool(call):
+        await run(call)
+        return "fn", [], []
+
+    async def bash_tool(call, state, after=None):
+        if after is not None:
+            await asyncio.wait([after])
+        await run(call)
+        return "ok"
+
+    async def submit_tool(call, state):
+        await run(call)
+        return "✗ incorrect"
+
+    monkeypatch.setattr(env, "eval_tool", eval_tool)
+    monkeypatch.setattr(env, "bash_tool", bash_tool)
+    monkeypatch.setattr(env, "submit_tool", submit_tool)
+
+    calls = [
+        tool_call("a", "eval"),
+        tool_call("b", "bash"),
+        tool_call("c", "bash"),
+        tool_call("d", "eval"),
+        tool_call("s", "submit"),
+        tool_call("e", "eval"),
+        tool_call("f", "eval"),
+    ]
+    state = {"budget": 6, "rollout_id": 1, "sandbox": None}
+    try:
+        responses, state = await env.env_response(
+            [{"role": "assistant", "content": "", "tool_calls": calls}], state
+        )
+
+        assert [r["tool_call_id"] for r in responses] == list("abcdse")
+        assert state["budget"] == 0
+        assert ("start", "f") not in events
+        # later calls finished first, yet answered in order
+        assert events.index(("end", "d")) < events.index(("end", "a"))
+        assert events.index(("end", "b")) < events.index(("start", "c"))
+        for before in "abcd":
+            assert events.index(("end", before)) < events.index(("start", "s"))
+        assert events.index(("end", "s")) < events.index(("start", "e"))
+    finally:
+        await env.close()
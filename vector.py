@@ -0,0 +1,407 @@
+import ast
+from typing import Callable
+from result import Result, Ok, Err
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# rows whose intermediates leave this range can't be trusted to match python's
+# exact int / error semantics, they get re-run on the scalar sandbox instead
+EXACT = 2.0**53
+
+BINOPS = {
+    ast.Add: lambda a, b: np.add(a, b),
+    ast.Sub: lambda a, b: np.subtract(a, b),
+    ast.Mult: lambda a, b: np.multiply(a, b),
+    ast.Div: lambda a, b: np.true_divide(a, b),
+    ast.FloorDiv: lambda a, b: np.floor_divide(a, b),
+    ast.Mod: lambda a, b: np.mod(a, b),
+    ast.Pow: lambda a, b: np.power(a, b),
+}
+
+COMPARES = {
+    ast.Eq: lambda a, b: np.equal(a, b),
+    ast.NotEq: lambda a, b: np.not_equal(a, b),
+    ast.Lt: lambda a, b: np.less(a, b),
+    ast.LtE: lambda a, b: np.less_equal(a, b),
+    ast.Gt: lambda a, b: np.greater(a, b),
+    ast.GtE: lambda a, b: np.greater_equal(a, b),
+}
+
+# math / builtin name -> (numpy implementation, allowed arg counts)
+FUNCTIONS = {
+    "sin": ("sin", {1}),
+    "cos": ("cos", {1}),
+    "tan": ("tan", {1}),
+    "asin": ("arcsin", {1}),
+    "acos": ("arccos", {1}),
+    "atan": ("arctan", {1}),
+    "atan2": ("arctan2", {2}),
+    "sinh": ("sinh", {1}),
+    "cosh": ("cosh", {1}),
+    "tanh": ("tanh", {1}),
+    "asinh": ("arcsinh", {1}),
+    "acosh": ("arccosh", {1}),
+    "atanh": ("arctanh", {1}),
+    "exp": ("exp", {1}),
+    "exp2": ("exp2", {1}),
+    "expm1": ("expm1", {1}),
+    "log2": ("log2", {1}),
+    "log10": ("log10", {1}),
+    "log1p": ("log1p", {1}),
+    "sqrt": ("sqrt", {1}),
+    "cbrt": ("cbrt", {1}),
+    "fabs": ("fabs", {1}),
+    "abs": ("abs", {1}),
+    "floor": ("floor", {1}),
+    "ceil": ("ceil", {1}),
+    "trunc": ("trunc", {1}),
+    "int": ("trunc", {1}),
+    "round": ("rint", {1}),
+    "hypot": ("hypot", {2}),
+    "degrees": ("degrees", {1}),
+    "radians": ("radians", {1}),
+    "copysign": ("copysign", {2}),
+    "fmod": ("fmod", {2}),
+    "pow": ("power", {2}),
+}
+
+CONSTANTS = {"pi", "e", "tau", "inf", "nan"}
+
+# the python type each row's result would have, tracked alongside the float64
+# values as an index into KINDS so results can be cast back per element
+BOOL, INT, FLOAT = range(3)
+KINDS = (bool, int, float)
+
+# math functions that return an int rather than a float
+INTEGRAL = {"floor", "ceil", "trunc", "int", "round"}
+
+Node = Callable[[dict], tuple]
+
+
+class Unsupported(Exception):
+    pass
+
+
+def number(x):
+    """bools do arithmetic as ints in python but as logic in numpy, and int
+    arrays refuse negative powers, so everything numeric runs as float64"""
+    return np.asarray(x, dtype=np.float64)
+
+
+def truthy(x):
+    return x != 0
+
+
+def checked(value):
+    return value, ~np.isfinite(value) | (np.abs(value) > EXACT)
+
+
+def arithmetic(*kinds):
+    """bool operands do int arithmetic, a float anywhere makes a float"""
+    kind = np.asarray(INT)
+    for k in kinds:
+        kind = np.maximum(kind, k)
+    return kind
+
+
+class Translator:
+    """turns a math-only `def blackbox` into a numpy closure over columns"""
+
+    def __init__(self, fn: str):
+        tree = ast.parse(fn)
+        if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+            raise Unsupported("expected a single function definition")
+
+        func = tree.body[0]
+        args = func.args
+        if (
+            args.posonlyargs
+            or args.vararg
+            or args.kwonlyargs
+            or args.kwarg
+            or args.defaults
+            or func.decorator_list
+        ):
+            raise Unsupported("only plain positional arguments are supported")
+
+        self.args = [a.arg for a in args.args]
+        self.locals = set(self.args)
+        self.body = self.block(func.body)
+
+    def block(self, body: list) -> Callable[[dict], tuple]:
+        steps = []
+        for i, stmt in enumerate(body):
+            if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant):
+                continue
+            if isinstance(stmt, ast.Return) and i == len(body) - 1:
+                if stmt.value is None:
+                    raise Unsupported("function must return a value")
+                ret = self.expr(stmt.value)
+                break
+            if isinstance(stmt, ast.Assign) and all(
+                isinstance(t, ast.Name) for t in stmt.targets
+            ):
+                names = [t.id for t in stmt.targets]
+                steps.append((names, self.expr(stmt.value)))
+                self.locals.update(names)
+                continue
+            if isinstance(stmt, ast.AugAssign) and isinstance(stmt.target, ast.Name):
+                name = stmt.target.id
+                if name not in self.locals:
+                    raise Unsupported(f"unbound name {name}")
+                value = ast.BinOp(ast.Name(name, ast.Load()), stmt.op, stmt.value)
+                steps.append(([name], self.expr(value)))
+                continue
+            raise Unsupported(f"unsupported statement {type(stmt).__name__}")
+        else:
+            raise Unsupported("function must end with a return")
+
+        def run(env: dict) -> tuple:
+            for names, node in steps:
+                value = node(env)
+                for name in names:
+                    env[name] = value
+            return ret(env)
+
+        return run
+
+    def expr(self, node: ast.expr) -> Node:
+        match node:
+            case ast.Constant(value=value) if type(value) in KINDS:
+                kind = np.asarray(KINDS.index(type(value)))
+                return lambda env: (np.asarray(value), np.asarray(False), kind)
+            case ast.Name(id=name) if name in self.locals:
+                return lambda env: env[name]
+            case ast.Name(id=name) if name in CONSTANTS:
+                value = float(getattr(np, name))
+                return lambda env: (
+                    np.asarray(value),
+                    np.asarray(False),
+                    np.asarray(FLOAT),
+                )
+            case ast.BinOp(op=op) if type(op) in BINOPS:
+                return self.binop(node)
+            case ast.UnaryOp():
+                return self.unaryop(node)
+            case ast.Compare():
+                return self.compare(node)
+            case ast.BoolOp():
+                return self.boolop(node)
+            case ast.IfExp():
+                return self.ifexp(node)
+            case ast.Call(func=ast.Name(id=name), keywords=[]):
+                return self.call(name, node.args)
+        raise Unsupported(f"unsupported expression {ast.dump(node)[:60]}")
+
+    def binop(self, node: ast.BinOp) -> Node:
+        left, right = self.expr(node.left), self.expr(node.right)
+        op = BINOPS[type(node.op)]
+        divides = isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod))
+        operator = type(node.op)
+
+        def run(env: dict) -> tuple:
+            (a, abad, akind), (b, bbad, bkind) = left(env), right(env)
+            a, b = number(a), number(b)
+            value, bad = checked(op(a, b))
+            bad = bad | abad | bbad
+            if divides:
+                bad = bad | (b == 0)
+            kind = arithmetic(akind, bkind)
+            if operator is ast.Div:
+                kind = np.asarray(FLOAT)
+            elif operator is ast.Pow:
+                # an int to a negative int power is a float
+                kind = np.where((kind == INT) & (b < 0), FLOAT, kind)
+            return value, bad, kind
+
+        return run
+
+    def unaryop(self, node: ast.UnaryOp) -> Node:
+        operand = self.expr(node.operand)
+        if not isinstance(node.op, (ast.USub, ast.UAdd, ast.Not)):
+            raise Unsupported(f"unsupported unary op {type(node.op).__name__}")
+        op = node.op
+
+        def run(env: dict) -> tuple:
+            value, bad, kind = operand(env)
+            match op:
+                case ast.USub():
+                    return -number(value), bad, arithmetic(kind)
+                case ast.UAdd():
+                    return number(value), bad, arithmetic(kind)
+            return ~truthy(value), bad, np.asarray(BOOL)
+
+        return run
+
+    def compare(self, node: ast.Compare) -> Node:
+        if not all(type(op) in COMPARES for op in node.ops):
+            raise Unsupported("unsupported comparison")
+        left = self.expr(node.left)
+        pairs = [
+            (COMPARES[type(op)], self.expr(c))
+            for op, c in zip(node.ops, node.comparators)
+        ]
+
+        def run(env: dict) -> tuple:
+            a, bad, _ = left(env)
+            active = np.asarray(True)
+            for op, right in pairs:
+                b, bbad, _ = right(env)
+                bad = bad | (active & bbad)
+                active = active & op(a, b)
+                a = b
+            return active, bad, np.asarray(BOOL)
+
+        return run
+
+    def boolop(self, node: ast.BoolOp) -> Node:
+        values = [self.expr(v) for v in node.values]
+        stops_on = isinstance(node.op, ast.Or)
+
+        def run(env: dict) -> tuple:
+            value, bad, kind = values[0](env)
+            active = truthy(value) != stops_on
+            for operand in values[1:]:
+                v, vbad, vkind = operand(env)
+                value = np.where(active, v, value)
+                kind = np.where(active, vkind, kind)
+                bad = bad | (active & vbad)
+                active = active & (truthy(v) != stops_on)
+            return value, bad, kind
+
+        return run
+
+    def ifexp(self, node: ast.IfExp) -> Node:
+        test, body, orelse = (
+            self.expr(node.test),
+            self.expr(node.body),
+            self.expr(node.orelse),
+        )
+
+        def run(env: dict) -> tuple:
+            t, tbad, _ = test(env)
+            (b, bbad, bkind), (o, obad, okind) = body(env), orelse(env)
+            taken = truthy(t)
+            value = np.where(taken, b, o)
+            bad = tbad | (taken & bbad) | (~taken & obad)
+            return value, bad, np.where(taken, bkind, okind)
+
+        return run
+
+    def call(self, name: str, args: list) -> Node:
+        if name in self.locals:
+            raise Unsupported(f"call to local name {name}")
+        operands = [self.expr(a) for a in args]
+
+        if name in ("min", "max"):
+            if len(operands) < 2:
+                raise Unsupported(f"{name} needs at least two scalar arguments")
+            ufunc = np.minimum if name == "min" else np.maximum
+        elif name in ("float", "bool", "log"):
+            if len(operands) not in ((1, 2) if name == "log" else (1,)):
+                raise Unsupported(f"wrong number of arguments to {name}")
+            ufunc = None
+        elif name in FUNCTIONS:
+            implementation, arities = FUNCTIONS[name]
+            if len(operands) not in arities:
+                raise Unsupported(f"wrong number of arguments to {name}")
+            ufunc = getattr(np, implementation)
+        else:
+            raise Unsupported(f"unsupported function {name}")
+
+        def run(env: dict) -> tuple:
+            evaluated = [operand(env) for operand in operands]
+            values = [number(v) for v, _, _ in evaluated]
+            kinds = [kind for _, _, kind in evaluated]
+            bad = np.asarray(False)
+            for _, vbad, _ in evaluated:
+                bad = bad | vbad
+
+            kind = np.asarray(FLOAT)
+            match name:
+                case "float":
+                    return values[0], bad, kind
+                case "bool":
+                    return truthy(values[0]), bad, np.asarray(BOOL)
+                case "log" if len(values) == 2:
+                    # math.log raises on a base <= 0 (domain) or 1 (division),
+                    # so those rows go to the scalar path for its error
+                    base = np.log(values[1])
+                    bad = bad | (values[1] <= 0) | ~np.isfinite(base) | (base == 0)
+                    value = np.log(values[0]) / base
+                case "log":
+                    value = np.log(values[0])
+                case "min" | "max":
+                    # python keeps the first of equal candidates, and its type
+                    value, kind = values[0], kinds[0]
+                    for v, vkind in zip(values[1:], kinds[1:]):
+                        wins = v < value if name == "min" else v > value
+                        value, kind = ufunc(value, v), np.where(wins, vkind, kind)
+                case "abs":
+                    value, kind = ufunc(*values), arithmetic(kinds[0])
+                case _ if name in INTEGRAL:
+                    value, kind = ufunc(*values), np.asarray(INT)
+                case _:
+                    value = ufunc(*values)
+
+            value, vbad = checked(value)
+            return value, bad | vbad, kind
+
+        return run
+
+
+class Vectorized:
+    def __init__(self, fn: str):
+        self.translator = Translator(fn)
+        self.args = self.translator.args
+
+    def __call__(self, columns: dict, n: int) -> tuple:
+        """evaluate every row at once, returns (values, indices into KINDS of
+        the type python would return, rows to re-check on the scalar path)"""
+        env = {}
+        bad = np.zeros(n, dtype=bool)
+        for name in self.args:
+            column = np.asarray(columns[name], dtype=np.float64)
+            kind = np.array([KINDS.index(type(v)) for v in columns[name]])
+            env[name] = (column, np.asarray(False), kind)
+            bad = bad | ~np.isfinite(column) | (np.abs(column) > EXACT)
+
+        with np.errstate(all="ignore"):
+            value, vbad, kind = self.translator.body(env)
+
+        value = np.broadcast_to(value, (n,))
+        kind = np.broadcast_to(kind, (n,))
+        bad = bad | np.broadcast_to(vbad, (n,))
+        return value, kind, bad
+
+
+def compile(fn: str) -> Result[Vectorized, str]:
+    """vectorize fn if it only uses math the numpy backend can mirror"""
+    if np is None:
+        return Err("numpy is not installed")
+    try:
+        return Ok(Vectorized(fn))
+    except SyntaxError as e:
+        return Err(f"syntax error: {e}")
+    except Unsupported as e:
+        return Err(str(e))
+    except (RecursionError, MemoryError):
+        return Err("too deeply nested to vectorize")
+
+
+def columns(args: list, kwargs_list: list) -> Result[dict, str]:
+    """pivot kwargs dicts into per-argument columns, refusing anything non-numeric"""
+    names = set(args)
+    cols = {name: [] for name in args}
+    for kwargs in kwargs_list:
+        if not isinstance(kwargs, dict) or set(kwargs) != names:
+            return Err("kwargs don't match the function signature")
+        for name in args:
+            value = kwargs[name]
+            if type(value) not in (int, float, bool):
+                return Err(f"non-numeric argument {name}")
+            cols[name].append(value)
+    return Ok(cols)
@@ -0,0 +1,219 @@
+import atexit
+import mmap
+import os
+import tempfile
+from array import array
+from json import loads, dumps
+from queue import LifoQueue
+from select import select
+from subprocess import Popen, PIPE, DEVNULL
+from time import monotonic
+from typing import Optional, Sequence
+import timing
+
+# tmpfs where there is one, so bulk buffers never touch disk
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class WorkerError(Exception):
+    def __init__(self, message: str, returncode: Optional[int] = None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class Worker:
+    """long-lived `sandbox.template.py serve` process, one job at a time"""
+
+    def __init__(self, code: str, limits: dict):
+        self.proc = Popen(
+            ["python3", "-c", code, "serve", dumps(limits)],
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=DEVNULL,
+        )
+        self.jobs = 0
+        self.buffer = b""
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def call(self, payload: dict, timeout: float) -> dict:
+        with timing.phase("encode"):
+            request = dumps(payload).encode() + b"\n"
+
+        with timing.phase("roundtrip"):
+            try:
+                self.proc.stdin.write(request)
+                self.proc.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                raise WorkerError(f"worker unavailable: {e}")
+
+            self.jobs += 1
+            line = self.readline(timeout)
+
+        try:
+            with timing.phase("decode"):
+                return loads(line)
+        except ValueError:
+            raise WorkerError(
+                f"json decode failed - stdout: {line.decode(errors='replace')}"
+            )
+
+    def readline(self, timeout: float) -> bytes:
+        fd = self.proc.stdout.fileno()
+        deadline = monotonic() + timeout
+        while b"\n" not in self.buffer:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise WorkerError(f"timed out after {timeout} seconds")
+            ready, _, _ = select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                code = self.proc.wait()
+                raise WorkerError(f"worker exited with code {code}", code)
+            self.buffer += chunk
+
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line
+
+    def kill(self):
+        """pipes are left to gc since a cancelled caller's thread may still read"""
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class BulkBuffer:
+    """float64 input columns plus one output column in a file both the host
+    and the worker mmap, so only its path has to cross the pipe"""
+
+    def __init__(self, n: int, width: int):
+        self.n = n
+        self.width = width
+        size = max(8 * n * (width + 1), 8)
+        self.file = tempfile.NamedTemporaryFile(prefix="sandbox_bulk_", dir=SHM_DIR)
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.view = memoryview(self.map).cast("d")
+
+    @property
+    def path(self) -> str:
+        return self.file.name
+
+    def column(self, i: int) -> memoryview:
+        return self.view[i * self.n : (i + 1) * self.n]
+
+    def write(self, i: int, values: Sequence[float]):
+        """numpy float64 arrays and array("d") copy straight in, anything else is packed first"""
+        try:
+            source = memoryview(values)
+            if source.format != "d" or not source.c_contiguous:
+                raise TypeError
+        except TypeError:
+            source = memoryview(array("d", values))
+        self.column(i)[:] = source
+
+    def output(self) -> array:
+        values = array("d")
+        values.frombytes(self.column(self.width).tobytes())
+        return values
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class WorkerPool:
+    """pool of warm workers, recycled after `max_jobs` jobs or on any failure"""
+
+    def __init__(
+        self,
+        code: str,
+        size: int = 4,
+        max_jobs: int = 100,
+        cpu_seconds: int = 15,
+        memory_mb: int = 512,
+        address_space_mb: int = 1024,
+        call_cpu_seconds: float = 0.25,
+    ):
+        self.code = code
+        self.size = size
+        self.max_jobs = max_jobs
+        self.limits = {
+            "cpu_seconds": cpu_seconds,
+            "max_jobs": max_jobs,
+            "memory_mb": memory_mb,
+            "address_space_mb": address_space_mb,
+            "call_cpu_seconds": call_cpu_seconds,
+        }
+        self.slots: LifoQueue[Optional[Worker]] = LifoQueue()
+        for _ in range(size):
+            self.slots.put(None)
+        self.spawned = 0
+        self.recycled = 0
+        atexit.register(self.close)
+
+    def spawn(self) -> Worker:
+        self.spawned += 1
+        with timing.phase("spawn"):
+            return Worker(self.code, self.limits)
+
+    def acquire(self) -> Worker:
+        """take an idle worker, spawning one if the slot is empty or dead"""
+        with timing.phase("acquire"):
+            worker = self.slots.get()
+        try:
+            if worker is not None and not worker.alive():
+                self.retire(worker)
+                worker = None
+            if worker is None:
+                worker = self.spawn()
+        except Exception:
+            self.slots.put(None)
+            raise
+        return worker
+
+    def release(self, worker: Worker, healthy: bool = True):
+        """return a worker, killing it if its job failed or it hit max_jobs"""
+        if not healthy or worker.jobs >= self.max_jobs:
+            self.retire(worker)
+            self.slots.put(None)
+        else:
+            self.slots.put(worker)
+
+    def run(self, payload: dict, timeout: float = 15) -> dict:
+        """run one job on a warm worker, raises WorkerError on crash or timeout"""
+        worker = self.acquire()
+        healthy = False
+        try:
+            data = worker.call(payload, timeout)
+            healthy = True
+            return data
+        finally:
+            self.release(worker, healthy)
+
+    def retire(self, worker: Worker):
+        self.recycled += 1
+        worker.kill()
+
+    def warm(self):
+        """spawn every worker up front so the first calls don't pay startup"""
+        workers = [self.slots.get() for _ in range(self.size)]
+        for i, worker in enumerate(workers):
+            if worker is None or not worker.alive():
+                workers[i] = self.spawn()
+        for worker in workers:
+            self.slots.put(worker)
+
+    def close(self):
+        """kill idle workers, the pool respawns lazily if used again"""
+        idle = []
+        while not self.slots.empty():
+            idle.append(self.slots.get_nowait())
+        for worker in idle:
+            if worker is not None:
+                worker.kill()
+            self.slots.put(None)